@@ -0,0 +1,106 @@
+"""Пропускная способность SQLite до и после настройки движка (WAL, прагмы, пул).
+
+    python benchmarks/db_bench.py --workers 50 --ops 40
+
+Оба прогона идут на свежем файле БД с одинаковой нагрузкой: параллельные
+обработчики пишут меню (JSON ~20 КБ) и читают случайные ранее записанные.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from database.db import Base, Menu, User, create_engine_for  # noqa: E402
+
+MENU_CONTENT = {"days": [
+    {"day": d, "meals": [
+        {"meal_type": "lunch", "dishes": [
+            {"name": f"Блюдо {d}-{i}", "description": "Описание блюда",
+             "ingredients": [{"name": "Продукт", "amount": 100, "unit": "г"}] * 5}
+            for i in range(3)
+        ]} for _ in range(3)
+    ]} for d in range(1, 8)
+]}
+
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def run(label: str, engine, workers: int, ops: int, write_share: float) -> dict:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with Session() as session:
+        session.add(User(telegram_id=1))
+        await session.commit()
+
+    ids, latencies = [], {"write": [], "read": []}
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for _ in range(ops):
+            kind = "write" if not ids or random.random() < write_share else "read"
+            started = time.perf_counter()
+            try:
+                async with Session() as session:
+                    if kind == "write":
+                        menu = Menu(user_id=1, diet_type="healthy", num_days=7, content=MENU_CONTENT)
+                        session.add(menu)
+                        await session.commit()
+                        ids.append(menu.id)
+                    else:
+                        await session.scalar(select(Menu).where(Menu.id == random.choice(ids)))
+            except Exception:
+                errors += 1
+                continue
+            latencies[kind].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+
+    done = len(latencies["write"]) + len(latencies["read"])
+    return {
+        "label": label,
+        "ops_per_sec": round(done / elapsed),
+        "writes": len(latencies["write"]),
+        "reads": len(latencies["read"]),
+        "write_p95_ms": round(_percentile(latencies["write"], 0.95) * 1000, 1),
+        "read_p95_ms": round(_percentile(latencies["read"], 0.95) * 1000, 1),
+        "errors": errors,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=40)
+    parser.add_argument("--write-share", type=float, default=0.3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = create_async_engine(f"sqlite+aiosqlite:///{tmp}/before.db", echo=False)
+        tuned = create_engine_for(f"sqlite+aiosqlite:///{tmp}/after.db")
+        for label, engine in (("до: по умолчанию", baseline), ("после: WAL + пул", tuned)):
+            result = await run(label, engine, args.workers, args.ops, args.write_share)
+            print(
+                f"{result['label']:<20} {result['ops_per_sec']:>6} оп/с  "
+                f"запись p95 {result['write_p95_ms']:>7} мс  чтение p95 {result['read_p95_ms']:>7} мс  "
+                f"ошибок {result['errors']}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,124 @@
+"""Задержка get/set хранилища FSM: MemoryStorage против DatabaseStorage.
+
+    python benchmarks/fsm_storage_bench.py --users 500 --steps 12 --eaters 50
+
+Каждый пользователь проходит мастер создания меню: на шаге get_state,
+get_data, update_data и set_state, как в handlers/menu_generation.py.
+«БД, тёплый» — состояния уже в памяти процесса, «БД, после перезапуска» —
+новый экземпляр хранилища, первое обращение к пользователю читает строку из
+БД (у «тёплого» это же видно в p95 get: первый шаг нового пользователя
+проверяет БД). Отдельно — сколько записей в БД осталось после склейки по ключу и сколько
+весят данные мастера с большим списком едоков.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+from database.codec import encode_json  # noqa: E402
+from database.db import FSMState, create_engine_for  # noqa: E402
+from database.fsm_storage import DatabaseStorage, pack_rows  # noqa: E402
+
+STATES = ["MenuFSM:diet", "MenuFSM:people_count", "MenuFSM:eaters_info", "MenuFSM:days",
+          "MenuFSM:meals_select", "MenuFSM:meal_times", "MenuFSM:confirm"]
+
+
+def make_eaters(n: int) -> list:
+    return [{"name": f"Человек {i + 1}", "age": 20 + i % 50,
+             "preferences": "без лактозы, не любит рыбу" if i % 3 == 0 else None} for i in range(n)]
+
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def wizard(storage, users: int, steps: int, eaters: list) -> dict:
+    gets, sets = [], []
+    for step in range(steps):
+        for user in range(1, users + 1):
+            key = StorageKey(bot_id=1, chat_id=user, user_id=user)
+            started = time.perf_counter()
+            await storage.get_state(key)
+            data = await storage.get_data(key)
+            gets.append(time.perf_counter() - started)
+
+            patch = {"step": step, "diet": "healthy", "num_people": len(eaters)}
+            if step == 2:
+                patch["eaters"] = eaters
+            started = time.perf_counter()
+            data = await storage.update_data(key, patch)
+            await storage.set_state(key, STATES[step % len(STATES)])
+            sets.append(time.perf_counter() - started)
+        await asyncio.sleep(0)
+    return {"get": gets, "set": sets}
+
+
+def _row(label: str, r: dict, base: dict = None) -> str:
+    def us(values, q):
+        return _percentile(values, q) * 1e6
+
+    line = (
+        f"{label:<24} get p50 {us(r['get'], 0.5):>7.1f} мкс  p95 {us(r['get'], 0.95):>7.1f}  "
+        f"set p50 {us(r['set'], 0.5):>7.1f} мкс  p95 {us(r['set'], 0.95):>7.1f}"
+    )
+    if base:
+        line += (f"   ×{us(r['get'], 0.5) / us(base['get'], 0.5):.1f} / "
+                 f"×{us(r['set'], 0.5) / us(base['set'], 0.5):.1f} к памяти")
+    return line
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--steps", type=int, default=12)
+    parser.add_argument("--eaters", type=int, default=50)
+    args = parser.parse_args()
+    eaters = make_eaters(args.eaters)
+
+    memory = await wizard(MemoryStorage(), args.users, args.steps, eaters)
+    print(_row("память", memory))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine_for(f"sqlite+aiosqlite:///{os.path.join(tmp, 'fsm.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(FSMState.__table__.create)
+        Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+        storage = DatabaseStorage(session_factory=Session)
+        warm = await wizard(storage, args.users, args.steps, eaters)
+        await storage.close()
+        print(_row("БД, тёплый", warm, memory))
+
+        restarted = DatabaseStorage(session_factory=Session)
+        cold = await wizard(restarted, args.users, 1, eaters)
+        await restarted.close()
+        print(_row("БД, после перезапуска", cold, memory) + "  (первое чтение из БД)")
+        await engine.dispose()
+
+    print(
+        f"\nзаписей в хранилище: {storage.stats['writes']}, строк записано в БД: "
+        f"{storage.stats['flushed_rows']} (склейка ×{storage.stats['writes'] / max(1, storage.stats['flushed_rows']):.0f})"
+    )
+    data = {"diet": "healthy", "num_people": len(eaters), "eaters": eaters, "current_eater": len(eaters),
+            "num_days": 7, "meals_config": {"breakfast": "08:00", "lunch": "13:00", "dinner": "19:00"}}
+    def size(value):
+        return len(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode())
+
+    print(
+        f"данные мастера с {len(eaters)} едоками: JSON {size(data)} Б, столбцы {size(pack_rows(data))} Б (Redis), "
+        f"столбцы + сжатие {len(encode_json(pack_rows(data)))} Б (БД)"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
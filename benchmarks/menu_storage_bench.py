@@ -0,0 +1,173 @@
+"""Размер БД и задержка списка меню: JSON-колонки против сжатых отложенных.
+
+    python benchmarks/menu_storage_bench.py --users 200 --menus 5 --days 14
+
+«До» — прежняя схема menus (content и shopping_list — JSON, грузятся всегда,
+без индекса по user_id). «После» — текущая модель Menu. Обе БД заполняются
+одинаковыми меню, затем меряется запрос «Мои меню» (5 последних меню
+пользователя) и загрузка одного меню целиком.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import JSON, Column, DateTime, ForeignKey, Integer, String, select  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+from sqlalchemy.orm import declarative_base, sessionmaker, undefer  # noqa: E402
+from database.db import Base, Menu, User, create_engine_for, menu_summary  # noqa: E402
+
+LegacyBase = declarative_base()
+
+
+class LegacyUser(LegacyBase):
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(Integer, unique=True, nullable=False)
+
+
+class LegacyMenu(LegacyBase):
+    __tablename__ = "menus"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    diet_type = Column(String, nullable=False)
+    num_people = Column(Integer, default=1)
+    num_days = Column(Integer, default=1)
+    content = Column(JSON)
+    shopping_list = Column(JSON, nullable=True)
+    created_at = Column(DateTime)
+
+
+DISHES = ["Омлет с овощами", "Гречневая каша", "Куриный суп", "Салат из свёклы", "Творожная запеканка",
+          "Запечённая рыба", "Овощное рагу", "Плов с курицей", "Сырники", "Тушёная капуста",
+          "Паста с томатами", "Котлеты из индейки", "Чечевичный суп", "Овсянка с ягодами"]
+PRODUCTS = [("Яйцо", "шт"), ("Молоко", "мл"), ("Куриное филе", "г"), ("Гречка", "г"), ("Морковь", "г"),
+            ("Лук репчатый", "г"), ("Творог", "г"), ("Оливковое масло", "мл"), ("Помидоры", "г"),
+            ("Соль", "по вкусу"), ("Рис", "г"), ("Треска", "г"), ("Капуста", "г"), ("Сметана", "г")]
+MEALS = [("breakfast", "Завтрак", "08:00"), ("lunch", "Обед", "13:00"), ("dinner", "Ужин", "19:00")]
+
+
+def make_menu(num_days: int) -> dict:
+    days = []
+    for d in range(1, num_days + 1):
+        meals = []
+        for meal_type, meal_name, time_str in MEALS:
+            dishes = []
+            for _ in range(2):
+                dishes.append({
+                    "name": random.choice(DISHES),
+                    "description": f"Лёгкое блюдо, готовится {random.randint(10, 60)} минут",
+                    "ingredients": [{"name": n, "amount": random.randint(1, 300), "unit": u}
+                                    for n, u in random.sample(PRODUCTS, 5)],
+                    "calories_per_serving": random.randint(150, 700),
+                    "proteins": random.randint(5, 40), "fats": random.randint(3, 30),
+                    "carbs": random.randint(10, 80),
+                })
+            meals.append({"meal_type": meal_type, "meal_name": meal_name, "time": time_str,
+                          "dishes": dishes,
+                          "total_calories": sum(x["calories_per_serving"] for x in dishes)})
+        days.append({"day": d, "date_label": f"День {d}", "meals": meals,
+                     "day_total_calories": sum(m["total_calories"] for m in meals)})
+    return {"days": days}
+
+
+def make_shopping_list() -> dict:
+    items = [{"name": n, "total_amount": str(random.randint(1, 2000)), "unit": u} for n, u in PRODUCTS]
+    return {"categories": [{"name": "Прочее", "items": items}], "total_items": len(items)}
+
+
+def _percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def _db_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+async def run(label: str, path: str, legacy: bool, menus: list, users: int, queries: int) -> dict:
+    engine = create_engine_for(f"sqlite+aiosqlite:///{path}")
+    metadata = LegacyBase.metadata if legacy else Base.metadata
+    user_cls, menu_cls = (LegacyUser, LegacyMenu) if legacy else (User, Menu)
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async with Session() as session:
+        session.add_all([user_cls(id=u, telegram_id=u) for u in range(1, users + 1)])
+        for i, (user_id, content, shopping, created_at) in enumerate(menus):
+            extra = {} if legacy else {"summary": menu_summary(content)}
+            session.add(menu_cls(user_id=user_id, diet_type="healthy", num_days=len(content["days"]),
+                                 content=content, shopping_list=shopping, created_at=created_at, **extra))
+            if i % 200 == 0:
+                await session.flush()
+        await session.commit()
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    list_times, load_times = [], []
+    async with Session() as session:
+        for _ in range(queries):
+            user_id = random.randint(1, users)
+            started = time.perf_counter()
+            result = await session.execute(
+                select(menu_cls).where(menu_cls.user_id == user_id)
+                .order_by(menu_cls.created_at.desc()).limit(5)
+            )
+            rows = result.scalars().all()
+            list_times.append(time.perf_counter() - started)
+            session.expunge_all()
+
+            started = time.perf_counter()
+            options = [] if legacy else [undefer(Menu.content)]
+            menu = await session.get(menu_cls, rows[0].id, options=options)
+            assert menu.content["days"]
+            load_times.append(time.perf_counter() - started)
+            session.expunge_all()
+    await engine.dispose()
+
+    return {
+        "label": label,
+        "size_mb": round(_db_size(path) / 1024 / 1024, 2),
+        "list_p50_ms": round(_percentile(list_times, 0.5) * 1000, 2),
+        "list_p95_ms": round(_percentile(list_times, 0.95) * 1000, 2),
+        "load_p50_ms": round(_percentile(load_times, 0.5) * 1000, 2),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--menus", type=int, default=5, help="меню на пользователя")
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    random.seed(1)
+    now = datetime.utcnow()
+    menus = [
+        (u, make_menu(args.days), make_shopping_list(), now - timedelta(minutes=random.randint(0, 100000)))
+        for u in range(1, args.users + 1) for _ in range(args.menus)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, name, legacy in (("до: JSON", "before.db", True), ("после: сжатие + deferred", "after.db", False)):
+            random.seed(2)
+            r = await run(label, os.path.join(tmp, name), legacy, menus, args.users, args.queries)
+            print(
+                f"{r['label']:<26} БД {r['size_mb']:>7} МБ  "
+                f"список p50 {r['list_p50_ms']:>6} мс  p95 {r['list_p95_ms']:>6} мс  "
+                f"меню целиком p50 {r['load_p50_ms']:>6} мс"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
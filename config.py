@@ -19,3 +19,118 @@ TRIAL_MAX_DAYS = 31  # полный доступ как у paid
 
 # Groq — актуальная модель
 GROQ_MODEL = "llama-3.3-70b-versatile"
+
+# HTTP-клиент Groq (общий пул соединений)
+GROQ_HTTP2 = os.getenv("GROQ_HTTP2", "1") == "1"
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "10"))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "60"))
+GROQ_CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "10"))
+GROQ_READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "60"))
+GROQ_POOL_TIMEOUT = float(os.getenv("GROQ_POOL_TIMEOUT", "30"))
+
+# Потоковая генерация меню: дни показываются по мере готовности
+MENU_STREAMING = os.getenv("MENU_STREAMING", "1") == "1"
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "2.0"))  # сек между правками сообщения
+
+# Длинные меню генерируются кусками по диапазонам дней
+MENU_CHUNK_MEALS = int(os.getenv("MENU_CHUNK_MEALS", "21"))  # приёмов пищи в одном запросе
+MENU_CHUNK_CONCURRENCY = int(os.getenv("MENU_CHUNK_CONCURRENCY", "5"))
+MENU_AVOID_DISHES_LIMIT = 60  # сколько уже использованных блюд передавать в промпт
+
+# Кэш сгенерированных меню
+MENU_CACHE_ENABLED = os.getenv("MENU_CACHE_ENABLED", "1") == "1"
+MENU_CACHE_TTL_HOURS = int(os.getenv("MENU_CACHE_TTL_HOURS", "168"))
+MENU_CACHE_MAX_MB = float(os.getenv("MENU_CACHE_MAX_MB", "20"))  # сжатых меню в кэше, сверх — LRU
+MENU_CACHE_VARIANTS = int(os.getenv("MENU_CACHE_VARIANTS", "3"))  # до стольких вариантов на ключ, добираются по ходу запросов
+
+# Кэш поисковых запросов для рецептов
+# Блюд в одном запросе к ИИ: меню на неделю — обычно один вызов, длиннее — несколько,
+# чтобы ответ (~60 токенов на блюдо) не упирался в лимит токенов ответа
+RECIPE_PREFETCH_BATCH = int(os.getenv("RECIPE_PREFETCH_BATCH", "40"))
+
+# Пул советов дня
+TIP_POOL_MIN = int(os.getenv("TIP_POOL_MIN", "50"))      # минимум советов в базе
+TIP_POOL_MAX = int(os.getenv("TIP_POOL_MAX", "1000"))    # больше не генерируем
+TIP_POOL_LOW = 3            # если у пользователя осталось меньше непрочитанных — дозаполняем
+TIP_BATCH_SIZE = 15         # советов в одном запросе к ИИ
+TIP_REFILL_MAX_PRESSURE = 0.7  # при большей загрузке лимитов Groq дозаполнение ждёт
+
+# Бюджет Groq для планировщика запросов (см. лимиты аккаунта на console.groq.com)
+GROQ_RPM = int(os.getenv("GROQ_RPM", "1000"))
+GROQ_TPM = int(os.getenv("GROQ_TPM", "300000"))
+
+# Устойчивость вызовов Groq: повторы, хеджирование, circuit breaker
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "3"))
+GROQ_RETRY_BASE = 0.5          # сек, база экспоненциальной задержки
+GROQ_RETRY_CAP = 20.0          # сек, максимум одной паузы
+GROQ_MAX_RETRY_AFTER = 60.0    # если Groq просит ждать дольше — не повторяем
+GROQ_BREAKER_FAILURES = int(os.getenv("GROQ_BREAKER_FAILURES", "5"))
+GROQ_BREAKER_RESET = float(os.getenv("GROQ_BREAKER_RESET", "30"))
+GROQ_SHORT_TIMEOUT = 20.0      # таймаут коротких вызовов (советы, рецепты, замены)
+HEDGE_PERCENTILE = 0.95
+MENU_CONTINUATION_ATTEMPTS = 2  # сколько раз догенерировать дни, потерянные из-за обрыва ответа
+
+# Учёт вызовов LLM и админ-статистика
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+LLM_METRICS_FLUSH_INTERVAL = float(os.getenv("LLM_METRICS_FLUSH_INTERVAL", "5"))  # сек
+LLM_METRICS_BATCH = 200            # записей в одной пачке INSERT
+LLM_CALLS_RETENTION_DAYS = int(os.getenv("LLM_CALLS_RETENTION_DAYS", "30"))  # сырые записи; агрегаты храним всегда
+
+# Бэкенд LLM: groq | openai (любой OpenAI-совместимый API) | fake (локальный сервер для тестов)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "")     # для openai, например http://127.0.0.1:8081/v1
+LLM_API_KEY = os.getenv("LLM_API_KEY", "")
+LLM_MODEL = os.getenv("LLM_MODEL", "")           # пусто — GROQ_MODEL
+
+# Фейковый LLM-сервер (services/fake_llm.py)
+FAKE_LLM_PORT = int(os.getenv("FAKE_LLM_PORT", "0"))                    # 0 — любой свободный
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "800"))    # медиана времени до первого токена
+FAKE_LLM_LATENCY_SIGMA = float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5"))  # ширина логнормального хвоста
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))      # доля ответов 429/500
+FAKE_LLM_TOKENS_PER_SEC = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "300"))
+
+# База данных: пул соединений и настройки SQLite
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))   # сек, для PostgreSQL
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))        # 64 МБ
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 256 МБ
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", "300"))   # сек, кэш действующего плана пользователя
+PLAN_CACHE_MAX_ENTRIES = 50000
+
+# Приём апдейтов: polling (локальная разработка) | webhook (aiohttp-сервер за балансировщиком)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")   # публичный адрес, например https://bot.up.railway.app
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")          # пусто — выводится из BOT_TOKEN
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))              # Railway передаёт порт в PORT
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "25"))  # сек на дообработку апдейтов при остановке
+
+# Несколько процессов-обработчиков: апдейты раскладываются по telegram id пользователя
+WORKERS = int(os.getenv("WORKERS", "1"))                     # 1 — всё в одном процессе
+WORKER_INDEX = int(os.environ["WORKER_INDEX"]) if os.getenv("WORKER_INDEX") else None  # задаёт супервизор
+# Webhook без супервизора может стоять за балансировщиком рядом с другими экземплярами:
+# апдейты пользователя приходят в разные процессы, кэшам процесса (план, FSM) верить нельзя
+SHARED_INSTANCES = BOT_MODE == "webhook" and WORKER_INDEX is None
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))  # обработчик i слушает 127.0.0.1:порт+i
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))  # апдейтов в очереди к одному обработчику
+WORKER_RESTART_MAX_DELAY = float(os.getenv("WORKER_RESTART_MAX_DELAY", "30"))  # сек, пауза перед перезапуском упавшего
+
+# Фоновая очередь генерации меню (таблица menu_jobs): переживает перезапуск процесса
+MENU_JOB_CONCURRENCY = int(os.getenv("MENU_JOB_CONCURRENCY", "4"))        # одновременных генераций в процессе
+MENU_JOB_POLL_INTERVAL = float(os.getenv("MENU_JOB_POLL_INTERVAL", "2"))  # сек, проверка очереди (задания других процессов)
+MENU_JOB_LEASE = 90             # сек; «running» без продления дольше — процесс упал, задание берёт другой
+MENU_JOB_MAX_ATTEMPTS = 3       # столько раз задание может начаться заново после падений
+MENU_JOB_RETENTION_DAYS = int(os.getenv("MENU_JOB_RETENTION_DAYS", "7"))  # завершённые задания
+
+# Хранилище FSM (шаги мастера создания меню): db — таблица fsm_states в DATABASE_URL,
+# redis — REDIS_URL (нужен пакет redis), memory — в памяти процесса, теряется при перезапуске
+FSM_STORAGE = os.getenv("FSM_STORAGE", "db")
+REDIS_URL = os.getenv("REDIS_URL", "")
+FSM_TTL_HOURS = float(os.getenv("FSM_TTL_HOURS", "24"))          # брошенный мастер забываем
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))  # сек; записи одного ключа за это время — одна запись в БД
+FSM_CACHE_MAX_ENTRIES = 20000   # состояний в памяти процесса (только чтение, записи всё равно идут в БД)
@@ -0,0 +1,54 @@
+"""Сжатое хранение больших JSON-полей (Menu.content, Menu.shopping_list).
+
+Формат значения: 1 байт версии + zlib-поток с предустановленным словарём.
+Словарь собран из ключей и частых значений меню и списка покупок — за счёт
+него даже небольшие документы сжимаются заметно лучше обычного zlib.
+
+Словарь версии нельзя менять после того, как им записаны данные: для нового
+словаря заводится новая версия, старые продолжают читаться своей.
+"""
+import json
+import zlib
+
+# Частые строки ближе к концу: zlib дешевле ссылается на короткие расстояния
+ZDICT_V1 = (
+    '"categories":[{"name":"Прочее","items":[{"name":"","total_amount":"","unit":"по вкусу"}]},'
+    '{"name":"Специи и приправы","items":[]},{"name":"Масла и соусы","items":[]},'
+    '{"name":"Крупы и злаки","items":[]},{"name":"Молочные продукты","items":[]},'
+    '{"name":"Овощи и фрукты","items":[]},{"name":"Мясо и рыба","items":[]}],"total_items":'
+    '"meal_type":"brunch","meal_name":"Второй завтрак",'
+    '"meal_type":"snack","meal_name":"Перекус",'
+    '"meal_type":"dinner","meal_name":"Ужин","time":"19:00",'
+    '"meal_type":"lunch","meal_name":"Обед","time":"13:00",'
+    '{"days":[{"day":1,"date_label":"День 1","meals":[{"meal_type":"breakfast","meal_name":"Завтрак",'
+    '"time":"08:00","dishes":[{"name":"","description":"","ingredients":[{"name":"","amount":1,"unit":"шт"},'
+    '{"name":"","amount":100,"unit":"мл"},{"name":"","amount":200,"unit":"г"}],'
+    '"calories_per_serving":350,"proteins":15,"fats":10,"carbs":45}],"total_calories":'
+    '"day_total_calories":'
+    '},{"name":"","amount":,"unit":"г"},{"name":"'
+).encode("utf-8")
+
+_ZDICTS = {1: ZDICT_V1}
+CURRENT_VERSION = 1
+COMPRESS_LEVEL = 6
+
+
+def encode_json(value) -> bytes:
+    raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                  zdict=_ZDICTS[CURRENT_VERSION])
+    return bytes([CURRENT_VERSION]) + compressor.compress(raw) + compressor.flush()
+
+
+def decode_json(data):
+    """Читает и сжатый формат, и JSON, записанный до перехода на сжатие."""
+    if data is None:
+        return None
+    if isinstance(data, str):
+        return json.loads(data)
+    data = bytes(data)
+    zdict = _ZDICTS.get(data[0]) if data else None
+    if zdict is None:
+        return json.loads(data.decode("utf-8"))
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=zdict)
+    return json.loads(decompressor.decompress(data[1:]) + decompressor.flush())
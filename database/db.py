@@ -1,17 +1,89 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from sqlalchemy import (
     Column, Integer, String, DateTime, Boolean,
-    Float, JSON, Text, ForeignKey, select
+    Float, JSON, Text, ForeignKey, UniqueConstraint, Index, LargeBinary, select
 )
+from sqlalchemy import event, inspect, text
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-from config import DATABASE_URL
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, deferred
+from sqlalchemy.pool import StaticPool, AsyncAdaptedQueuePool
+from database.codec import encode_json, decode_json
+from config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE,
+    PLAN_CACHE_TTL, PLAN_CACHE_MAX_ENTRIES, SHARED_INSTANCES,
+)
+
+
+def normalize_database_url(url: str) -> str:
+    # Railway/Heroku отдают postgres://… — SQLAlchemy нужен явный async-драйвер
+    for prefix in ("postgres://", "postgresql://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    # WAL: читатели не блокируются писателем; NORMAL в WAL безопасен при сбое процесса
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def create_engine_for(url: str, **overrides):
+    """Движок с настройками под конкретную СУБД: прагмы и пул для SQLite,
+    размер пула, pre-ping и recycle для PostgreSQL."""
+    url = normalize_database_url(url)
+    if url.startswith("sqlite"):
+        if ":memory:" in url or url.rstrip("/").endswith(":"):
+            options = {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+        else:
+            # По умолчанию aiosqlite открывает файл заново на каждую сессию (NullPool) —
+            # держим соединения в пуле, прагмы применяются один раз на соединение
+            options = {"poolclass": AsyncAdaptedQueuePool, "pool_size": DB_POOL_SIZE,
+                       "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT}
+        options.update(overrides)
+        engine = create_async_engine(url, echo=False, **options)
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+        return engine
+
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+    if url.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {"server_settings": {"application_name": "menu-bot"}}
+    options.update(overrides)
+    return create_async_engine(url, echo=False, **options)
+
 
 Base = declarative_base()
-engine = create_async_engine(DATABASE_URL, echo=False)
+engine = create_engine_for(DATABASE_URL)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+class CompressedJSON(TypeDecorator):
+    """JSON, хранимый сжатым блобом (см. database/codec.py)."""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else encode_json(value)
+
+    def process_result_value(self, value, dialect):
+        return decode_json(value)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -41,6 +113,7 @@ class EaterProfile(Base):
 
 class Menu(Base):
     __tablename__ = "menus"
+    __table_args__ = (Index("ix_menus_user_created", "user_id", text("created_at DESC")),)
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -48,13 +121,100 @@ class Menu(Base):
     num_people = Column(Integer, default=1)
     num_days = Column(Integer, default=1)
     meals_per_day = Column(JSON)  # {"breakfast": "08:00", "lunch": "13:00", "dinner": "19:00"}
-    content = Column(JSON)  # Full menu data
-    shopping_list = Column(JSON, nullable=True)
+    # Меню хранится строками menu_days/menu_meals/dishes/dish_ingredients (services/menu_store.py);
+    # content остаётся только у меню, записанных до этого, и переносится в строки при первом чтении
+    content = deferred(Column(CompressedJSON), raiseload=True)
+    shopping_list = deferred(Column(CompressedJSON, nullable=True), raiseload=True)
+    summary = Column(JSON, nullable=True)  # menu_summary(content) — для списков меню
     created_at = Column(DateTime, default=datetime.utcnow)
     status = Column(String, default="draft")  # draft | confirmed
     user = relationship("User", back_populates="menus")
 
 
+class MenuDay(Base):
+    __tablename__ = "menu_days"
+    __table_args__ = (UniqueConstraint("menu_id", "day"),)
+
+    id = Column(Integer, primary_key=True)
+    menu_id = Column(Integer, ForeignKey("menus.id", ondelete="CASCADE"), nullable=False)
+    day = Column(Integer, nullable=False)
+    date_label = Column(String)
+    total_calories = Column(Integer, nullable=True)
+
+
+class MenuMeal(Base):
+    __tablename__ = "menu_meals"
+
+    id = Column(Integer, primary_key=True)
+    menu_id = Column(Integer, ForeignKey("menus.id", ondelete="CASCADE"), nullable=False, index=True)
+    day_id = Column(Integer, ForeignKey("menu_days.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    meal_type = Column(String)
+    meal_name = Column(String)
+    time = Column(String)
+    total_calories = Column(Integer, nullable=True)
+
+
+class Dish(Base):
+    __tablename__ = "dishes"
+
+    id = Column(Integer, primary_key=True)
+    menu_id = Column(Integer, ForeignKey("menus.id", ondelete="CASCADE"), nullable=False, index=True)
+    meal_id = Column(Integer, ForeignKey("menu_meals.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    name = Column(String)
+    description = Column(Text)
+    calories_per_serving = Column(Float, nullable=True)
+    proteins = Column(Float, nullable=True)
+    fats = Column(Float, nullable=True)
+    carbs = Column(Float, nullable=True)
+    extra = Column(JSON, nullable=True)  # прочие поля блюда от ИИ, если есть
+
+
+class DishIngredient(Base):
+    __tablename__ = "dish_ingredients"
+
+    id = Column(Integer, primary_key=True)
+    menu_id = Column(Integer, ForeignKey("menus.id", ondelete="CASCADE"), nullable=False, index=True)
+    dish_id = Column(Integer, ForeignKey("dishes.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    name = Column(String)
+    amount = Column(JSON)  # число или строка («по вкусу», «1/2»)
+    unit = Column(String)
+
+
+class MenuJob(Base):
+    """Задание на генерацию меню (services/menu_jobs.py)."""
+    __tablename__ = "menu_jobs"
+    __table_args__ = (Index("ix_menu_jobs_status_id", "status", "id"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    telegram_id = Column(Integer, nullable=False)
+    chat_id = Column(Integer, nullable=False)
+    message_id = Column(Integer, nullable=False)  # сообщение с прогрессом, в нём же итог
+    plan = Column(String, default="free")
+    params = Column(JSON)  # diet, num_people, num_days, meals_config, eaters
+    status = Column(String, default="queued")  # queued | running | done | failed
+    attempts = Column(Integer, default=0)
+    lease_until = Column(DateTime, nullable=True)  # пока идёт генерация, процесс продлевает срок
+    menu_id = Column(Integer, ForeignKey("menus.id", ondelete="SET NULL"), nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class FSMState(Base):
+    """Состояние и данные FSM одного пользователя (database/fsm_storage.py)."""
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)  # fsm:<bot>:<chat>:<user>:<destiny>
+    state = Column(String, nullable=True)
+    data = Column(CompressedJSON, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
 class Payment(Base):
     __tablename__ = "payments"
 
@@ -67,9 +227,138 @@ class Payment(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class MenuCache(Base):
+    __tablename__ = "menu_cache"
+
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String, index=True, nullable=False)  # sha256 нормализованных параметров
+    content = Column(CompressedJSON)
+    size_bytes = Column(Integer, default=0)  # длина сжатого content — лимит кэша считается в байтах
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class RecipeQuery(Base):
+    __tablename__ = "recipe_queries"
+
+    id = Column(Integer, primary_key=True)
+    dish_key = Column(String, unique=True, nullable=False)  # нормализованное название блюда
+    dish_name = Column(String)
+    queries = Column(JSON)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DishCache(Base):
+    __tablename__ = "dish_cache"
+
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String, unique=True, nullable=False)  # блюдо + режим питания + модель
+    dish_name = Column(String)
+    content = Column(JSON)  # блюдо на одну порцию
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class NutritionTip(Base):
+    __tablename__ = "nutrition_tips"
+
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    text_hash = Column(String, unique=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class TipView(Base):
+    __tablename__ = "tip_views"
+    __table_args__ = (UniqueConstraint("telegram_id", "tip_id"),)
+
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(Integer, nullable=False, index=True)
+    tip_id = Column(Integer, ForeignKey("nutrition_tips.id", ondelete="CASCADE"))
+    seen_at = Column(DateTime, default=datetime.utcnow)
+
+
+class LLMCall(Base):
+    __tablename__ = "llm_calls"
+
+    id = Column(Integer, primary_key=True)
+    call_type = Column(String, nullable=False)  # menu | shopping | tip | ...
+    telegram_id = Column(Integer, nullable=True)
+    plan = Column(String)
+    model = Column(String)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    latency_ms = Column(Integer)
+    finish_reason = Column(String, nullable=True)
+    outcome = Column(String)  # ok | http_429 | http_5xx | timeout | error | cancelled
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class LLMCallRollup(Base):
+    """Почасовые агрегаты по llm_calls: счётчики и токены (гистограмма — llm_latency_buckets)."""
+    __tablename__ = "llm_call_rollups"
+    __table_args__ = (UniqueConstraint("hour", "call_type", "plan"),)
+
+    id = Column(Integer, primary_key=True)
+    hour = Column(DateTime, nullable=False, index=True)
+    call_type = Column(String, nullable=False)
+    plan = Column(String, nullable=False)
+    calls = Column(Integer, default=0)
+    errors = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+
+
+class LLMLatencyBucket(Base):
+    """Гистограмма задержек к llm_call_rollups: строка на непустую корзину LATENCY_BUCKETS_MS.
+
+    Отдельные строки, а не JSON-массив, — чтобы счётчик прибавлялся одним UPSERT
+    и процессы (WORKERS > 1) не затирали данные друг друга."""
+    __tablename__ = "llm_latency_buckets"
+    __table_args__ = (UniqueConstraint("hour", "call_type", "plan", "bucket"),)
+
+    id = Column(Integer, primary_key=True)
+    hour = Column(DateTime, nullable=False, index=True)
+    call_type = Column(String, nullable=False)
+    plan = Column(String, nullable=False)
+    bucket = Column(Integer, nullable=False)  # индекс в LATENCY_BUCKETS_MS
+    count = Column(Integer, default=0)
+
+
+def menu_summary(content: dict) -> dict:
+    """Короткая выжимка меню для списков — без загрузки самого меню."""
+    days = (content or {}).get("days", [])
+    dishes = sum(len(m.get("dishes", [])) for d in days for m in d.get("meals", []))
+    totals = [d["day_total_calories"] for d in days if isinstance(d.get("day_total_calories"), (int, float))]
+    return {
+        "days": len(days),
+        "dishes": dishes,
+        "avg_kcal": round(sum(totals) / len(totals)) if totals else None,
+    }
+
+
+def _upgrade_schema(conn):
+    # create_all не меняет существующие таблицы — дотягиваем их до текущих моделей
+    columns = {c["name"]: c for c in inspect(conn).get_columns("menus")}
+    if "summary" not in columns:
+        conn.execute(text("ALTER TABLE menus ADD COLUMN summary JSON"))
+    if conn.dialect.name == "postgresql":
+        for name in ("content", "shopping_list"):
+            if not isinstance(columns[name]["type"], LargeBinary):
+                conn.execute(text(
+                    f"ALTER TABLE menus ALTER COLUMN {name} TYPE BYTEA "
+                    f"USING convert_to({name}::text, 'UTF8')"
+                ))
+    for index in Menu.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_upgrade_schema)
 
 
 async def get_session():
@@ -77,24 +366,91 @@ async def get_session():
         yield session
 
 
+def _dialect_insert(session: AsyncSession):
+    if session.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
 async def get_or_create_user(session: AsyncSession, telegram_id: int, username: str = None, full_name: str = None):
-    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-    user = result.scalar_one_or_none()
-    if not user:
-        user = User(telegram_id=telegram_id, username=username, full_name=full_name)
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
+    """Пользователь по telegram_id одним INSERT ... ON CONFLICT DO UPDATE ... RETURNING:
+    создаёт нового или обновляет имя существующего, безопасно при параллельных апдейтах."""
+    insert = _dialect_insert(session)
+    stmt = insert(User).values(
+        telegram_id=telegram_id, username=username, full_name=full_name,
+        plan="free", created_at=datetime.utcnow(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={"username": stmt.excluded.username, "full_name": stmt.excluded.full_name},
+    ).returning(User)
+    user = (await session.execute(stmt, execution_options={"populate_existing": True})).scalar_one()
+    await session.commit()
     return user
 
 
-async def get_user_plan(session: AsyncSession, telegram_id: int) -> str:
-    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-    user = result.scalar_one_or_none()
-    if not user:
-        return "free"
-    if user.plan == "paid" and user.paid_until and user.paid_until > datetime.utcnow():
-        return "paid"
-    if user.plan == "trial" and user.trial_end and user.trial_end > datetime.utcnow():
-        return "trial"
-    return "free"
+# Кэш действующего плана: telegram_id -> (план, когда перепроверить).
+# При SHARED_INSTANCES не используется: invalidate_user_plan сбросил бы только
+# кэш процесса, принявшего оплату, остальные экземпляры отдавали бы старый план
+_plan_cache = OrderedDict()
+_plan_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def invalidate_user_plan(telegram_id: int):
+    """Вызывать после любого изменения plan / trial_end / paid_until."""
+    _plan_cache.pop(telegram_id, None)
+    _plan_stats["invalidations"] += 1
+
+
+def plan_cache_stats() -> dict:
+    total = _plan_stats["hits"] + _plan_stats["misses"]
+    return {**_plan_stats, "size": len(_plan_cache), "enabled": not SHARED_INSTANCES,
+            "hit_rate": round(_plan_stats["hits"] / total, 3) if total else 0.0}
+
+
+def effective_plan(user) -> tuple:
+    """(план, до какого момента он действует) по полям пользователя."""
+    now = datetime.utcnow()
+    if user is not None:
+        if user.plan == "paid" and user.paid_until and user.paid_until > now:
+            return "paid", user.paid_until
+        if user.plan == "trial" and user.trial_end and user.trial_end > now:
+            return "trial", user.trial_end
+    return "free", None
+
+
+def remember_plan(telegram_id: int, plan: str, expires=None):
+    if SHARED_INSTANCES:
+        return
+    # Запись живёт не дольше TTL и не переживает окончание триала или подписки
+    until = datetime.utcnow() + timedelta(seconds=PLAN_CACHE_TTL)
+    _plan_cache[telegram_id] = (plan, min(until, expires) if expires else until)
+    _plan_cache.move_to_end(telegram_id)
+    while len(_plan_cache) > PLAN_CACHE_MAX_ENTRIES:
+        _plan_cache.popitem(last=False)
+
+
+async def current_plan(session: AsyncSession, telegram_id: int):
+    """Действующий план без загрузки пользователя: из кэша, а при SHARED_INSTANCES —
+    одним SELECT из БД. None — пользователя нужно загрузить (или создать)."""
+    if not SHARED_INSTANCES:
+        return cached_plan(telegram_id)
+    row = (await session.execute(
+        select(User.plan, User.trial_end, User.paid_until).where(User.telegram_id == telegram_id)
+    )).one_or_none()
+    # Закрываем транзакцию чтения — соединение не держим, пока работает обработчик
+    await session.commit()
+    return effective_plan(row)[0] if row is not None else None
+
+
+def cached_plan(telegram_id: int):
+    """План из кэша или None, если его пора перечитать из БД."""
+    cached = _plan_cache.get(telegram_id)
+    if cached is not None and cached[1] > datetime.utcnow():
+        _plan_cache.move_to_end(telegram_id)
+        _plan_stats["hits"] += 1
+        return cached[0]
+    _plan_stats["misses"] += 1
+    return None
@@ -0,0 +1,248 @@
+"""Хранилище FSM aiogram, которое переживает перезапуск.
+
+DatabaseStorage держит состояния в таблице fsm_states (SQLite или PostgreSQL
+из DATABASE_URL). Чтения обслуживаются из памяти процесса: все апдейты
+пользователя приходят в один процесс (см. supervisor.py), а после перезапуска
+состояние один раз подгружается из БД. Записи копятся по ключу и уходят в БД
+пачкой раз в FSM_FLUSH_INTERVAL: пять update_data на одном шаге мастера —
+одна строка в UPSERT.
+
+Webhook без супервизора (BOT_MODE=webhook, WORKER_INDEX не задан) может стоять
+за балансировщиком рядом с другими экземплярами, и следующий апдейт пользователя
+придёт не сюда. Тогда хранилище общее (shared): каждое чтение идёт в БД, каждая
+запись сразу сохраняется. Быстрее для такого развёртывания — FSM_STORAGE=redis.
+"""
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+from database.db import AsyncSessionLocal, FSMState, _dialect_insert
+from config import (
+    FSM_STORAGE, REDIS_URL, FSM_TTL_HOURS, FSM_FLUSH_INTERVAL, FSM_CACHE_MAX_ENTRIES,
+    SHARED_INSTANCES,
+)
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 3600  # сек между удалениями просроченных состояний
+FLUSH_BATCH = 200  # строк в одном UPSERT: SQLite ограничивает число параметров запроса
+ROWS_MARKER = "__cols__"
+
+
+def pack_rows(data: dict) -> dict:
+    """Списки словарей (едоки — до 50 человек) → столбцы: ключи не повторяются в каждой строке."""
+    packed = {}
+    for name, value in data.items():
+        if isinstance(value, list) and len(value) > 1 and all(isinstance(v, dict) for v in value):
+            cols = list(dict.fromkeys(k for row in value for k in row))
+            value = {ROWS_MARKER: cols, "rows": [[row.get(c) for c in cols] for row in value]}
+        packed[name] = value
+    return packed
+
+
+def unpack_rows(data: dict) -> dict:
+    unpacked = {}
+    for name, value in data.items():
+        if isinstance(value, dict) and ROWS_MARKER in value:
+            cols = value[ROWS_MARKER]
+            value = [dict(zip(cols, row)) for row in value["rows"]]
+        unpacked[name] = value
+    return unpacked
+
+
+class _Record:
+    __slots__ = ("state", "data", "expires_at")
+
+    def __init__(self, state=None, data=None, expires_at=None):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.expires_at = expires_at
+
+
+class DatabaseStorage(BaseStorage):
+    def __init__(self, session_factory=AsyncSessionLocal, ttl_hours: float = FSM_TTL_HOURS,
+                 flush_interval: float = FSM_FLUSH_INTERVAL, cache_size: int = FSM_CACHE_MAX_ENTRIES,
+                 shared: bool = False):
+        self.session_factory = session_factory
+        self.shared = shared  # состояния меняют и другие экземпляры — память не источник правды
+        self.ttl = timedelta(hours=ttl_hours)
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+        self._cache = OrderedDict()  # StorageKey → _Record
+        self._dirty = set()
+        self._pending = asyncio.Event()
+        self._flush_task = None
+        self.stats = {"writes": 0, "flushed_rows": 0, "loads": 0}
+
+    async def _record(self, key) -> _Record:
+        record = self._cache.get(key)
+        # Несохранённая своя запись новее БД; иначе в общем режиме перечитываем
+        if record is None or (self.shared and key not in self._dirty):
+            record = await self._load(key)
+        if record.expires_at is not None and record.expires_at < datetime.utcnow():
+            record.state, record.data, record.expires_at = None, {}, None
+        self._cache.move_to_end(key)
+        return record
+
+    async def _load(self, key) -> _Record:
+        async with self.session_factory() as session:
+            row = (await session.execute(
+                select(FSMState.state, FSMState.data, FSMState.expires_at)
+                .where(FSMState.key == self.key_builder.build(key))
+            )).first()
+        self.stats["loads"] += 1
+        loaded = _Record(row.state, unpack_rows(row.data or {}), row.expires_at) if row else _Record()
+        if self.shared and key not in self._dirty:
+            self._cache[key] = loaded
+        # Пока шёл запрос, ключ мог быть записан — запись новее прочитанного
+        record = self._cache.setdefault(key, loaded)
+        self._evict()
+        return record
+
+    def _evict(self):
+        if len(self._cache) <= self.cache_size:
+            return
+        # Несохранённые записи не выбрасываем — они уйдут при ближайшем сбросе
+        for key in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if key not in self._dirty:
+                del self._cache[key]
+
+    async def _touch(self, key, record: _Record):
+        record.expires_at = datetime.utcnow() + self.ttl
+        self._dirty.add(key)
+        self.stats["writes"] += 1
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        if not self.shared:
+            self._pending.set()
+            return
+        # Следующий апдейт может прийти в другой экземпляр — сохраняем сразу
+        try:
+            await self.flush()
+        except Exception:
+            self._pending.set()
+            raise
+
+    async def set_state(self, key, state=None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        await self._touch(key, record)
+
+    async def get_state(self, key):
+        return (await self._record(key)).state
+
+    async def set_data(self, key, data: dict) -> None:
+        record = await self._record(key)
+        record.data = data.copy()
+        await self._touch(key, record)
+
+    async def get_data(self, key) -> dict:
+        return (await self._record(key)).data.copy()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        rows, cleared = [], []
+        for key in keys:
+            record = self._cache[key]
+            if record.state is None and not record.data:
+                cleared.append(self.key_builder.build(key))
+            else:
+                rows.append({
+                    "key": self.key_builder.build(key),
+                    "state": record.state,
+                    "data": pack_rows(record.data),
+                    "expires_at": record.expires_at,
+                })
+        try:
+            async with self.session_factory() as session:
+                for i in range(0, len(rows), FLUSH_BATCH):
+                    stmt = _dialect_insert(session)(FSMState).values(rows[i:i + FLUSH_BATCH])
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[FSMState.key],
+                        set_={"state": stmt.excluded.state, "data": stmt.excluded.data,
+                              "expires_at": stmt.excluded.expires_at},
+                    )
+                    await session.execute(stmt)
+                for i in range(0, len(cleared), FLUSH_BATCH):
+                    await session.execute(
+                        delete(FSMState).where(FSMState.key.in_(cleared[i:i + FLUSH_BATCH]))
+                    )
+                await session.commit()
+        except Exception:
+            self._dirty |= keys
+            raise
+        self.stats["flushed_rows"] += len(keys)
+
+    async def purge_expired(self):
+        async with self.session_factory() as session:
+            await session.execute(delete(FSMState).where(FSMState.expires_at < datetime.utcnow()))
+            await session.commit()
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        last_purge = loop.time()
+        while True:
+            # asyncio.timeout, а не wait_for: wait_for теряет cancel() из close(),
+            # если событие выставлено в тот же момент
+            try:
+                async with asyncio.timeout(PURGE_INTERVAL):
+                    await self._pending.wait()
+                # Даём накопиться остальным записям этого шага
+                await asyncio.sleep(self.flush_interval)
+            except TimeoutError:
+                pass
+            self._pending.clear()
+            try:
+                await self.flush()
+                if loop.time() - last_purge > PURGE_INTERVAL:
+                    last_purge = loop.time()
+                    await self.purge_expired()
+            except Exception as e:
+                logger.warning(f"FSM storage flush failed: {e}")
+                self._pending.set()
+                await asyncio.sleep(self.flush_interval)
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning(f"FSM storage final flush failed, {len(self._dirty)} states lost: {e}")
+
+
+def _redis_storage():
+    try:
+        from aiogram.fsm.storage.redis import RedisStorage
+    except ImportError:
+        raise RuntimeError("FSM_STORAGE=redis требует пакет redis: pip install redis")
+    if not REDIS_URL:
+        raise RuntimeError("FSM_STORAGE=redis требует REDIS_URL")
+    ttl = timedelta(hours=FSM_TTL_HOURS)
+    return RedisStorage.from_url(
+        REDIS_URL, state_ttl=ttl, data_ttl=ttl,
+        json_dumps=lambda data: json.dumps(pack_rows(data), ensure_ascii=False, separators=(",", ":")),
+        json_loads=lambda raw: unpack_rows(json.loads(raw)),
+    )
+
+
+def create_fsm_storage() -> BaseStorage:
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "redis":
+        return _redis_storage()
+    if SHARED_INSTANCES:
+        logger.info("FSM storage: webhook without supervisor, reading and writing through to the database")
+    return DatabaseStorage(shared=SHARED_INSTANCES)
@@ -0,0 +1,137 @@
+import re
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message
+from services.llm_metrics import llm_stats
+from services.prompt_encoder import encoding_stats
+from services.menu_jobs import menu_job_stats
+from services.groq_service import pool_stats, resilience_stats
+from services.menu_cache import cache_stats
+from database.db import plan_cache_stats
+from config import ADMIN_IDS
+
+router = Router()
+
+DEFAULT_WINDOW_HOURS = 24
+
+
+def _parse_window(arg: str) -> int:
+    """'24', '24h', '7d' → часы."""
+    match = re.fullmatch(r"\s*(\d+)\s*([hdчд]?)\s*", arg or "")
+    if not match:
+        return DEFAULT_WINDOW_HOURS
+    value, unit = int(match.group(1)), match.group(2)
+    return max(1, value * 24 if unit in ("d", "д") else value)
+
+
+def _ms(value) -> str:
+    if value is None:
+        return "—"
+    return f"{value / 1000:.1f}с" if value >= 1000 else f"{value}мс"
+
+
+def _num(value: int) -> str:
+    return f"{value:,}".replace(",", " ")
+
+
+def _format_row(name: str, s: dict) -> str:
+    tokens = s["prompt_tokens"] + s["completion_tokens"]
+    return (
+        f"<b>{name}</b>: {s['calls']} выз., ошибок {s['errors']}\n"
+        f"   p50 {_ms(s['p50'])} · p95 {_ms(s['p95'])} · p99 {_ms(s['p99'])}\n"
+        f"   токены: {_num(tokens)} (вход {_num(s['prompt_tokens'])} / выход {_num(s['completion_tokens'])})"
+    )
+
+
+BREAKER_STATES = {"closed": "закрыт", "open": "открыт", "half_open": "пробный запрос"}
+
+
+def _format_resilience(s: dict) -> str:
+    breaker, retries, hedging = s["breaker"], s["retries"], s["hedging"]
+    state = BREAKER_STATES.get(breaker["state"], breaker["state"])
+    if breaker["state"] == "open":
+        state += f", ещё {breaker['retry_in']}с"
+    return (
+        f"<b>Устойчивость (с запуска):</b>\n"
+        f"   breaker: {state}, ошибок подряд {breaker['failures']}, "
+        f"открывался {breaker['opened']}, отказов {_num(breaker['rejected'])}\n"
+        f"   повторов {_num(retries['retries'])}, сдались {_num(retries['gave_up'])}\n"
+        f"   хеджирование: {_num(hedging['hedged'])} вторых запросов, быстрее первого {_num(hedging['hedge_won'])}"
+    ) + _format_coalescing(s["coalescing"])
+
+
+def _format_coalescing(kinds: dict) -> str:
+    # Одинаковые одновременные запросы, склеенные в один вызов (SingleFlight)
+    total = sum(k["calls"] for k in kinds.values())
+    if not total:
+        return ""
+    joined = sum(k["coalesced"] for k in kinds.values())
+    lines = [f"\n   склеено одинаковых запросов: {_num(joined)} из {_num(total)} ({joined / total:.0%})"]
+    lines += [
+        f"\n      {name}: {_num(k['coalesced'])} / {_num(k['calls'])}"
+        for name, k in kinds.items() if k["coalesced"]
+    ]
+    return "".join(lines)
+
+
+def _format_jobs(s: dict) -> str:
+    oldest = f", самое старое ждёт {s['oldest_queued_s']}с" if s["oldest_queued_s"] is not None else ""
+    return (
+        f"<b>Очередь меню:</b> ждут {s['queued']}, в работе {s['running']}{oldest}\n"
+        f"   готово {s['done']}, ошибок {s['failed']}\n"
+        f"   ожидание p50 {_ms(s['wait_p50'])} · p95 {_ms(s['wait_p95'])}\n"
+        f"   до готового меню p50 {_ms(s['total_p50'])} · p95 {_ms(s['total_p95'])}"
+    )
+
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    hours = _parse_window(command.args)
+    stats = await llm_stats(hours)
+    jobs = _format_jobs(await menu_job_stats(hours))
+    if not stats["total"]["calls"]:
+        await message.answer(f"📊 За последние {hours} ч вызовов ИИ не было.\n\n{jobs}", parse_mode="HTML")
+        return
+
+    lines = [f"📊 <b>Вызовы ИИ за {hours} ч</b>\n", _format_row("Всего", stats["total"])]
+    lines.append("\n<b>По типам:</b>")
+    lines += [_format_row(name, s) for name, s in stats["by_type"].items()]
+    lines.append("\n<b>По планам:</b>")
+    lines += [_format_row(name, s) for name, s in stats["by_plan"].items()]
+    lines.append("\n" + _format_resilience(resilience_stats()))
+
+    plans = plan_cache_stats()
+    if not plans["enabled"]:
+        lines.append("\n<b>Кэш планов:</b> выключен — webhook без супервизора, план читается из БД")
+    else:
+        lines.append(
+            f"\n<b>Кэш планов:</b> попаданий {plans['hit_rate']:.0%} "
+            f"({_num(plans['hits'])} / {_num(plans['hits'] + plans['misses'])}), записей {_num(plans['size'])}"
+        )
+
+    menus = cache_stats()
+    lines.append(
+        f"<b>Кэш меню (с запуска):</b> попаданий {menus['hit_rate']:.0%} "
+        f"({_num(menus['hits'])} / {_num(menus['hits'] + menus['misses'] + menus['fills'])}), "
+        f"новых вариантов {_num(menus['fills'])}, сохранено {_num(menus['stores'])}, вытеснено {_num(menus['evictions'])}"
+    )
+
+    pool = pool_stats()
+    lines.append(
+        f"\n<b>Пул соединений ИИ:</b> занято {pool['active']}, свободно {pool['idle']}, "
+        f"ждут {pool['waiting']} (макс. {pool['max']}), таймаутов пула с запуска {pool['pool_timeouts']}"
+    )
+
+    lines.append("\n" + jobs)
+
+    savings = encoding_stats()
+    if savings:
+        lines.append("\n<b>Компактные промпты (с запуска):</b>")
+        lines += [
+            f"{name}: ~{_num(s['raw_tokens'])} → ~{_num(s['sent_tokens'])} ток. (×{s['ratio']})"
+            for name, s in savings.items()
+        ]
+    await message.answer("\n".join(lines), parse_mode="HTML")
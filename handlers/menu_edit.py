@@ -3,8 +3,11 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database.db import AsyncSessionLocal, Menu, get_user_plan
-from handlers.menu_generation import format_menu_summary
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.db import Menu
+from handlers.menu_generation import _format_day_lines
+from services.dish_cache import get_dish
+from services.menu_store import list_days, list_meals, list_dishes, replace_dish, average_day_calories
 from keyboards.keyboards import menu_actions_keyboard
 from sqlalchemy import update
 
@@ -20,22 +23,20 @@ class EditMenuFSM(StatesGroup):
 
 
 @router.callback_query(F.data.startswith("edit_menu:"))
-async def start_edit(call: CallbackQuery, state: FSMContext):
+async def start_edit(call: CallbackQuery, state: FSMContext, session: AsyncSession):
     menu_id = int(call.data.split(":")[1])
     await state.update_data(edit_menu_id=menu_id)
 
-    async with AsyncSessionLocal() as session:
-        menu = await session.get(Menu, menu_id)
+    days = await list_days(session, menu_id)
+    # Старое меню при первом открытии переносится в таблицы — фиксируем
+    await session.commit()
 
-    if not menu:
+    if days is None:
         await call.answer("Меню не найдено!", show_alert=True)
         return
 
-    days = menu.content.get("days", [])
     lines = ["<b>Редактирование меню</b>\n\nВыберите номер дня:\n"]
-    for d in days:
-        day_num   = d.get("day", "")
-        day_label = d.get("date_label", f"День {day_num}")
+    for day_num, day_label in days:
         lines.append(f"  <b>{day_num}</b> — {day_label}")
 
     await state.set_state(EditMenuFSM.choose_day)
@@ -43,7 +44,7 @@ async def start_edit(call: CallbackQuery, state: FSMContext):
 
 
 @router.message(EditMenuFSM.choose_day)
-async def choose_day_handler(message: Message, state: FSMContext):
+async def choose_day_handler(message: Message, state: FSMContext, session: AsyncSession):
     try:
         day_num = int(message.text.strip())
     except ValueError:
@@ -52,18 +53,14 @@ async def choose_day_handler(message: Message, state: FSMContext):
         return
 
     data = await state.get_data()
-    async with AsyncSessionLocal() as session:
-        menu = await session.get(Menu, data["edit_menu_id"])
-
-    day = next((d for d in menu.content["days"] if d["day"] == day_num), None)
-    if not day:
+    meals = await list_meals(session, data["edit_menu_id"], day_num)
+    if not meals:
         await message.answer("День не найден. Введите корректный номер:")
         return
 
     await state.update_data(edit_day=day_num)
 
     # Нумеруем приёмы пищи цифрами
-    meals = day.get("meals", [])
     lines = [f"<b>День {day_num} — приёмы пищи:</b>\n"]
     for i, m in enumerate(meals, start=1):
         meal_name = m.get("meal_name", m["meal_type"])
@@ -77,7 +74,7 @@ async def choose_day_handler(message: Message, state: FSMContext):
 
 
 @router.message(EditMenuFSM.choose_meal)
-async def choose_meal_handler(message: Message, state: FSMContext):
+async def choose_meal_handler(message: Message, state: FSMContext, session: AsyncSession):
     try:
         meal_idx = int(message.text.strip()) - 1
     except ValueError:
@@ -94,19 +91,14 @@ async def choose_meal_handler(message: Message, state: FSMContext):
     meal_type = meals_list[meal_idx]
     await state.update_data(edit_meal=meal_type)
 
-    async with AsyncSessionLocal() as session:
-        menu = await session.get(Menu, data["edit_menu_id"])
-
-    day  = next((d for d in menu.content["days"] if d["day"] == data["edit_day"]), None)
-    meal = next((m for m in day["meals"] if m["meal_type"] == meal_type), None)
-    if not meal:
+    dishes = await list_dishes(session, data["edit_menu_id"], data["edit_day"], meal_type)
+    if not dishes:
         await message.answer("Приём пищи не найден. Попробуйте снова:")
         return
 
-    dishes = meal.get("dishes", [])
     lines  = [f"<b>Блюда:</b>\n"]
-    for i, d in enumerate(dishes, start=1):
-        lines.append(f"  <b>{i}</b> — {d.get('name', '')}")
+    for i, name in enumerate(dishes, start=1):
+        lines.append(f"  <b>{i}</b> — {name}")
     lines.append("\nВведите номер блюда для замены:")
 
     await state.set_state(EditMenuFSM.choose_dish)
@@ -132,40 +124,58 @@ async def choose_dish_handler(message: Message, state: FSMContext):
 
 
 @router.message(EditMenuFSM.new_dish)
-async def apply_dish_edit(message: Message, state: FSMContext):
+async def apply_dish_edit(message: Message, state: FSMContext, plan: str, session: AsyncSession):
     new_dish_name = message.text.strip()
     data = await state.get_data()
 
     await message.answer("Обновляю блюдо...")
 
-    async with AsyncSessionLocal() as session:
-        menu = await session.get(Menu, data["edit_menu_id"])
-        plan = await get_user_plan(session, message.from_user.id)
-
-        content = menu.content
-        day  = next((d for d in content["days"] if d["day"] == data["edit_day"]), None)
-        meal = next((m for m in day["meals"] if m["meal_type"] == data["edit_meal"]), None)
-
-        if meal and 0 <= data["edit_dish_idx"] < len(meal["dishes"]):
-            meal["dishes"][data["edit_dish_idx"]] = {
-                "name":                 new_dish_name,
-                "description":          "Блюдо добавлено пользователем",
-                "ingredients":          [],
-                "calories_per_serving": None,
-                "proteins":             None,
-                "fats":                 None,
-                "carbs":                None,
-            }
-
-        await session.execute(
-            update(Menu).where(Menu.id == data["edit_menu_id"]).values(content=content)
-        )
-        await session.commit()
-        await session.refresh(menu)
+    menu = await session.get(Menu, data["edit_menu_id"])
+    # Не держим соединение, пока ИИ подбирает блюдо
+    await session.commit()
+    if menu is None:
+        await message.answer("Меню не найдено. Начните редактирование заново.")
+        await state.clear()
+        return
+
+    try:
+        dish = await get_dish(new_dish_name, menu.diet_type, menu.num_people, plan)
+    except Exception as e:
+        logger.warning(f"Dish enrichment failed for {new_dish_name!r}: {e}")
+        dish = None
+
+    # Без данных о КБЖУ итоги дня не пересчитываем
+    recompute = dish is not None
+    if not dish:
+        dish = {
+            "name":                 new_dish_name,
+            "description":          "Блюдо добавлено пользователем",
+            "ingredients":          [],
+            "calories_per_serving": None,
+            "proteins":             None,
+            "fats":                 None,
+            "carbs":                None,
+        }
+
+    # Меняется одна строка блюда и итоги одного дня, а не всё меню
+    day = await replace_dish(session, data["edit_menu_id"], data["edit_day"], data["edit_meal"],
+                             data["edit_dish_idx"], dish, recompute=recompute)
+    if day is None:
+        await session.rollback()
+        await message.answer("Блюдо не найдено. Начните редактирование заново.")
+        await state.clear()
+        return
+
+    values = {"shopping_list": None}  # список покупок пересоберётся при следующем запросе
+    if recompute and menu.summary:
+        avg_kcal = await average_day_calories(session, data["edit_menu_id"])
+        values["summary"] = {**menu.summary, "avg_kcal": avg_kcal}
+    await session.execute(update(Menu).where(Menu.id == data["edit_menu_id"]).values(**values))
+    await session.commit()
 
     await message.answer(
-        f"✅ Блюдо заменено на: <b>{new_dish_name}</b>\n\n"
-        + format_menu_summary(menu.content, plan),
+        f"✅ Блюдо заменено на: <b>{new_dish_name}</b>\n"
+        + "\n".join(_format_day_lines(day, plan)),
         parse_mode="HTML",
         reply_markup=menu_actions_keyboard(data["edit_menu_id"], plan)
     )
@@ -1,18 +1,27 @@
+import asyncio
 import json
 import logging
-from aiogram import Router, F
+import time
+from aiogram import Bot, Router, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
 
-from database.db import AsyncSessionLocal, get_user_plan, get_or_create_user, Menu
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.db import AsyncSessionLocal, Menu, MenuJob, User, menu_summary
 from keyboards.keyboards import (
     diet_keyboard, days_keyboard, meals_keyboard,
     people_keyboard, confirm_cancel_keyboard, skip_keyboard, main_menu_keyboard
 )
-from services.groq_service import generate_menu
-from config import FREE_MAX_DAYS, TRIAL_MAX_DAYS
+from services.groq_service import generate_menu, GroqUnavailableError
+from services.recipe_cache import schedule_recipe_prefetch
+from services.menu_store import save_menu_content, load_menu_content
+from services.menu_jobs import enqueue_menu_job, queue_position
+from services.menu_schema import MEAL_NAMES
+from config import FREE_MAX_DAYS, TRIAL_MAX_DAYS, PROGRESS_EDIT_INTERVAL
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -28,17 +37,8 @@ class MenuFSM(StatesGroup):
     meals_select = State()
     meal_times = State()
     confirm = State()
-    generating = State()
 
 
-MEAL_NAMES = {
-    "breakfast": "Завтрак",
-    "brunch": "Второй завтрак",
-    "lunch": "Обед",
-    "snack": "Перекус",
-    "dinner": "Ужин",
-}
-
 DEFAULT_TIMES = {
     "breakfast": "08:00",
     "brunch": "11:00",
@@ -49,9 +49,11 @@ DEFAULT_TIMES = {
 
 
 @router.message(F.text == "\U0001f37d\ufe0f Создать меню")
-async def start_menu_creation(message: Message, state: FSMContext):
+async def start_menu_creation(message: Message, state: FSMContext, plan: str):
     await state.clear()
     await state.set_state(MenuFSM.diet)
+    # План нужен шагам выбора дней — раньше он в данные FSM не попадал
+    await state.update_data(plan=plan)
     await message.answer(
         "<b>Шаг 1/5: Выберите режим питания</b>\n\n"
         "От этого зависит подбор блюд и калорийность:",
@@ -345,99 +347,240 @@ async def cancel_menu(call: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(MenuFSM.confirm, F.data == "confirm_menu")
-async def confirm_and_generate(call: CallbackQuery, state: FSMContext):
-    await state.set_state(MenuFSM.generating)
+async def confirm_and_generate(call: CallbackQuery, state: FSMContext,
+                               user: User, plan: str, session: AsyncSession):
     data = await state.get_data()
 
-    async with AsyncSessionLocal() as session:
-        plan = await get_user_plan(session, call.from_user.id)
-        user = await get_or_create_user(session, call.from_user.id)
-
     num_days = data.get("num_days", 1)
     if plan == "free" and num_days > FREE_MAX_DAYS:
         num_days = FREE_MAX_DAYS
     # trial и paid — без ограничений
 
-    progress_msg = await call.message.edit_text(
-        "<b>Генерирую меню...</b>\n\n"
-        "ИИ составляет рецепты специально для вас. "
-        "Это займет 15-30 секунд.",
-        parse_mode="HTML"
+    # Сообщение — до постановки задания: после неё его уже правит обработчик очереди
+    position = await queue_position(session)
+    if position:
+        text = (
+            "<b>Меню в очереди на генерацию</b>\n\n"
+            f"Вы {position}-й в очереди. Генерация начнётся, как только "
+            "освободится место, — сообщение обновится само."
+        )
+    else:
+        text = (
+            "<b>Генерирую меню...</b>\n\n"
+            "ИИ составляет рецепты специально для вас. "
+            "Это займет 15-30 секунд."
+        )
+    progress_msg = await call.message.edit_text(text, parse_mode="HTML")
+
+    # Генерация идёт в фоне (services/menu_jobs.py) и переживает перезапуск бота
+    await enqueue_menu_job(
+        session, user,
+        chat_id=progress_msg.chat.id,
+        message_id=progress_msg.message_id,
+        plan=plan,
+        params={
+            "diet": data.get("diet"),
+            "num_people": data.get("num_people", 1),
+            "num_days": num_days,
+            "meals_config": data.get("meals_config", {
+                "breakfast": "08:00",
+                "lunch": "13:00",
+                "dinner": "19:00"
+            }),
+            "eaters": data.get("eaters", []),
+        },
     )
+    await state.clear()
+
+
+def _job_message(bot: Bot, job: MenuJob):
+    """Правка сообщения с прогрессом задания. Если сообщение удалено — итог придёт новым.
+    После итоговой правки запоздалые правки прогресса игнорируются."""
+    finished = False
+
+    async def edit(text: str, reply_markup=None, final: bool = False):
+        nonlocal finished
+        if finished:
+            return
+        finished = final
+        try:
+            await bot.edit_message_text(
+                text, chat_id=job.chat_id, message_id=job.message_id,
+                parse_mode="HTML", reply_markup=reply_markup
+            )
+        except TelegramBadRequest as e:
+            # «message is not modified» после перезапуска или сообщение уже удалено
+            if final and "not modified" not in str(e):
+                await bot.send_message(job.chat_id, text, parse_mode="HTML", reply_markup=reply_markup)
+
+    return edit
+
+
+async def run_menu_job(bot: Bot, job: MenuJob) -> int:
+    """Выполняет задание из очереди: генерация, сохранение меню, итог в сообщении."""
+    params, plan = job.params, job.plan
+    num_days = params["num_days"]
+    edit = _job_message(bot, job)
+
+    if job.menu_id:
+        # Меню уже сохранено, процесс упал до итогового сообщения — не генерируем заново
+        async with AsyncSessionLocal() as session:
+            menu_data = await load_menu_content(session, job.menu_id)
+        if menu_data is not None:
+            from keyboards.keyboards import menu_actions_keyboard
+            await edit(format_menu_summary(menu_data, plan),
+                       reply_markup=menu_actions_keyboard(job.menu_id, plan), final=True)
+            return job.menu_id
 
     try:
         menu_data = await generate_menu(
-            diet_type=data.get("diet"),
-            num_people=data.get("num_people", 1),
+            diet_type=params["diet"],
+            num_people=params["num_people"],
             num_days=num_days,
-            meals_config=data.get("meals_config", {
-                "breakfast": "08:00",
-                "lunch": "13:00",
-                "dinner": "19:00"
-            }),
-            eaters=data.get("eaters", []),
-            plan=plan
+            meals_config=params["meals_config"],
+            eaters=params["eaters"],
+            plan=plan,
+            on_day=_progress_updater(edit, num_days, plan),
+            on_queue=_queue_notifier(edit)
         )
 
         async with AsyncSessionLocal() as session:
-            from sqlalchemy import select
-            from database.db import User
-            result = await session.execute(
-                select(User).where(User.telegram_id == call.from_user.id)
-            )
-            db_user = result.scalar_one_or_none()
             menu = Menu(
-                user_id=db_user.id,
-                diet_type=data.get("diet"),
-                num_people=data.get("num_people", 1),
+                user_id=job.user_id,
+                diet_type=params["diet"],
+                num_people=params["num_people"],
                 num_days=num_days,
-                meals_per_day=data.get("meals_config"),
-                content=menu_data,
+                meals_per_day=params["meals_config"],
+                summary=menu_summary(menu_data),
                 status="draft"
             )
             session.add(menu)
+            await session.flush()
+            await save_menu_content(session, menu.id, menu_data)
+            # В той же транзакции: после перезапуска задание увидит готовое меню
+            await session.execute(update(MenuJob).where(MenuJob.id == job.id).values(menu_id=menu.id))
             await session.commit()
-            await session.refresh(menu)
             menu_id = menu.id
 
+        # Запросы рецептов для всех блюд — в фоне, пока пользователь читает меню
+        schedule_recipe_prefetch(menu_data, plan)
+
         summary = format_menu_summary(menu_data, plan)
         from keyboards.keyboards import menu_actions_keyboard
-        await progress_msg.edit_text(
-            summary,
-            parse_mode="HTML",
-            reply_markup=menu_actions_keyboard(menu_id, plan)
-        )
+        await edit(summary, reply_markup=menu_actions_keyboard(menu_id, plan), final=True)
+        return menu_id
 
+    except GroqUnavailableError as e:
+        logger.warning("Menu generation skipped, Groq unavailable: " + str(e))
+        await edit("<b>" + str(e) + "</b>", final=True)
+        raise
     except Exception as e:
         logger.error("Menu generation error: " + str(e))
-        await progress_msg.edit_text(
+        await edit(
             "<b>Ошибка при генерации меню.</b>\n\n"
             "Пожалуйста, попробуйте снова.\n\n"
             "Детали: " + str(e)[:200],
-            parse_mode="HTML"
+            final=True
         )
-    finally:
-        await state.clear()
+        raise
+
+
+def _progress_updater(edit, num_days: int, plan: str):
+    """Колбэк для потоковой генерации: показывает готовые дни в сообщении прогресса.
+
+    Правки не чаще PROGRESS_EDIT_INTERVAL, чтобы не упереться в лимиты Telegram;
+    дни, пришедшие между правками, показываются отложенной правкой.
+    """
+    ready = []
+    last_edit = 0.0
+    trailing = None
+
+    async def show():
+        nonlocal last_edit
+        last_edit = time.monotonic()
+        await edit(format_menu_progress(ready, num_days, plan))
+
+    async def show_later(delay: float):
+        nonlocal trailing
+        await asyncio.sleep(delay)
+        trailing = None
+        try:
+            await show()
+        except Exception as e:
+            logger.warning(f"Progress edit failed: {e}")
+
+    async def on_day(day: dict):
+        nonlocal trailing
+        ready.append(day)
+        if trailing is not None:
+            return  # отложенная правка покажет и этот день
+        wait = PROGRESS_EDIT_INTERVAL - (time.monotonic() - last_edit)
+        if wait > 0:
+            trailing = asyncio.create_task(show_later(wait))
+            return
+        await show()
+
+    return on_day
+
+
+def _queue_notifier(edit):
+    """Сообщает пользователю позицию в очереди, если лимиты Groq заняты."""
+    notified = False
+
+    async def on_queue(position: int, eta: float):
+        nonlocal notified
+        if notified:
+            return
+        notified = True
+        await edit(
+            "<b>Генерирую меню...</b>\n\n"
+            "Сейчас много запросов. Вы в очереди: " + str(position + 1) + ", "
+            "ожидание около " + str(int(eta) + 1) + " сек."
+        )
+
+    return on_queue
+
+
+def _format_day_lines(day: dict, plan: str) -> list:
+    lines = []
+    day_num = str(day.get("day", ""))
+    day_label = day.get("date_label", "День " + day_num)
+    lines.append("\n<b>" + day_label + "</b>")
+    for meal in day.get("meals", []):
+        meal_name = meal.get("meal_name", "")
+        meal_time = meal.get("time", "")
+        dishes = [d.get("name", "") for d in meal.get("dishes", [])]
+        cal = meal.get("total_calories", "")
+        if cal and plan != "free":
+            cal_str = " (" + str(cal) + " ккал)"
+        else:
+            cal_str = ""  # free — без калорий  # free скрывает калории
+        lines.append("  " + meal_name + " " + meal_time + cal_str)
+        for d in dishes:
+            lines.append("    - " + d)
+    return lines
+
+
+def format_menu_progress(days: list, num_days: int, plan: str) -> str:
+    header = (
+        "<b>Генерирую меню...</b> Готово дней: "
+        + str(len(days)) + " из " + str(num_days) + "\n"
+    )
+    body = []
+    # Куски длинного меню генерируются параллельно — дни приходят не по порядку
+    for day in sorted(days, key=lambda d: d.get("day", 0)):
+        body.extend(_format_day_lines(day, plan))
+    text = "\n".join(body)
+    # Лимит сообщения Telegram — 4096 символов, показываем последние дни
+    if len(text) > 3500:
+        text = "...\n" + text[-3500:].split("\n", 1)[-1]
+    return header + text
 
 
 def format_menu_summary(menu_data: dict, plan: str) -> str:
     lines = ["<b>Меню готово!</b>\n"]
     for day in menu_data.get("days", []):
-        day_num = str(day.get("day", ""))
-        day_label = day.get("date_label", "День " + day_num)
-        lines.append("\n<b>" + day_label + "</b>")
-        for meal in day.get("meals", []):
-            meal_name = meal.get("meal_name", "")
-            meal_time = meal.get("time", "")
-            dishes = [d.get("name", "") for d in meal.get("dishes", [])]
-            cal = meal.get("total_calories", "")
-            if cal and plan != "free":
-                cal_str = " (" + str(cal) + " ккал)"
-            else:
-                cal_str = ""  # free — без калорий  # free скрывает калории
-            lines.append("  " + meal_name + " " + meal_time + cal_str)
-            for d in dishes:
-                lines.append("    - " + d)
+        lines.extend(_format_day_lines(day, plan))
 
     if plan == "free":
         lines.append("\n\n<i>Калорийность и список покупок доступны в PRO</i>")
@@ -3,28 +3,28 @@ import urllib.parse
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from database.db import AsyncSessionLocal, Menu, get_user_plan
-from services.groq_service import suggest_recipe_queries
+from sqlalchemy.ext.asyncio import AsyncSession
+from services.menu_store import load_menu_content
+from services.recipe_cache import get_recipe_queries
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 
 @router.callback_query(F.data.startswith("recipes:"))
-async def show_recipes(call: CallbackQuery):
+async def show_recipes(call: CallbackQuery, plan: str, session: AsyncSession):
     menu_id = int(call.data.split(":")[1])
 
-    async with AsyncSessionLocal() as session:
-        plan = await get_user_plan(session, call.from_user.id)
-        menu = await session.get(Menu, menu_id)
+    content = await load_menu_content(session, menu_id)
+    await session.commit()
 
-    if not menu:
+    if not content:
         await call.answer("Меню не найдено!", show_alert=True)
         return
 
     # Collect all dishes
     all_dishes = []
-    for day in menu.content.get("days", []):
+    for day in content.get("days", []):
         for meal in day.get("meals", []):
             # Only free plan hides dinner recipes
             if plan == "free" and meal.get("meal_type") == "dinner":
@@ -60,17 +60,19 @@ async def show_recipes(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("recipe_dish:"))
-async def get_dish_recipe(call: CallbackQuery):
+async def get_dish_recipe(call: CallbackQuery, plan: str, session: AsyncSession):
     parts = call.data.split(":")
     menu_id = int(parts[1])
     dish_idx = int(parts[2])
 
-    async with AsyncSessionLocal() as session:
-        plan = await get_user_plan(session, call.from_user.id)
-        menu = await session.get(Menu, menu_id)
+    content = await load_menu_content(session, menu_id)
+    await session.commit()
+    if not content:
+        await call.answer("Меню не найдено!", show_alert=True)
+        return
 
     all_dishes = []
-    for day in menu.content.get("days", []):
+    for day in content.get("days", []):
         for meal in day.get("meals", []):
             if plan == "free" and meal.get("meal_type") == "dinner":
                 continue
@@ -84,10 +86,7 @@ async def get_dish_recipe(call: CallbackQuery):
     dish_name = all_dishes[dish_idx]
     await call.answer("Ищу рецепты...")
 
-    try:
-        queries = await suggest_recipe_queries(dish_name)
-    except Exception:
-        queries = [f"рецепт {dish_name}", f"{dish_name} пошаговый рецепт"]
+    queries = await get_recipe_queries(dish_name, plan)
 
     builder = InlineKeyboardBuilder()
     for q in queries:
@@ -2,8 +2,12 @@ import io
 import logging
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, BufferedInputFile
-from database.db import AsyncSessionLocal, Menu, get_user_plan
-from services.groq_service import generate_shopping_list
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from database.db import Menu
+from services.menu_store import load_menu_content, delete_menu_content
+from services.shopping_service import build_shopping_list
 from services.pdf_service import generate_shopping_pdf, generate_menu_pdf
 
 logger = logging.getLogger(__name__)
@@ -11,12 +15,11 @@ router = Router()
 
 
 @router.callback_query(F.data.startswith("shopping:"))
-async def send_shopping_list(call: CallbackQuery):
+async def send_shopping_list(call: CallbackQuery, plan: str, session: AsyncSession):
     menu_id = int(call.data.split(":")[1])
 
-    async with AsyncSessionLocal() as session:
-        plan = await get_user_plan(session, call.from_user.id)
-        menu = await session.get(Menu, menu_id)
+    menu = await session.get(Menu, menu_id, options=[undefer(Menu.shopping_list)])
+    await session.commit()
 
     if not menu:
         await call.answer("Меню не найдено!", show_alert=True)
@@ -33,14 +36,14 @@ async def send_shopping_list(call: CallbackQuery):
         if menu.shopping_list:
             shopping_data = menu.shopping_list
         else:
-            shopping_data = await generate_shopping_list(menu.content, menu.num_people)
+            content = await load_menu_content(session, menu_id)
+            await session.commit()
+            shopping_data = await build_shopping_list(content, plan)
             # Save
-            async with AsyncSessionLocal() as session:
-                from sqlalchemy import update
-                await session.execute(
-                    update(Menu).where(Menu.id == menu_id).values(shopping_list=shopping_data)
-                )
-                await session.commit()
+            await session.execute(
+                update(Menu).where(Menu.id == menu_id).values(shopping_list=shopping_data)
+            )
+            await session.commit()
 
         meta = {
             "diet_type": menu.diet_type,
@@ -62,12 +65,12 @@ async def send_shopping_list(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("menu_pdf:"))
-async def send_menu_pdf(call: CallbackQuery):
+async def send_menu_pdf(call: CallbackQuery, plan: str, session: AsyncSession):
     menu_id = int(call.data.split(":")[1])
 
-    async with AsyncSessionLocal() as session:
-        plan = await get_user_plan(session, call.from_user.id)
-        menu = await session.get(Menu, menu_id)
+    menu = await session.get(Menu, menu_id)
+    content = await load_menu_content(session, menu_id) if menu else None
+    await session.commit()
 
     if not menu:
         await call.answer("Меню не найдено!", show_alert=True)
@@ -81,7 +84,7 @@ async def send_menu_pdf(call: CallbackQuery):
             "num_days": menu.num_days,
             "num_people": menu.num_people
         }
-        pdf_bytes = generate_menu_pdf(menu.content, meta, plan)
+        pdf_bytes = generate_menu_pdf(content, meta, plan)
 
         await call.message.answer_document(
             BufferedInputFile(pdf_bytes, filename=f"menu_{menu_id}.pdf"),
@@ -96,11 +99,11 @@ async def send_menu_pdf(call: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("delete_menu:"))
-async def delete_menu(call: CallbackQuery):
+async def delete_menu(call: CallbackQuery, session: AsyncSession):
     menu_id = int(call.data.split(":")[1])
-    async with AsyncSessionLocal() as session:
-        menu = await session.get(Menu, menu_id)
-        if menu:
-            await session.delete(menu)
-            await session.commit()
+    menu = await session.get(Menu, menu_id)
+    if menu:
+        await delete_menu_content(session, menu_id)
+        await session.delete(menu)
+        await session.commit()
     await call.message.edit_text("🗑️ Меню удалено.")
@@ -2,7 +2,7 @@ from aiogram import Router, F
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message
 from sqlalchemy.ext.asyncio import AsyncSession
-from database.db import get_or_create_user, get_user_plan, AsyncSessionLocal
+from database.db import User
 from keyboards.keyboards import main_menu_keyboard, subscription_keyboard
 
 router = Router()
@@ -31,16 +31,8 @@ PLAN_INFO = {
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message):
-    async with AsyncSessionLocal() as session:
-        user = await get_or_create_user(
-            session,
-            message.from_user.id,
-            message.from_user.username,
-            message.from_user.full_name
-        )
-        plan = await get_user_plan(session, message.from_user.id)
-
+async def cmd_start(message: Message, plan: str):
+    # Пользователь уже создан middleware (UserContextMiddleware)
     emoji, plan_name, _ = PLAN_INFO.get(plan, PLAN_INFO["free"])
     await message.answer(
         WELCOME_TEXT.format(
@@ -79,16 +71,7 @@ async def cmd_help(message: Message):
 
 
 @router.message(F.text == "👤 Мой профиль")
-async def my_profile(message: Message):
-    async with AsyncSessionLocal() as session:
-        plan = await get_user_plan(session, message.from_user.id)
-        from sqlalchemy import select
-        from database.db import User, EaterProfile
-        result = await session.execute(
-            select(User).where(User.telegram_id == message.from_user.id)
-        )
-        user = result.scalar_one_or_none()
-
+async def my_profile(message: Message, user: User, plan: str):
     emoji, plan_name, features = PLAN_INFO.get(plan, PLAN_INFO["free"])
 
     profile_text = f"""👤 <b>Ваш профиль</b>
@@ -2,8 +2,8 @@ import logging
 from datetime import datetime, timedelta
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message, LabeledPrice, PreCheckoutQuery
-from sqlalchemy import select, update
-from database.db import AsyncSessionLocal, User, Payment, get_user_plan
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.db import User, Payment, invalidate_user_plan
 from keyboards.keyboards import main_menu_keyboard, subscription_keyboard
 from config import SUBSCRIPTION_PRICE_RUB, PAYMENT_TOKEN, TRIAL_DAYS
 
@@ -12,10 +12,7 @@ router = Router()
 
 
 @router.message(F.text == "💎 Подписка")
-async def subscription_menu(message: Message):
-    async with AsyncSessionLocal() as session:
-        plan = await get_user_plan(session, message.from_user.id)
-
+async def subscription_menu(message: Message, plan: str):
     plan_info = {
         "free": "🆓 Бесплатный план",
         "trial": "🎁 Триал период",
@@ -49,26 +46,17 @@ async def subscription_menu(message: Message):
 
 
 @router.callback_query(F.data == "sub:trial")
-async def activate_trial(call: CallbackQuery):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == call.from_user.id)
-        )
-        user = result.scalar_one_or_none()
-
-        if not user:
-            await call.answer("Ошибка: пользователь не найден", show_alert=True)
-            return
-
-        if user.plan in ("trial", "paid"):
-            await call.answer("Триал уже был активирован или у вас PRO подписка!", show_alert=True)
-            return
+async def activate_trial(call: CallbackQuery, user: User, session: AsyncSession):
+    if user.plan in ("trial", "paid"):
+        await call.answer("Триал уже был активирован или у вас PRO подписка!", show_alert=True)
+        return
 
-        now = datetime.utcnow()
-        user.plan = "trial"
-        user.trial_start = now
-        user.trial_end = now + timedelta(days=TRIAL_DAYS)
-        await session.commit()
+    now = datetime.utcnow()
+    user.plan = "trial"
+    user.trial_start = now
+    user.trial_end = now + timedelta(days=TRIAL_DAYS)
+    await session.commit()
+    invalidate_user_plan(call.from_user.id)
 
     await call.message.edit_text(
         f"🎉 <b>Триал активирован!</b>\n\n"
@@ -108,29 +96,24 @@ async def pre_checkout(query: PreCheckoutQuery):
 
 
 @router.message(F.successful_payment)
-async def payment_success(message: Message):
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == message.from_user.id)
-        )
-        user = result.scalar_one_or_none()
-        if user:
-            now = datetime.utcnow()
-            if user.paid_until and user.paid_until > now:
-                user.paid_until += timedelta(days=30)
-            else:
-                user.paid_until = now + timedelta(days=30)
-            user.plan = "paid"
-
-            payment = Payment(
-                user_id=user.id,
-                amount=SUBSCRIPTION_PRICE_RUB,
-                currency="RUB",
-                status="success",
-                payment_id=message.successful_payment.telegram_payment_charge_id
-            )
-            session.add(payment)
-            await session.commit()
+async def payment_success(message: Message, user: User, session: AsyncSession):
+    now = datetime.utcnow()
+    if user.paid_until and user.paid_until > now:
+        user.paid_until += timedelta(days=30)
+    else:
+        user.paid_until = now + timedelta(days=30)
+    user.plan = "paid"
+
+    payment = Payment(
+        user_id=user.id,
+        amount=SUBSCRIPTION_PRICE_RUB,
+        currency="RUB",
+        status="success",
+        payment_id=message.successful_payment.telegram_payment_charge_id
+    )
+    session.add(payment)
+    await session.commit()
+    invalidate_user_plan(message.from_user.id)
 
     await message.answer(
         "🎉 <b>Оплата прошла успешно!</b>\n\n"
@@ -4,8 +4,10 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy import select
-from database.db import AsyncSessionLocal, Menu, User, get_user_plan
-from services.groq_service import generate_nutrition_tip, substitute_ingredient
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.db import Menu, User
+from services.groq_service import substitute_ingredient
+from services.tip_pool import pop_tip
 from keyboards.keyboards import menu_actions_keyboard, main_menu_keyboard
 
 logger = logging.getLogger(__name__)
@@ -18,10 +20,9 @@ class SubstituteFSM(StatesGroup):
 
 # ── DAILY TIP ──────────────────────────────────────────────────────────────────
 @router.message(F.text == "💡 Совет дня")
-async def daily_tip(message: Message):
-    await message.answer("⏳ Генерирую совет...")
+async def daily_tip(message: Message, plan: str):
     try:
-        tip = await generate_nutrition_tip()
+        tip = await pop_tip(message.from_user.id, plan)
         await message.answer(
             f"💡 <b>Совет по питанию</b>\n\n{tip}\n\n"
             f"<i>Хотите ещё? Нажмите кнопку снова!</i>",
@@ -44,31 +45,22 @@ async def substitute_start(message: Message, state: FSMContext):
 
 
 @router.message(SubstituteFSM.ingredient)
-async def get_substitutes(message: Message, state: FSMContext):
+async def get_substitutes(message: Message, state: FSMContext, user: User, plan: str, session: AsyncSession):
     ingredient = message.text.strip()
     await state.clear()
 
-    async with AsyncSessionLocal() as session:
-        plan = await get_user_plan(session, message.from_user.id)
-
     # Get diet from last menu
     diet = "правильное"
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            select(User).where(User.telegram_id == message.from_user.id)
-        )
-        user = result.scalar_one_or_none()
-        if user:
-            menu_result = await session.execute(
-                select(Menu).where(Menu.user_id == user.id).order_by(Menu.created_at.desc()).limit(1)
-            )
-            last_menu = menu_result.scalar_one_or_none()
-            if last_menu:
-                diet = last_menu.diet_type
+    last_diet = await session.scalar(
+        select(Menu.diet_type).where(Menu.user_id == user.id).order_by(Menu.created_at.desc()).limit(1)
+    )
+    await session.commit()
+    if last_diet:
+        diet = last_diet
 
     await message.answer(f"⏳ Ищу замены для «{ingredient}»...")
     try:
-        result = await substitute_ingredient(ingredient, diet)
+        result = await substitute_ingredient(ingredient, diet, plan)
         subs = result.get("substitutes", [])
         notes = result.get("notes", "")
         text = (
@@ -83,21 +75,12 @@ async def get_substitutes(message: Message, state: FSMContext):
 
 # ── MY MENUS ──────────────────────────────────────────────────────────────────
 @router.message(F.text == "📋 Мои меню")
-async def my_menus(message: Message):
-    async with AsyncSessionLocal() as session:
-        plan = await get_user_plan(session, message.from_user.id)
-        result = await session.execute(
-            select(User).where(User.telegram_id == message.from_user.id)
-        )
-        user = result.scalar_one_or_none()
-        if not user:
-            await message.answer("Профиль не найден.")
-            return
-
-        menus_result = await session.execute(
-            select(Menu).where(Menu.user_id == user.id).order_by(Menu.created_at.desc()).limit(5)
-        )
-        menus = menus_result.scalars().all()
+async def my_menus(message: Message, user: User, plan: str, session: AsyncSession):
+    menus_result = await session.execute(
+        select(Menu).where(Menu.user_id == user.id).order_by(Menu.created_at.desc()).limit(5)
+    )
+    menus = menus_result.scalars().all()
+    await session.commit()
 
     if not menus:
         await message.answer(
@@ -112,10 +95,14 @@ async def my_menus(message: Message):
 
     for menu in menus:
         diet_name = diet_labels.get(menu.diet_type, menu.diet_type)
+        summary = menu.summary or {}
         text = (
             f"🍽️ <b>{diet_name}</b>\n"
             f"📅 {menu.num_days} дней | 👥 {menu.num_people} чел.\n"
-            f"🕐 {menu.created_at.strftime('%d.%m.%Y %H:%M')}"
+            + (f"🍴 {summary['dishes']} блюд" if summary.get("dishes") else "")
+            + (f" | 🔥 ~{summary['avg_kcal']} ккал/день" if summary.get("avg_kcal") and plan != "free" else "")
+            + ("\n" if summary.get("dishes") else "")
+            + f"🕐 {menu.created_at.strftime('%d.%m.%Y %H:%M')}"
         )
         await message.answer(
             text,
@@ -1,13 +1,27 @@
 import asyncio
+import hashlib
 import logging
 import os
+import signal
+import time
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import BOT_TOKEN, GROQ_API_KEY
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from config import (
+    BOT_TOKEN, GROQ_API_KEY, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_DRAIN_TIMEOUT,
+    WORKERS, WORKER_INDEX, WORKER_BASE_PORT,
+)
 from database.db import init_db
+from database.fsm_storage import create_fsm_storage
+from services.groq_service import init_client, close_client, pool_stats
+from services.tip_pool import start_tip_refiller, stop_tip_refiller
+from services.llm_metrics import start_metrics_flusher, stop_metrics_flusher
+from services.menu_jobs import start_menu_jobs, stop_menu_jobs
+from middlewares.user_context import UserContextMiddleware
 from handlers import (
     start, settings, menu_generation, menu_edit,
-    shopping_list, recipes, subscription, support, tips
+    shopping_list, recipes, subscription, support, tips, admin
 )
 
 logging.basicConfig(
@@ -17,17 +31,18 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def main():
-    # Диагностика переменных окружения
-    logger.info(f"GROQ_API_KEY present: {bool(GROQ_API_KEY)}")
-    logger.info(f"GROQ_API_KEY length: {len(GROQ_API_KEY)}")
-    logger.info(f"GROQ_API_KEY starts with: {GROQ_API_KEY[:7] if GROQ_API_KEY else 'EMPTY'}")
+def webhook_secret() -> str:
+    # Одинаковый у всех экземпляров за балансировщиком, даже если WEBHOOK_SECRET не задан
+    return WEBHOOK_SECRET or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()
 
-    bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
 
-    await init_db()
+def build_dispatcher() -> Dispatcher:
+    # Состояние мастеров переживает перезапуск (FSM_STORAGE, по умолчанию — таблица в БД)
+    dp = Dispatcher(storage=create_fsm_storage())
+
+    # Пользователь, план и сессия БД — один раз на апдейт, для всех обработчиков
+    dp.message.middleware(UserContextMiddleware())
+    dp.callback_query.middleware(UserContextMiddleware())
 
     dp.include_router(start.router)
     dp.include_router(settings.router)
@@ -38,10 +53,157 @@ async def main():
     dp.include_router(subscription.router)
     dp.include_router(support.router)
     dp.include_router(tips.router)
+    dp.include_router(admin.router)
+    return dp
+
+
+async def wait_for_stop_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+async def _watch_loop_lag(lag: dict, interval: float = 0.5):
+    # Насколько позже срока просыпается цикл — видно, когда CPU-работа стопорит остальных
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        late = (time.perf_counter() - started - interval) * 1000
+        lag["max_ms"] = max(lag["max_ms"], late)
+
+
+async def serve_updates(bot: Bot, dp: Dispatcher, host: str, port: int, on_started=None):
+    """aiohttp-сервер апдейтов: WEBHOOK_PATH + /health. Работает до SIGTERM/SIGINT,
+    затем дообрабатывает принятые апдейты не дольше WEBHOOK_DRAIN_TIMEOUT."""
+    state = {"draining": False}
+    lag = {"max_ms": 0.0}
+    # Ответ сразу, обработка — в фоне: долгая генерация меню не вызывает повторов
+    handler = SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=webhook_secret())
+
+    async def health(request: web.Request) -> web.Response:
+        # 503 при остановке — балансировщик перестаёт слать сюда запросы
+        status = 503 if state["draining"] else 200
+        body = {
+            "status": "draining" if state["draining"] else "ok",
+            "pid": os.getpid(),
+            "in_flight": len(handler._background_feed_update_tasks),
+            "loop_lag_max_ms": round(lag["max_ms"], 1),  # с прошлого запроса /health
+            "llm_pool": pool_stats(),
+        }
+        lag["max_ms"] = 0.0
+        return web.json_response(body, status=status)
+
+    app = web.Application()
+    handler.register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/health", health)
+
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    lag_task = asyncio.create_task(_watch_loop_lag(lag))
+    if on_started is not None:
+        await on_started()
+    logger.info(f"Update server listening on {host}:{port}")
+
+    try:
+        await wait_for_stop_signal()
+    finally:
+        state["draining"] = True
+        lag_task.cancel()
+        await site.stop()
+        pending = set(handler._background_feed_update_tasks)
+        if pending:
+            logger.info(f"Waiting for {len(pending)} in-flight updates")
+            _, not_done = await asyncio.wait(pending, timeout=WEBHOOK_DRAIN_TIMEOUT)
+            if not_done:
+                logger.warning(f"{len(not_done)} updates still running after {WEBHOOK_DRAIN_TIMEOUT}s, cancelling")
+                for task in not_done:
+                    task.cancel()
+                await asyncio.gather(*not_done, return_exceptions=True)
+        # on_shutdown приложения закрывает и сессию бота
+        await runner.cleanup()
+
 
-    logger.info("Bot started!")
+async def run_polling(bot: Bot, dp: Dispatcher):
+    # getUpdates не работает, пока у бота установлен webhook
+    await bot.delete_webhook(drop_pending_updates=False)
     await dp.start_polling(bot)
 
 
+async def set_webhook(bot: Bot, allowed_updates: list):
+    url = WEBHOOK_URL + WEBHOOK_PATH
+    info = await bot.get_webhook_info()
+    if info.url != url:
+        # Экземпляры за балансировщиком ставят один и тот же адрес — лишний раз не дёргаем API
+        await bot.set_webhook(
+            url, secret_token=webhook_secret(),
+            allowed_updates=allowed_updates, drop_pending_updates=False,
+        )
+    logger.info(f"Webhook url {url}")
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    if not WEBHOOK_URL:
+        raise RuntimeError("BOT_MODE=webhook требует WEBHOOK_URL")
+    # Webhook при остановке не снимаем: остальные экземпляры (или следующий деплой) продолжают принимать апдейты
+    await serve_updates(
+        bot, dp, WEBHOOK_HOST, WEBHOOK_PORT,
+        on_started=lambda: set_webhook(bot, dp.resolve_used_update_types()),
+    )
+
+
+async def run_worker(bot: Bot, dp: Dispatcher):
+    # Апдейты приходят только от супервизора (supervisor.py)
+    await serve_updates(bot, dp, "127.0.0.1", WORKER_BASE_PORT + WORKER_INDEX)
+
+
+async def main():
+    if WORKERS > 1 and WORKER_INDEX is None:
+        from supervisor import run_supervisor
+        await run_supervisor()
+        return
+
+    # Диагностика переменных окружения
+    logger.info(f"GROQ_API_KEY present: {bool(GROQ_API_KEY)}")
+    logger.info(f"GROQ_API_KEY length: {len(GROQ_API_KEY)}")
+    logger.info(f"GROQ_API_KEY starts with: {GROQ_API_KEY[:7] if GROQ_API_KEY else 'EMPTY'}")
+
+    bot = Bot(token=BOT_TOKEN)
+    dp = build_dispatcher()
+
+    # В режиме нескольких процессов схему БД готовит супервизор
+    if WORKER_INDEX is None:
+        await init_db()
+    await init_client()
+    start_metrics_flusher()
+    # Пул советов общий (в БД) — пополняет его один процесс
+    if not WORKER_INDEX:
+        start_tip_refiller()
+    # Очередь генерации меню разбирают все процессы; задания, прерванные перезапуском, продолжаются
+    start_menu_jobs(menu_generation.run_menu_job, bot)
+
+    if WORKER_INDEX is not None:
+        logger.info(f"Worker {WORKER_INDEX} started, pid {os.getpid()}")
+    else:
+        logger.info(f"Bot started! Mode: {BOT_MODE}")
+    try:
+        if WORKER_INDEX is not None:
+            await run_worker(bot, dp)
+        elif BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
+    finally:
+        await stop_menu_jobs()
+        # Несохранённые шаги мастеров — в БД (в webhook-режиме shutdown диспетчера не вызывается)
+        await dp.storage.close()
+        await stop_tip_refiller()
+        await stop_metrics_flusher()
+        await close_client()
+
+
 if __name__ == "__main__":
     asyncio.run(main())
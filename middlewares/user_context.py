@@ -0,0 +1,36 @@
+from aiogram import BaseMiddleware
+from database.db import AsyncSessionLocal, get_or_create_user, effective_plan, remember_plan, current_plan
+from services.llm_metrics import bind_user
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Передаёт в обработчик `plan`, `session` и — если обработчик его
+    принимает — `user`.
+
+    План берётся из кэша (в webhook без супервизора — из БД, см. current_plan);
+    пользователь загружается (или создаётся) одним UPSERT только для
+    обработчиков с параметром `user` и при промахе.
+    Сессия — единица работы обработчика: изменения фиксирует сам обработчик
+    через session.commit(). Соединение с БД после загрузки пользователя
+    отпускается, так что долгие вызовы ИИ не держат его занятым.
+    """
+
+    async def __call__(self, handler, event, data):
+        tg_user = data.get("event_from_user")
+        if tg_user is None or tg_user.is_bot:
+            return await handler(event, data)
+
+        bind_user(tg_user.id)
+        handler_object = data.get("handler")
+        needs_user = handler_object is None or "user" in handler_object.params
+        async with AsyncSessionLocal() as session:
+            plan = None if needs_user else await current_plan(session, tg_user.id)
+            if plan is None:
+                user = await get_or_create_user(session, tg_user.id, tg_user.username, tg_user.full_name)
+                plan, expires = effective_plan(user)
+                remember_plan(tg_user.id, plan, expires)
+                data["user"] = user
+
+            data["session"] = session
+            data["plan"] = plan
+            return await handler(event, data)
@@ -0,0 +1,86 @@
+import hashlib
+import logging
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from database.db import AsyncSessionLocal, DishCache
+from services.groq_service import generate_dish, backend, DISH_PROMPT_VERSION
+from services.recipe_cache import normalize_dish_name
+
+logger = logging.getLogger(__name__)
+
+_stats = {"hits": 0, "misses": 0}
+
+
+def dish_cache_key(dish_name: str, diet_type: str) -> str:
+    raw = "|".join([
+        normalize_dish_name(dish_name), (diet_type or "").strip().lower(),
+        backend.model, str(DISH_PROMPT_VERSION),
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def scale_dish(dish: dict, dish_name: str, num_people: int) -> dict:
+    """Блюдо на одну порцию → на num_people: граммовки умножаются, КБЖУ порции — нет."""
+    ingredients = []
+    for ing in dish.get("ingredients", []):
+        ing = dict(ing)
+        amount = ing.get("amount")
+        if isinstance(amount, (int, float)) and not isinstance(amount, bool):
+            scaled = amount * max(1, int(num_people))
+            ing["amount"] = int(scaled) if float(scaled).is_integer() else round(scaled, 1)
+        ingredients.append(ing)
+    return {
+        "name": dish_name,
+        "description": dish.get("description", ""),
+        "ingredients": ingredients,
+        "calories_per_serving": dish.get("calories_per_serving"),
+        "proteins": dish.get("proteins"),
+        "fats": dish.get("fats"),
+        "carbs": dish.get("carbs"),
+    }
+
+
+async def get_dish(dish_name: str, diet_type: str, num_people: int, plan: str = "free") -> dict:
+    """Полное блюдо для правки меню: из общего кэша или одним коротким вызовом ИИ."""
+    key = dish_cache_key(dish_name, diet_type)
+    async with AsyncSessionLocal() as session:
+        cached = await session.scalar(select(DishCache.content).where(DishCache.cache_key == key))
+        if cached:
+            await session.execute(
+                update(DishCache).where(DishCache.cache_key == key).values(hits=DishCache.hits + 1)
+            )
+            await session.commit()
+            _stats["hits"] += 1
+            return scale_dish(cached, dish_name, num_people)
+
+    _stats["misses"] += 1
+    dish = await generate_dish(dish_name, diet_type, plan)
+    async with AsyncSessionLocal() as session:
+        session.add(DishCache(cache_key=key, dish_name=dish_name, content=dish))
+        try:
+            await session.commit()
+        except IntegrityError:
+            # То же блюдо параллельно сгенерировал другой пользователь
+            await session.rollback()
+    return scale_dish(dish, dish_name, num_people)
+
+
+def _calories(value) -> int:
+    try:
+        return int(round(float(value)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def recompute_totals(day: dict):
+    """Пересчитывает калорийность приёмов пищи и дня по блюдам."""
+    for meal in day.get("meals", []):
+        meal["total_calories"] = sum(
+            _calories(d.get("calories_per_serving")) for d in meal.get("dishes", [])
+        )
+    day["day_total_calories"] = sum(m["total_calories"] for m in day.get("meals", []))
+
+
+def dish_cache_stats() -> dict:
+    total = _stats["hits"] + _stats["misses"]
+    return {**_stats, "hit_rate": round(_stats["hits"] / total, 3) if total else 0.0}
@@ -0,0 +1,236 @@
+"""Локальный фейковый OpenAI-совместимый сервер для нагрузочных тестов без Groq.
+
+Отвечает валидными по схеме меню, составом блюд, категориями продуктов,
+запросами рецептов, советами и заменами,
+с настраиваемыми задержками, долей ошибок и потоковой выдачей (SSE).
+
+Запуск отдельно:  python -m services.fake_llm --port 8081
+и в боте:         LLM_BACKEND=openai LLM_BASE_URL=http://127.0.0.1:8081/v1
+Или прямо в процессе бота: LLM_BACKEND=fake
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+import uuid
+from aiohttp import web
+from config import (
+    FAKE_LLM_LATENCY_MS, FAKE_LLM_LATENCY_SIGMA, FAKE_LLM_ERROR_RATE, FAKE_LLM_TOKENS_PER_SEC,
+)
+
+logger = logging.getLogger(__name__)
+
+MODEL = "fake-llm"
+
+DISH_BASES = [
+    "Омлет", "Овсянка", "Гречка", "Запечённая курица", "Суп", "Салат", "Рагу",
+    "Творожная запеканка", "Паста", "Рыба на пару", "Плов", "Котлеты", "Сырники",
+]
+DISH_GARNISH = [
+    "с овощами", "с зеленью", "с грибами", "с сыром", "с ягодами", "по-домашнему",
+    "с томатами", "с брокколи", "с тыквой", "с орехами",
+]
+INGREDIENTS = [
+    ("Куриное филе", "г"), ("Яйцо", "шт"), ("Овсяные хлопья", "г"), ("Гречка", "г"),
+    ("Молоко", "мл"), ("Творог", "г"), ("Помидор", "шт"), ("Огурец", "шт"),
+    ("Брокколи", "г"), ("Оливковое масло", "ст.л."), ("Соль", "ч.л."), ("Рис", "г"),
+    ("Морковь", "шт"), ("Лук репчатый", "шт"), ("Сыр", "г"), ("Филе трески", "г"),
+]
+CATEGORIES = [
+    "Мясо и рыба", "Овощи и фрукты", "Молочные продукты", "Крупы и злаки",
+    "Масла и соусы", "Специи и приправы", "Прочее",
+]
+TIPS = [
+    "Пейте воду в течение дня небольшими порциями. Жажду легко спутать с голодом.",
+    "Добавляйте овощи в каждый приём пищи. Клетчатка дольше сохраняет чувство сытости.",
+    "Старайтесь ужинать за 2–3 часа до сна. Так пищеварение не мешает восстановлению.",
+    "Белок на завтрак снижает тягу к сладкому во второй половине дня.",
+]
+
+
+def _dish(calories: int, hide_calories: bool) -> dict:
+    dish = {
+        "name": f"{random.choice(DISH_BASES)} {random.choice(DISH_GARNISH)}",
+        "description": "Простое сытное блюдо",
+        "ingredients": [
+            {"name": name, "amount": random.choice([1, 2, 50, 100, 150, 200]), "unit": unit}
+            for name, unit in random.sample(INGREDIENTS, 4)
+        ],
+        "proteins": random.randint(5, 35),
+        "fats": random.randint(3, 25),
+        "carbs": random.randint(10, 70),
+    }
+    if not hide_calories:
+        dish["calories_per_serving"] = calories
+    return dish
+
+
+def _compact_dish(dish: dict) -> dict:
+    compact = {
+        "n": dish["name"], "s": dish["description"],
+        "i": [[i["name"], i["amount"], i["unit"]] for i in dish["ingredients"]],
+        "b": [dish["proteins"], dish["fats"], dish["carbs"]],
+    }
+    if "calories_per_serving" in dish:
+        compact["k"] = dish["calories_per_serving"]
+    return compact
+
+
+def _menu(prompt: str) -> dict:
+    """Меню в компактной схеме services/menu_schema — как просит промпт."""
+    days = int(re.search(r"Количество дней: (\d+)", prompt).group(1))
+    span = re.search(r"дни с (\d+) по (\d+)", prompt)
+    day_from = int(span.group(1)) if span else 1
+    meals = re.findall(r"^  - (\w+): \d\d:\d\d$", prompt, re.M) or ["breakfast"]
+    hide_dinner = "Для ужина НЕ указывай калорийность" in prompt
+
+    result = []
+    for day in range(day_from, day_from + days):
+        day_meals = []
+        for meal_type in meals:
+            hide = hide_dinner and meal_type == "dinner"
+            dishes = [_dish(random.randint(150, 600), hide) for _ in range(random.randint(1, 2))]
+            day_meals.append({"t": meal_type, "x": [_compact_dish(d) for d in dishes]})
+        result.append({"n": day, "m": day_meals})
+    return {"d": result}
+
+
+def _section(prompt: str, title: str) -> list:
+    """Строки после заголовка вида 'ПРОДУКТЫ:' до пустой строки."""
+    match = re.search(rf"{title}[^\n]*:\n(.*?)(?:\n\n|$)", prompt, re.S)
+    return [line.strip() for line in match.group(1).splitlines() if line.strip()] if match else []
+
+
+def _queries(dish: str) -> list:
+    return [f"рецепт {dish}", f"{dish} пошагово", f"как приготовить {dish}"]
+
+
+def _respond(prompt: str) -> str:
+    """Текст ответа по виду промпта — так же, как их различает groq_service."""
+    if '{"d":[' in prompt:
+        return json.dumps(_menu(prompt), ensure_ascii=False, separators=(",", ":"))
+    if "КБЖУ на 1 порцию" in prompt:
+        dish = _dish(random.randint(150, 600), False)
+        dish.pop("name")
+        return json.dumps(dish, ensure_ascii=False)
+    if "Отнеси каждый продукт" in prompt:
+        names = _section(prompt, "ПРОДУКТЫ")
+        return json.dumps({str(i): random.randint(1, len(CATEGORIES)) for i in range(1, len(names) + 1)})
+    if "БЛЮДА:" in prompt:
+        dishes = [re.sub(r"^\d+\.\s*", "", line) for line in _section(prompt, "БЛЮДА")]
+        return json.dumps({str(i): _queries(d) for i, d in enumerate(dishes, start=1)},
+                          ensure_ascii=False)
+    if "поисковых запроса" in prompt:
+        dish = re.search(r'блюда "([^"]+)"', prompt)
+        return json.dumps(_queries(dish.group(1) if dish else "блюдо"), ensure_ascii=False)
+    count = re.search(r"Дай (\d+) разных", prompt)
+    if count:
+        tips = [f"{random.choice(TIPS)} ({uuid.uuid4().hex[:6]})" for _ in range(int(count.group(1)))]
+        return json.dumps(tips, ensure_ascii=False)
+    if "совет" in prompt:
+        return random.choice(TIPS)
+    if "замены" in prompt:
+        return json.dumps({"substitutes": ["Вариант 1", "Вариант 2", "Вариант 3"],
+                           "notes": "Подходит для выбранного режима питания"}, ensure_ascii=False)
+    return "ok"
+
+
+def create_app(latency_ms: float = FAKE_LLM_LATENCY_MS, latency_sigma: float = FAKE_LLM_LATENCY_SIGMA,
+               error_rate: float = FAKE_LLM_ERROR_RATE,
+               tokens_per_sec: float = FAKE_LLM_TOKENS_PER_SEC) -> web.Application:
+    stats = {"requests": 0, "errors": 0, "streams": 0}
+
+    def ttft() -> float:
+        # Логнормальное распределение: медиана latency_ms, хвост задаётся sigma
+        return random.lognormvariate(0, latency_sigma) * latency_ms / 1000
+
+    async def completions(request: web.Request):
+        stats["requests"] += 1
+        body = await request.json()
+        if random.random() < error_rate:
+            stats["errors"] += 1
+            await asyncio.sleep(ttft() / 2)
+            if random.random() < 0.5:
+                return web.json_response({"error": {"message": "rate limited"}}, status=429,
+                                         headers={"retry-after": "1"})
+            return web.json_response({"error": {"message": "internal error"}}, status=500)
+
+        prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+        content = _respond(prompt)
+        finish_reason = "stop"
+        max_chars = int(body.get("max_tokens", 8000)) * 3
+        if len(content) > max_chars:
+            content, finish_reason = content[:max_chars], "length"
+        usage = {"prompt_tokens": len(prompt) // 3, "completion_tokens": len(content) // 3}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        generation = usage["completion_tokens"] / tokens_per_sec if tokens_per_sec else 0
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft() + generation)
+            return web.json_response({
+                "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion",
+                "created": int(time.time()), "model": body.get("model", MODEL),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+
+        stats["streams"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(ttft())
+        pieces = [content[i:i + 60] for i in range(0, len(content), 60)] or [""]
+        delay = generation / len(pieces)
+        for piece in pieces:
+            chunk = {"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            if delay:
+                await asyncio.sleep(delay)
+        last = {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+                "x_groq": {"usage": usage}}
+        await response.write(f"data: {json.dumps(last)}\n\ndata: [DONE]\n\n".encode())
+        await response.write_eof()
+        return response
+
+    async def health(request: web.Request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    app.router.add_get("/stats", health)
+    return app
+
+
+async def start_fake_server(host: str = "127.0.0.1", port: int = 0, **options) -> tuple:
+    """Запускает сервер в текущем event loop. Возвращает (runner, base_url)."""
+    runner = web.AppRunner(create_app(**options))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    base_url = f"http://{host}:{bound_port}/v1"
+    logger.info(f"Fake LLM server listening on {base_url}")
+    return runner, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый LLM-сервер для нагрузочных тестов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=FAKE_LLM_LATENCY_MS)
+    parser.add_argument("--sigma", type=float, default=FAKE_LLM_LATENCY_SIGMA)
+    parser.add_argument("--error-rate", type=float, default=FAKE_LLM_ERROR_RATE)
+    parser.add_argument("--tps", type=float, default=FAKE_LLM_TOKENS_PER_SEC)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(
+        create_app(args.latency_ms, args.sigma, args.error_rate, args.tps),
+        host=args.host, port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import logging
+import random
+import time
+from collections import deque
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class GroqUnavailableError(Exception):
+    """Groq недоступен — circuit breaker открыт или исчерпаны повторы."""
+
+    def __init__(self, message: str = "Сервис ИИ временно недоступен. Попробуйте через пару минут."):
+        super().__init__(message)
+
+
+def _retry_after(exc: Exception):
+    if isinstance(exc, httpx.HTTPStatusError):
+        value = exc.response.headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+def is_outage(exc: Exception) -> bool:
+    """Ошибки, которые говорят о недоступности Groq (429 — это лимит, не сбой)."""
+    if isinstance(exc, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return False
+
+
+class RetryPolicy:
+    def __init__(self, max_retries: int, base: float, cap: float, max_retry_after: float):
+        self.max_retries = max_retries
+        self.base = base
+        self.cap = cap
+        self.max_retry_after = max_retry_after
+        self.stats = {"retries": 0, "gave_up": 0}
+
+    def delay(self, attempt: int, exc: Exception):
+        """Пауза перед повтором или None, если повторять не нужно.
+
+        Экспоненциальная задержка с full jitter; Retry-After от сервера — нижняя граница.
+        """
+        if attempt >= self.max_retries or not is_retryable(exc):
+            return None
+        retry_after = _retry_after(exc)
+        if retry_after is not None and retry_after > self.max_retry_after:
+            return None
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """closed → (N сбоев подряд) → open → (reset_timeout) → half_open → один пробный запрос."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def before_call(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.stats["rejected"] += 1
+                raise GroqUnavailableError()
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                self.stats["rejected"] += 1
+                raise GroqUnavailableError()
+            self._probe_in_flight = True
+
+    def abandon(self):
+        """Вызов отменён без результата — пробный слот освобождается."""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self, exc: Exception):
+        if not is_outage(exc):
+            if self.state == "half_open":
+                self._probe_in_flight = False
+            return
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.error(f"Groq circuit breaker opened after {self.failures} failures: {exc}")
+                self.stats["opened"] += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        retry_in = 0.0
+        if self.state == "open":
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        return {"state": self.state, "failures": self.failures,
+                "retry_in": round(retry_in, 1), **self.stats}
+
+
+class LatencyTracker:
+    """Скользящее окно задержек по типам вызовов — для порога хеджирования."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples = {}
+
+    def record(self, call_type: str, seconds: float):
+        self._samples.setdefault(call_type, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, call_type: str, q: float, min_samples: int = 20):
+        samples = self._samples.get(call_type)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
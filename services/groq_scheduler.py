@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+PLAN_RANK = {"paid": 0, "trial": 1, "free": 2}
+
+
+def priority_for(plan: str = "free", background: bool = False) -> tuple:
+    """Меньше — важнее. Интерактивные запросы всегда раньше фоновых,
+    внутри группы: paid > trial > free."""
+    return (1 if background else 0, PLAN_RANK.get(plan, 2))
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, per_minute: float):
+        self.capacity = float(capacity)
+        self.rate = per_minute / 60.0
+        self.level = float(capacity)
+        self._updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def time_until(self, amount: float) -> float:
+        deficit = min(amount, self.capacity) - self.level
+        return max(0.0, deficit / self.rate) if self.rate > 0 else 0.0
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Ticket:
+    def __init__(self, tokens: int, priority: tuple, queued_at: float):
+        self.tokens = tokens
+        self.priority = priority
+        self.queued_at = queued_at
+        self.waited = 0.0
+
+
+class GroqScheduler:
+    """Очередь запросов к Groq с приоритетами и двумя token bucket:
+    запросы в минуту (RPM) и токены в минуту (TPM).
+
+    Перед вызовом из TPM списывается оценка (промпт + max_tokens),
+    после ответа — разница с фактическим usage возвращается или досписывается.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm, rpm)
+        self.tokens = TokenBucket(tpm, tpm)
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = asyncio.Condition()
+        self.stats = {"granted": 0, "waited_total": 0.0, "max_wait": 0.0, "throttled": 0}
+
+    def _refill(self):
+        self.requests.refill()
+        self.tokens.refill()
+
+    def estimate_wait(self, tokens: int, priority: tuple, entry=None) -> tuple:
+        """Позиция в очереди и оценка ожидания в секундах для запроса."""
+        self._refill()
+        key = entry[:2] if entry is not None else [priority, float("inf")]
+        ahead = [e for e in self._queue if e[:2] < key]
+        need_requests = len(ahead) + 1
+        need_tokens = sum(e[2] for e in ahead) + tokens
+        wait = max(
+            (need_requests - self.requests.level) / max(self.requests.rate, 1e-9),
+            (need_tokens - self.tokens.level) / max(self.tokens.rate, 1e-9),
+            0.0,
+        )
+        return len(ahead), wait
+
+    async def acquire(self, tokens: int, priority: tuple, on_wait=None) -> Ticket:
+        tokens = int(min(tokens, self.tokens.capacity))
+        entry = [priority, next(self._seq), tokens]
+        ticket = Ticket(tokens, priority, time.monotonic())
+        heapq.heappush(self._queue, entry)
+        try:
+            if on_wait is not None:
+                position, eta = self.estimate_wait(tokens, priority, entry)
+                if eta >= 1:
+                    try:
+                        await on_wait(position, eta)
+                    except Exception as e:
+                        logger.warning(f"on_wait callback failed: {e}")
+
+            async with self._cond:
+                while True:
+                    self._refill()
+                    wait = 1.0
+                    if self._queue[0] is entry:
+                        wait = max(self.requests.time_until(1), self.tokens.time_until(tokens))
+                        if wait <= 0:
+                            heapq.heappop(self._queue)
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            self._cond.notify_all()
+                            break
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=max(wait, 0.05))
+                    except asyncio.TimeoutError:
+                        pass
+        except BaseException:
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            raise
+
+        ticket.waited = time.monotonic() - ticket.queued_at
+        self.stats["granted"] += 1
+        self.stats["waited_total"] += ticket.waited
+        self.stats["max_wait"] = max(self.stats["max_wait"], ticket.waited)
+        return ticket
+
+    def settle(self, ticket: Ticket, used_tokens: int = None):
+        """Сверка с фактическим usage. Без usage (ошибка запроса) возвращаем
+        предоплату целиком — токены не были потрачены."""
+        self._refill()
+        if used_tokens is None:
+            self.tokens.give_back(ticket.tokens)
+        elif used_tokens < ticket.tokens:
+            self.tokens.give_back(ticket.tokens - used_tokens)
+        else:
+            self.tokens.take(used_tokens - ticket.tokens)
+
+    def throttle(self):
+        """Groq ответил 429 — считаем, что бюджет запросов на эту минуту исчерпан."""
+        self._refill()
+        self.requests.level = min(self.requests.level, 0.0)
+        self.stats["throttled"] += 1
+
+    def pressure(self) -> float:
+        self._refill()
+        if self._queue:
+            return 1.0
+        return max(
+            1 - self.requests.level / self.requests.capacity,
+            1 - self.tokens.level / self.tokens.capacity,
+        )
+
+    def snapshot(self) -> dict:
+        self._refill()
+        granted = self.stats["granted"]
+        return {
+            "queued": len(self._queue),
+            "rpm_available": round(self.requests.level, 1),
+            "tpm_available": round(self.tokens.level),
+            "avg_wait": round(self.stats["waited_total"] / granted, 3) if granted else 0.0,
+            "max_wait": round(self.stats["max_wait"], 3),
+            "granted": granted,
+            "throttled": self.stats["throttled"],
+        }
@@ -1,29 +1,420 @@
+import asyncio
+import hashlib
 import json
 import logging
+import time
 import httpx
-from config import GROQ_API_KEY, GROQ_MODEL
+from config import (
+    GROQ_HTTP2,
+    GROQ_MAX_CONNECTIONS, GROQ_MAX_KEEPALIVE, GROQ_KEEPALIVE_EXPIRY,
+    GROQ_CONNECT_TIMEOUT, GROQ_READ_TIMEOUT, GROQ_POOL_TIMEOUT,
+    MENU_STREAMING, MENU_CHUNK_MEALS, MENU_CHUNK_CONCURRENCY, MENU_AVOID_DISHES_LIMIT,
+    MENU_CONTINUATION_ATTEMPTS,
+    GROQ_RPM, GROQ_TPM,
+    GROQ_MAX_RETRIES, GROQ_RETRY_BASE, GROQ_RETRY_CAP, GROQ_MAX_RETRY_AFTER,
+    GROQ_BREAKER_FAILURES, GROQ_BREAKER_RESET, GROQ_SHORT_TIMEOUT, HEDGE_PERCENTILE,
+)
+from services.groq_scheduler import GroqScheduler, priority_for
+from services.groq_resilience import (
+    GroqUnavailableError, RetryPolicy, CircuitBreaker, LatencyTracker,
+    is_retryable, is_outage,
+)
+from services.menu_parser import DaysStreamParser, recover_days
+from services.menu_schema import DAYS_KEY, SCHEMA_EXAMPLE, SCHEMA_LEGEND, expand_day
+from services.menu_cache import menu_cache_key, get_cached_menu, put_cached_menu
+from services.llm_metrics import record_call
+from services.prompt_encoder import estimate_tokens, numbered, decode_numbered, track_savings
+from services.llm_backend import create_backend
+from services.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
-GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+# Увеличивать при любом изменении промпта меню — старые записи кэша перестанут совпадать
+MENU_PROMPT_VERSION = 2
+DISH_PROMPT_VERSION = 1
 
+_client: httpx.AsyncClient | None = None
+backend = create_backend()
+scheduler = GroqScheduler(rpm=GROQ_RPM, tpm=GROQ_TPM)
+retry_policy = RetryPolicy(GROQ_MAX_RETRIES, GROQ_RETRY_BASE, GROQ_RETRY_CAP, GROQ_MAX_RETRY_AFTER)
+breaker = CircuitBreaker(GROQ_BREAKER_FAILURES, GROQ_BREAKER_RESET)
+latency = LatencyTracker()
+coalescer = SingleFlight()
+_hedge_stats = {"hedged": 0, "hedge_won": 0}
 
-async def _chat(messages: list, max_tokens: int = 8000, temperature: float = 0.7) -> str:
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json",
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=GROQ_MAX_CONNECTIONS,
+        max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+        keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        GROQ_READ_TIMEOUT,
+        connect=GROQ_CONNECT_TIMEOUT,
+        pool=GROQ_POOL_TIMEOUT,
+    )
+    return httpx.AsyncClient(
+        http2=GROQ_HTTP2,
+        limits=limits,
+        timeout=timeout,
+        headers=backend.headers(),
+    )
+
+
+async def init_client():
+    """Создаёт общий клиент Groq. Вызывается один раз при старте бота."""
+    global _client
+    await backend.start()
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+        logger.info(
+            f"LLM client ready: backend={backend.name}, model={backend.model}, http2={GROQ_HTTP2}, "
+            f"max_connections={GROQ_MAX_CONNECTIONS}, keepalive={GROQ_MAX_KEEPALIVE}"
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        logger.info(f"Closing Groq client, pool: {pool_stats()}")
+        await _client.aclose()
+        _client = None
+    await backend.stop()
+
+
+def get_client() -> httpx.AsyncClient:
+    # Ленивое создание — для скриптов и случаев, когда init_client() не вызывали
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+_pool_events = {"pool_timeouts": 0}
+
+
+def _note_pool_timeout():
+    # Ждали свободное соединение дольше GROQ_POOL_TIMEOUT — пул мал для текущей нагрузки
+    _pool_events["pool_timeouts"] += 1
+    logger.warning(f"Groq pool exhausted: {pool_stats()}")
+
+
+def pool_stats() -> dict:
+    """Состояние пула: активные, простаивающие соединения и ожидающие запросы.
+
+    Снимок по запросу (/health, /stats, таймаут пула), не на каждый вызов Groq.
+    """
+    stats = {"active": 0, "idle": 0, "waiting": 0, "max": GROQ_MAX_CONNECTIONS, **_pool_events}
+    if _client is None:
+        return stats
+    # httpx не даёт публичного API для пула — читаем состояние httpcore
+    pool = getattr(_client._transport, "_pool", None)
+    if pool is None:
+        return stats
+    for conn in pool.connections:
+        if conn.is_idle():
+            stats["idle"] += 1
+        else:
+            stats["active"] += 1
+    stats["waiting"] = sum(1 for r in getattr(pool, "_requests", []) if r.is_queued())
+    return stats
+
+
+# Последние значения заголовков x-ratelimit-* от Groq
+_rate_limits = {}
+
+
+def _track_rate_limits(response: httpx.Response):
+    for kind in ("requests", "tokens"):
+        limit = response.headers.get(f"x-ratelimit-limit-{kind}")
+        remaining = response.headers.get(f"x-ratelimit-remaining-{kind}")
+        if limit and remaining:
+            try:
+                _rate_limits[kind] = (int(remaining), int(limit))
+            except ValueError:
+                pass
+
+
+def rate_limit_pressure() -> float:
+    """Загрузка лимитов Groq (0 — свободно, 1 — лимит исчерпан или есть очередь).
+
+    Учитывает и собственные token bucket планировщика, и заголовки x-ratelimit-*.
+    """
+    pressure = scheduler.pressure()
+    for remaining, limit in _rate_limits.values():
+        if limit > 0:
+            pressure = max(pressure, 1 - remaining / limit)
+    return pressure
+
+
+def _estimate_tokens(messages: list) -> int:
+    return estimate_tokens("".join(m.get("content", "") for m in messages))
+
+
+def _outcome(exc: BaseException = None) -> str:
+    if exc is None:
+        return "ok"
+    if isinstance(exc, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    if isinstance(exc, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return "http_429" if status == 429 else f"http_{status // 100}xx"
+    return "error"
+
+
+def _settle(ticket, response: httpx.Response, usage: dict = None):
+    if response is not None and response.status_code == 429:
+        scheduler.throttle()
+    total = (usage or {}).get("total_tokens")
+    scheduler.settle(ticket, int(total) if total is not None else None)
+
+
+async def _post_once(payload: dict, messages: list, plan: str, background: bool,
+                     on_wait, call_type: str, timeout) -> tuple:
+    ticket = await scheduler.acquire(
+        _estimate_tokens(messages) + payload["max_tokens"], priority_for(plan, background), on_wait
+    )
+    client = get_client()
+    response = None
+    usage = None
+    finish_reason = None
+    error = None
+    started = time.monotonic()
+    try:
+        if timeout is not None:
+            response = await client.post(backend.chat_url, json=payload, timeout=timeout)
+        else:
+            response = await client.post(backend.chat_url, json=payload)
+        _track_rate_limits(response)
+        response.raise_for_status()
+        data = response.json()
+        usage = data.get("usage")
+        latency.record(call_type, time.monotonic() - started)
+        choice = data["choices"][0]
+        finish_reason = choice.get("finish_reason")
+        return choice["message"]["content"].strip(), finish_reason
+    except BaseException as e:
+        error = e
+        if isinstance(e, httpx.PoolTimeout):
+            _note_pool_timeout()
+        raise
+    finally:
+        _settle(ticket, response, usage)
+        record_call(call_type, plan, backend.model, usage, time.monotonic() - started,
+                    finish_reason, _outcome(error))
+
+
+async def _hedged(call_type: str, make_call) -> tuple:
+    """Если ответ дольше обычного (перцентиль HEDGE_PERCENTILE), параллельно
+    отправляем второй такой же запрос и берём тот, что придёт первым."""
+    threshold = latency.percentile(call_type, HEDGE_PERCENTILE)
+    primary = asyncio.create_task(make_call())
+    if threshold is None or breaker.state != "closed":
+        return await primary
+    done, _ = await asyncio.wait({primary}, timeout=threshold)
+    if done:
+        return primary.result()
+
+    _hedge_stats["hedged"] += 1
+    backup = asyncio.create_task(make_call())
+    pending = {primary, backup}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is backup:
+                        _hedge_stats["hedge_won"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in (primary, backup):
+            if not task.done():
+                task.cancel()
+
+
+def _give_up(attempt: int, exc: Exception):
+    """Пауза перед повтором или исключение, которое нужно пробросить наверх."""
+    delay = retry_policy.delay(attempt, exc)
+    if delay is not None:
+        retry_policy.stats["retries"] += 1
+        logger.warning(f"Groq call failed ({exc!r}), retry {attempt + 1} in {delay:.1f}s")
+        return delay, None
+    if is_retryable(exc):
+        retry_policy.stats["gave_up"] += 1
+    if is_outage(exc):
+        return None, GroqUnavailableError()
+    return None, exc
+
+
+def _request_key(messages: list, max_tokens: int, temperature: float) -> str:
+    raw = json.dumps(
+        {"model": backend.model, "messages": messages,
+         "max_tokens": max_tokens, "temperature": temperature},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def _complete(messages: list, max_tokens: int = 8000, temperature: float = 0.7,
+                    plan: str = "free", background: bool = False, on_wait=None,
+                    call_type: str = "chat", hedge: bool = False) -> tuple:
+    """Одинаковые запросы, идущие одновременно (двойные нажатия, популярные блюда),
+    склеиваются в один вызов Groq."""
+    return await coalescer.do(
+        call_type, _request_key(messages, max_tokens, temperature),
+        lambda: _call(messages, max_tokens, temperature, plan, background, on_wait,
+                      call_type, hedge),
+    )
+
+
+async def _call(messages: list, max_tokens: int = 8000, temperature: float = 0.7,
+                plan: str = "free", background: bool = False, on_wait=None,
+                call_type: str = "chat", hedge: bool = False) -> tuple:
+    """Один запрос к Groq с повторами, circuit breaker и (для коротких вызовов)
+    хеджированием. Возвращает (текст, finish_reason).
+    Бросает GroqUnavailableError, если Groq лежит."""
+    payload = {
+        "model": backend.model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
     }
+    timeout = GROQ_SHORT_TIMEOUT if hedge else None
+
+    def make_call():
+        return _post_once(payload, messages, plan, background, on_wait, call_type, timeout)
+
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await (_hedged(call_type, make_call) if hedge else make_call())
+        except Exception as e:
+            breaker.record_failure(e)
+            delay, error = _give_up(attempt, e)
+            if error is e:
+                raise
+            if error is not None:
+                raise error from e
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException:
+            breaker.abandon()
+            raise
+        breaker.record_success()
+        return result
+
+
+async def _chat(messages: list, max_tokens: int = 8000, temperature: float = 0.7,
+                plan: str = "free", background: bool = False, on_wait=None,
+                call_type: str = "chat", hedge: bool = False) -> str:
+    content, _ = await _complete(messages, max_tokens, temperature, plan, background,
+                                 on_wait, call_type, hedge)
+    return content
+
+
+async def _stream_once(payload: dict, messages: list, plan: str, background: bool, on_wait,
+                       meta: dict, call_type: str):
+    ticket = await scheduler.acquire(
+        _estimate_tokens(messages) + payload["max_tokens"], priority_for(plan, background), on_wait
+    )
+    client = get_client()
+    response = None
+    usage = None
+    error = None
+    started = time.monotonic()
+    try:
+        async with client.stream("POST", backend.chat_url, json=payload) as response:
+            _track_rate_limits(response)
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                # Groq кладёт usage в x_groq последнего чанка, OpenAI — в корень
+                usage = chunk.get("usage") or chunk.get("x_groq", {}).get("usage") or usage
+                choices = chunk.get("choices") or [{}]
+                if choices[0].get("finish_reason"):
+                    meta["finish_reason"] = choices[0]["finish_reason"]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+    except BaseException as e:
+        error = e
+        if isinstance(e, httpx.PoolTimeout):
+            _note_pool_timeout()
+        raise
+    finally:
+        _settle(ticket, response, usage)
+        record_call(call_type, plan, backend.model, usage, time.monotonic() - started,
+                    meta.get("finish_reason"), _outcome(error))
+
+
+async def _chat_stream(messages: list, max_tokens: int = 8000, temperature: float = 0.7,
+                       plan: str = "free", background: bool = False, on_wait=None,
+                       call_type: str = "menu", meta: dict = None):
+    """То же, что _chat, но отдаёт текст ответа кусками по мере генерации (SSE).
+    finish_reason последнего чанка записывается в meta.
+
+    Повтор возможен, только пока не отдан первый кусок — иначе текст задвоится.
+    """
+    meta = meta if meta is not None else {}
     payload = {
-        "model": GROQ_MODEL,
+        "model": backend.model,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+    attempt = 0
+    while True:
+        breaker.before_call()
+        started = time.monotonic()
+        yielded = False
+        try:
+            async for delta in _stream_once(payload, messages, plan, background, on_wait, meta,
+                                           call_type):
+                yielded = True
+                yield delta
+        except Exception as e:
+            breaker.record_failure(e)
+            if yielded:
+                raise
+            delay, error = _give_up(attempt, e)
+            if error is e:
+                raise
+            if error is not None:
+                raise error from e
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        except BaseException:
+            breaker.abandon()
+            raise
+        breaker.record_success()
+        latency.record(call_type, time.monotonic() - started)
+        return
+
+
+def resilience_stats() -> dict:
+    return {
+        "breaker": breaker.snapshot(),
+        "retries": dict(retry_policy.stats),
+        "hedging": dict(_hedge_stats),
+        "coalescing": coalescer.snapshot(),
     }
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(GROQ_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        return data["choices"][0]["message"]["content"].strip()
 
 
 def _clean_json(content: str) -> str:
@@ -48,23 +439,66 @@ DIET_DESCRIPTIONS = {
 }
 
 
-async def generate_menu(diet_type, num_people, num_days, meals_config, eaters, plan):
-    diet_desc = DIET_DESCRIPTIONS.get(diet_type, diet_type)
-    eaters_info = "\n".join(
+def _validate_menu(menu_data) -> list:
+    """Список дней из ответа (компактная схема или, если ИИ её проигнорировал, полная)."""
+    days = None
+    if isinstance(menu_data, dict):
+        days = menu_data.get(DAYS_KEY) or menu_data.get("days")
+    if not isinstance(days, list) or not days:
+        raise ValueError("Ошибка обработки ответа ИИ. Попробуйте снова.")
+    return days
+
+
+async def _stream_menu(messages: list, max_tokens: int, on_day,
+                       plan: str = "free", on_wait=None, meta: dict = None) -> str:
+    parser = DaysStreamParser(DAYS_KEY)
+    parts = []
+    async for delta in _chat_stream(messages, max_tokens=max_tokens, plan=plan,
+                                    on_wait=on_wait, meta=meta):
+        parts.append(delta)
+        for day in parser.feed(delta):
+            try:
+                await on_day(day)
+            except Exception as e:
+                # Прогресс — второстепенное, генерацию из-за него не роняем
+                logger.warning(f"on_day callback failed: {e}")
+    return "".join(parts).strip()
+
+
+def _eaters_prompt(eaters: list) -> str:
+    return "\n".join(
         [f"- {e.get('name', f'Человек {i+1}')}, возраст {e.get('age', '?')} лет"
          + (f", предпочтения: {e['preferences']}" if e.get('preferences') else "")
          for i, e in enumerate(eaters)]
     )
+
+
+def _build_menu_prompt(diet_type, num_people, day_from, day_to, total_days,
+                       meals_config, eaters, plan, avoid_dishes=None) -> str:
+    diet_desc = DIET_DESCRIPTIONS.get(diet_type, diet_type)
+    eaters_info = _eaters_prompt(eaters)
     meals_list = ", ".join(meals_config.keys())
     meal_times = "\n".join([f"  - {k}: {v}" for k, v in meals_config.items()])
     hide_dinner_calories = plan == "free"
+    num_days = day_to - day_from + 1
+
+    if num_days == total_days:
+        days_line = f"- Количество дней: {num_days}"
+    else:
+        days_line = (
+            f"- Количество дней: {num_days} (дни с {day_from} по {day_to} "
+            f"из меню на {total_days} дней)"
+        )
+    avoid_line = ""
+    if avoid_dishes:
+        avoid_line = "\n6. Не повторяй блюда, уже вошедшие в меню: " + "; ".join(avoid_dishes)
 
-    prompt = f"""Ты профессиональный диетолог и шеф-повар. Составь подробное меню питания.
+    return f"""Ты профессиональный диетолог и шеф-повар. Составь подробное меню питания.
 
 ПАРАМЕТРЫ:
 - Режим питания: {diet_desc}
 - Количество людей: {num_people}
-- Количество дней: {num_days}
+{days_line}
 - Приёмы пищи: {meals_list}
 - Время приёмов пищи:
 {meal_times}
@@ -77,94 +511,258 @@ async def generate_menu(diet_type, num_people, num_days, meals_config, eaters, p
 2. Для каждого блюда укажи: название, ингредиенты с граммовкой на {num_people} чел., калорийность порции
 3. Учитывай возраст и предпочтения едоков
 4. Блюда должны быть разнообразными, не повторяться
-5. {'Для ужина НЕ указывай калорийность (ограничение бесплатного плана)' if hide_dinner_calories else 'Указывай калорийность всех блюд'}
-
-Верни СТРОГО валидный JSON следующей структуры (без markdown, только JSON):
-{{
-  "days": [
-    {{
-      "day": 1,
-      "date_label": "День 1",
-      "meals": [
-        {{
-          "meal_type": "breakfast",
-          "meal_name": "Завтрак",
-          "time": "08:00",
-          "dishes": [
-            {{
-              "name": "Название блюда",
-              "description": "Краткое описание",
-              "ingredients": [
-                {{"name": "Ингредиент", "amount": 100, "unit": "г"}}
-              ],
-              "calories_per_serving": 350,
-              "proteins": 15,
-              "fats": 10,
-              "carbs": 45
-            }}
-          ],
-          "total_calories": 350
-        }}
-      ],
-      "day_total_calories": 1800
-    }}
-  ],
-  "diet_type": "{diet_type}",
-  "num_people": {num_people}
-}}"""
+5. {'Для ужина НЕ указывай калорийность (ограничение бесплатного плана)' if hide_dinner_calories else 'Указывай калорийность всех блюд'}{avoid_line}
+
+Верни СТРОГО валидный JSON в компактном формате (без markdown и без отступов, только JSON):
+{SCHEMA_EXAMPLE}
+Ключи: {SCHEMA_LEGEND}.
+Первый день — {day_from}. Если калорийность блюда не нужна, ключ k не указывай."""
+
+
+def _renumber_day(day: dict, number: int) -> dict:
+    day["day"] = number
+    day["date_label"] = f"День {number}"
+    return day
+
+
+def _dish_names(days: list) -> list:
+    return [
+        dish.get("name", "")
+        for day in days
+        for meal in day.get("meals", [])
+        for dish in meal.get("dishes", [])
+        if dish.get("name")
+    ]
+
 
+def _chunk_ranges(num_days: int, meals_count: int) -> list:
+    # Размер куска зависит от числа приёмов пищи: ответ должен влезть в max_tokens
+    size = max(1, MENU_CHUNK_MEALS // max(1, meals_count))
+    return [(start, min(start + size - 1, num_days)) for start in range(1, num_days + 1, size)]
+
+
+def _parse_days(content: str, expected: int, finish_reason, day_from: int, day_to: int,
+                meals_config: dict) -> list:
+    """Дни из ответа в формате Menu.content. Если JSON оборван (max_tokens) или битый —
+    достаём все полностью завершённые дни, остальное догенерирует продолжение."""
     try:
-        content = await _chat([{"role": "user", "content": prompt}], max_tokens=8000)
-        return json.loads(_clean_json(content))
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parse error: {e}")
+        days = _validate_menu(json.loads(_clean_json(content)))[:expected]
+    except (json.JSONDecodeError, ValueError) as e:
+        days = (recover_days(content, DAYS_KEY) or recover_days(content))[:expected]
+        if finish_reason == "length":
+            logger.warning(
+                f"Menu truncated at max_tokens (days {day_from}-{day_to}), "
+                f"recovered {len(days)} of {expected} days"
+            )
+        else:
+            logger.error(
+                f"JSON parse error (days {day_from}-{day_to}): {e}, "
+                f"recovered {len(days)} of {expected} days"
+            )
+    return [expand_day(day, meals_config) for day in days]
+
+
+async def _generate_chunk(diet_type, num_people, day_from, day_to, total_days,
+                          meals_config, eaters, plan, avoid_dishes, on_day=None,
+                          on_wait=None, attempt: int = 0) -> list:
+    prompt = _build_menu_prompt(
+        diet_type, num_people, day_from, day_to, total_days,
+        meals_config, eaters, plan, avoid_dishes
+    )
+    messages = [{"role": "user", "content": prompt}]
+    expected = day_to - day_from + 1
+    meta = {}
+
+    if on_day is not None and MENU_STREAMING:
+        streamed = 0
+
+        async def on_chunk_day(day):
+            nonlocal streamed
+            if streamed >= expected:
+                return
+            streamed += 1
+            await on_day(_renumber_day(expand_day(day, meals_config), day_from + streamed - 1))
+
+        content = await _stream_menu(messages, 8000, on_chunk_day, plan, on_wait, meta)
+    else:
+        content, meta["finish_reason"] = await _complete(
+            messages, max_tokens=8000, plan=plan, on_wait=on_wait, call_type="menu"
+        )
+
+    days = _parse_days(content, expected, meta.get("finish_reason"), day_from, day_to, meals_config)
+    days = [_renumber_day(day, day_from + i) for i, day in enumerate(days)]
+
+    missing_from = day_from + len(days)
+    if missing_from > day_to:
+        return days
+    if attempt >= MENU_CONTINUATION_ATTEMPTS:
         raise ValueError("Ошибка обработки ответа ИИ. Попробуйте снова.")
+
+    # Продолжение: просим только недостающие дни, уже готовые блюда не повторяем
+    logger.info(f"Requesting continuation for days {missing_from}-{day_to}")
+    avoid = list(dict.fromkeys(list(avoid_dishes or []) + _dish_names(days)))
+    rest = await _generate_chunk(
+        diet_type, num_people, missing_from, day_to, total_days,
+        meals_config, eaters, plan, avoid[-MENU_AVOID_DISHES_LIMIT:], on_day,
+        on_wait, attempt + 1
+    )
+    return days + rest
+
+
+async def generate_menu(diet_type, num_people, num_days, meals_config, eaters, plan,
+                        on_day=None, on_queue=None):
+    """Генерирует меню. Если передан on_day, ответ читается потоком и
+    on_day(day) вызывается для каждого готового дня до завершения генерации.
+    on_queue(position, eta) вызывается, если запрос ждёт в очереди к Groq.
+
+    Длинные меню делятся на диапазоны дней, которые генерируются параллельно
+    (не больше MENU_CHUNK_CONCURRENCY одновременно) и склеиваются по порядку.
+    """
+    cache_key = menu_cache_key(
+        diet_type, num_people, num_days, meals_config, _eaters_prompt(eaters),
+        plan == "free", backend.model, MENU_PROMPT_VERSION
+    )
+    try:
+        cached = await get_cached_menu(cache_key)
+    except Exception as e:
+        logger.warning(f"Menu cache read failed: {e}")
+        cached = None
+    if cached:
+        return cached
+
+    # Одинаковый запрос, пока меню ещё генерируется, ждёт ту же генерацию; прогресс
+    # и позиция в очереди рассылаются всем ждущим — в том числе разным пользователям
+    return await coalescer.do("menu_request", cache_key, lambda fanout: _generate_menu(
+        cache_key, diet_type, num_people, num_days, meals_config, eaters, plan,
+        fanout.emitter("on_day") if on_day else None, fanout.emitter("on_queue")
+    ), events={"on_day": on_day, "on_queue": on_queue})
+
+
+async def _generate_menu(cache_key, diet_type, num_people, num_days, meals_config, eaters,
+                         plan, on_day=None, on_queue=None):
+    ranges = _chunk_ranges(num_days, len(meals_config))
+    semaphore = asyncio.Semaphore(MENU_CHUNK_CONCURRENCY)
+    used_dishes = []
+
+    async def run_chunk(day_from, day_to):
+        async with semaphore:
+            # Куски, стартующие позже, видят блюда уже готовых кусков
+            avoid = list(dict.fromkeys(used_dishes))[-MENU_AVOID_DISHES_LIMIT:]
+            days = await _generate_chunk(
+                diet_type, num_people, day_from, day_to, num_days,
+                meals_config, eaters, plan, avoid, on_day, on_queue
+            )
+            used_dishes.extend(_dish_names(days))
+            return days
+
+    try:
+        chunks = await asyncio.gather(*(run_chunk(a, b) for a, b in ranges))
     except Exception as e:
         logger.error(f"Groq API error: {e}")
         raise
 
+    days = [day for chunk in chunks for day in chunk]
+    for i, day in enumerate(days, start=1):
+        _renumber_day(day, i)
+    menu_data = {"days": days, "diet_type": diet_type, "num_people": num_people}
 
-async def generate_shopping_list(menu_data, num_people):
-    prompt = f"""На основе меню сформируй единый список покупок.
+    try:
+        await put_cached_menu(cache_key, menu_data)
+    except Exception as e:
+        logger.warning(f"Menu cache write failed: {e}")
+    return menu_data
+
+
+async def generate_dish(dish_name: str, diet_type: str, plan: str = "free") -> dict:
+    """Ингредиенты, КБЖУ и описание одного блюда на одну порцию — для правки меню."""
+    diet_desc = DIET_DESCRIPTIONS.get(diet_type, diet_type)
+    prompt = f"""Блюдо "{dish_name}", режим питания: {diet_desc}.
+Дай состав и КБЖУ на 1 порцию. Верни СТРОГО валидный JSON (без markdown):
+{{"description": "до 10 слов", "ingredients": [{{"name": "Ингредиент", "amount": 100, "unit": "г"}}], "calories_per_serving": 350, "proteins": 15, "fats": 10, "carbs": 45}}"""
+    content = await _chat([{"role": "user", "content": prompt}], max_tokens=400,
+                          temperature=0.3, plan=plan, call_type="dish", hedge=True)
+    dish = json.loads(_clean_json(content))
+    if not isinstance(dish, dict) or not isinstance(dish.get("ingredients"), list):
+        raise ValueError("Ошибка обработки ответа ИИ. Попробуйте снова.")
+    return dish
 
-МЕНЮ (JSON):
-{json.dumps(menu_data, ensure_ascii=False)}
 
-Количество человек: {num_people}
+async def classify_ingredients(names: list, plan: str = "free") -> dict:
+    """Запасной вариант для локального списка покупок: категории для продуктов,
+    которых нет в словаре. Возвращает {название: категория}.
 
-Задача: собери все ингредиенты из всех блюд, суммируй одинаковые продукты, сгруппируй по категориям.
+    Продукты и категории нумеруются — модель отвечает парами номеров вместо
+    названий, ответ в несколько раз короче."""
+    categories = [
+        "Мясо и рыба", "Овощи и фрукты", "Молочные продукты", "Крупы и злаки",
+        "Масла и соусы", "Специи и приправы", "Прочее",
+    ]
+    prompt = f"""Отнеси каждый продукт к одной из категорий.
 
-Верни СТРОГО валидный JSON (без markdown):
-{{
-  "categories": [
-    {{"name": "Мясо и рыба", "items": [{{"name": "Куриная грудка", "total_amount": 1500, "unit": "г"}}]}},
-    {{"name": "Овощи и фрукты", "items": []}},
-    {{"name": "Молочные продукты", "items": []}},
-    {{"name": "Крупы и злаки", "items": []}},
-    {{"name": "Масла и соусы", "items": []}},
-    {{"name": "Специи и приправы", "items": []}},
-    {{"name": "Прочее", "items": []}}
-  ],
-  "total_items": 0
-}}"""
-    content = await _chat([{"role": "user", "content": prompt}], max_tokens=4000, temperature=0.3)
-    return json.loads(_clean_json(content))
+КАТЕГОРИИ:
+{numbered(categories)}
+
+ПРОДУКТЫ:
+{numbered(names)}
 
+Верни СТРОГО валидный JSON-объект (без markdown), где ключ — номер продукта, значение — номер категории:
+{{"1": 2}}"""
+    content = await _chat([{"role": "user", "content": prompt}],
+                          max_tokens=8 * len(names) + 50, temperature=0, plan=plan,
+                          call_type="classify")
+    result = decode_numbered(json.loads(_clean_json(content)), names, categories)
+    track_savings("classify", prompt + content, [*result, *result.values()])
+    return result
 
-async def suggest_recipe_queries(dish_name):
+
+async def suggest_recipe_queries(dish_name, plan="free"):
     prompt = f"""Для блюда "{dish_name}" сгенерируй 3 поисковых запроса для Google, чтобы найти рецепт.
 Верни JSON массив строк (без markdown): ["запрос 1", "запрос 2", "запрос 3"]"""
-    content = await _chat([{"role": "user", "content": prompt}], max_tokens=200, temperature=0.5)
+    content = await _chat([{"role": "user", "content": prompt}], max_tokens=200,
+                          temperature=0.5, plan=plan, call_type="recipe_queries", hedge=True)
     return json.loads(_clean_json(content))
 
 
-async def generate_nutrition_tip():
+async def suggest_recipe_queries_batch(dish_names: list, plan: str = "free") -> dict:
+    """Поисковые запросы сразу для многих блюд одним вызовом: {блюдо: [запросы]}."""
+    prompt = f"""Для каждого блюда из списка сгенерируй 3 поисковых запроса для Google, чтобы найти рецепт.
+
+БЛЮДА:
+{numbered(dish_names)}
+
+Верни СТРОГО валидный JSON-объект (без markdown), где ключ — номер блюда:
+{{"1": ["запрос 1", "запрос 2", "запрос 3"]}}"""
+    content = await _chat([{"role": "user", "content": prompt}],
+                          max_tokens=60 * len(dish_names) + 100, temperature=0.5,
+                          plan=plan, background=True, call_type="recipe_batch")
+    result = decode_numbered(json.loads(_clean_json(content)), dish_names)
+    track_savings("recipe_batch", prompt + content, list(result))
+    return {
+        name: [str(q) for q in items[:3]]
+        for name, items in result.items() if isinstance(items, list) and items
+    }
+
+
+async def generate_nutrition_tip(plan="free"):
     prompt = "Дай один короткий полезный совет по питанию или здоровому образу жизни (2-3 предложения). Совет должен быть научно обоснованным и практичным."
-    return await _chat([{"role": "user", "content": prompt}], max_tokens=200, temperature=0.9)
+    return await _chat([{"role": "user", "content": prompt}], max_tokens=200,
+                       temperature=0.9, plan=plan, call_type="tip", hedge=True)
+
+
+async def generate_nutrition_tips(count: int) -> list:
+    """Пачка разных советов за один вызов — для пула советов."""
+    prompt = f"""Дай {count} разных коротких полезных советов по питанию или здоровому образу жизни (2-3 предложения каждый). Советы должны быть научно обоснованными, практичными и не повторять друг друга по теме.
+Верни JSON массив строк (без markdown): ["совет 1", "совет 2"]"""
+    content = await _chat([{"role": "user", "content": prompt}],
+                          max_tokens=120 * count + 100, temperature=0.9, background=True,
+                          call_type="tips_batch")
+    tips = json.loads(_clean_json(content))
+    return [str(t).strip() for t in tips if str(t).strip()]
 
 
-async def substitute_ingredient(ingredient, diet_type):
+async def substitute_ingredient(ingredient, diet_type, plan="free"):
     prompt = f"""Предложи 3 замены для ингредиента "{ingredient}" в контексте {diet_type} питания.
 Верни JSON: {{"substitutes": ["вариант1", "вариант2", "вариант3"], "notes": "короткое пояснение"}}"""
-    content = await _chat([{"role": "user", "content": prompt}], max_tokens=300, temperature=0.7)
+    content = await _chat([{"role": "user", "content": prompt}], max_tokens=300,
+                          temperature=0.7, plan=plan, call_type="substitute", hedge=True)
     return json.loads(_clean_json(content))
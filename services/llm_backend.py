@@ -0,0 +1,77 @@
+import logging
+from config import (
+    LLM_BACKEND, LLM_BASE_URL, LLM_API_KEY, LLM_MODEL,
+    GROQ_API_KEY, GROQ_MODEL, FAKE_LLM_PORT,
+)
+
+logger = logging.getLogger(__name__)
+
+GROQ_BASE_URL = "https://api.groq.com/openai/v1"
+
+
+class LLMBackend:
+    """OpenAI-совместимый chat completions API: адрес, ключ и модель."""
+
+    name = "openai"
+
+    def __init__(self, base_url: str, api_key: str, model: str):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+
+    @property
+    def chat_url(self) -> str:
+        return f"{self.base_url}/chat/completions"
+
+    def headers(self) -> dict:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class GroqBackend(LLMBackend):
+    name = "groq"
+
+    def __init__(self):
+        super().__init__(GROQ_BASE_URL, GROQ_API_KEY, LLM_MODEL or GROQ_MODEL)
+
+
+class FakeBackend(LLMBackend):
+    """Фейковый сервер из services/fake_llm, поднятый в процессе бота."""
+
+    name = "fake"
+
+    def __init__(self, port: int = FAKE_LLM_PORT):
+        super().__init__(f"http://127.0.0.1:{port}/v1", "", LLM_MODEL or "fake-llm")
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        if self._runner is not None:
+            return
+        from services.fake_llm import start_fake_server
+        self._runner, self.base_url = await start_fake_server(port=self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def create_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    if name == "groq":
+        return GroqBackend()
+    if name == "openai":
+        if not LLM_BASE_URL:
+            raise ValueError("LLM_BACKEND=openai требует LLM_BASE_URL")
+        return LLMBackend(LLM_BASE_URL, LLM_API_KEY, LLM_MODEL or GROQ_MODEL)
+    if name == "fake":
+        return FakeBackend()
+    raise ValueError(f"Неизвестный LLM_BACKEND: {name}")
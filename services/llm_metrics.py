@@ -0,0 +1,225 @@
+import asyncio
+import contextvars
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, insert
+from database.db import AsyncSessionLocal, LLMCall, LLMCallRollup, LLMLatencyBucket, _dialect_insert
+from config import LLM_METRICS_FLUSH_INTERVAL, LLM_METRICS_BATCH, LLM_CALLS_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы задержек, мс (последняя — всё, что дольше)
+LATENCY_BUCKETS_MS = [
+    100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000,
+    7500, 10000, 15000, 20000, 30000, 45000, 60000, 90000, 120000,
+]
+RETENTION_CHECK_EVERY = 720  # сбросов между чистками старых записей (~1 ч при интервале 5 с)
+
+# Пользователь текущего апдейта — выставляется middleware, читается при записи вызова
+current_user = contextvars.ContextVar("llm_current_user", default=None)
+
+_buffer = []
+_flush_event = asyncio.Event()
+_flush_lock = asyncio.Lock()
+_flush_task = None
+_stats = {"recorded": 0, "flushed": 0, "dropped": 0}
+
+
+def bind_user(telegram_id):
+    current_user.set(telegram_id)
+
+
+def record_call(call_type: str, plan: str, model: str, usage: dict, latency: float,
+                finish_reason, outcome: str):
+    """Кладёт запись в буфер, не трогая базу — запись идёт пачками в фоне."""
+    usage = usage or {}
+    _buffer.append({
+        "call_type": call_type,
+        "telegram_id": current_user.get(),
+        "plan": plan or "free",
+        "model": model,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "latency_ms": int(latency * 1000),
+        "finish_reason": finish_reason,
+        "outcome": outcome,
+        "created_at": datetime.utcnow(),
+    })
+    _stats["recorded"] += 1
+    if len(_buffer) >= LLM_METRICS_BATCH:
+        _flush_event.set()
+    # Если база недоступна долго, не копим память бесконечно
+    if len(_buffer) > LLM_METRICS_BATCH * 50:
+        del _buffer[:LLM_METRICS_BATCH]
+        _stats["dropped"] += LLM_METRICS_BATCH
+
+
+def _bucket_index(latency_ms: int) -> int:
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if latency_ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+
+def _rollup(rows: list) -> dict:
+    groups = {}
+    for row in rows:
+        hour = row["created_at"].replace(minute=0, second=0, microsecond=0)
+        key = (hour, row["call_type"], row["plan"])
+        agg = groups.setdefault(key, {
+            "calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "latency_hist": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        })
+        agg["calls"] += 1
+        if row["outcome"] != "ok":
+            agg["errors"] += 1
+        agg["prompt_tokens"] += row["prompt_tokens"] or 0
+        agg["completion_tokens"] += row["completion_tokens"] or 0
+        agg["latency_hist"][_bucket_index(row["latency_ms"])] += 1
+    return groups
+
+
+COUNTERS = ("calls", "errors", "prompt_tokens", "completion_tokens")
+
+
+async def _upsert_rollups(session, groups: dict):
+    # Прибавление на стороне БД: параллельные сбросы разных процессов складываются, а не затирают друг друга
+    upsert = _dialect_insert(session)
+    stmt = upsert(LLMCallRollup).values([
+        {"hour": hour, "call_type": call_type, "plan": plan, **{c: agg[c] for c in COUNTERS}}
+        for (hour, call_type, plan), agg in groups.items()
+    ])
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=["hour", "call_type", "plan"],
+        set_={c: getattr(LLMCallRollup, c) + getattr(stmt.excluded, c) for c in COUNTERS},
+    ))
+
+    buckets = [
+        {"hour": hour, "call_type": call_type, "plan": plan, "bucket": i, "count": count}
+        for (hour, call_type, plan), agg in groups.items()
+        for i, count in enumerate(agg["latency_hist"]) if count
+    ]
+    stmt = upsert(LLMLatencyBucket).values(buckets)
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=["hour", "call_type", "plan", "bucket"],
+        set_={"count": LLMLatencyBucket.count + stmt.excluded.count},
+    ))
+
+
+async def flush():
+    async with _flush_lock:
+        while _buffer:
+            rows = _buffer[:LLM_METRICS_BATCH]
+            async with AsyncSessionLocal() as session:
+                await session.execute(insert(LLMCall), rows)
+                await _upsert_rollups(session, _rollup(rows))
+                await session.commit()
+            del _buffer[:len(rows)]
+            _stats["flushed"] += len(rows)
+
+
+async def _purge_old_calls():
+    cutoff = datetime.utcnow() - timedelta(days=LLM_CALLS_RETENTION_DAYS)
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(LLMCall).where(LLMCall.created_at < cutoff))
+        await session.commit()
+
+
+async def _flush_loop():
+    flushes = 0
+    while True:
+        try:
+            await asyncio.wait_for(_flush_event.wait(), timeout=LLM_METRICS_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_event.clear()
+        try:
+            await flush()
+            flushes += 1
+            if flushes % RETENTION_CHECK_EVERY == 0:
+                await _purge_old_calls()
+        except Exception as e:
+            logger.warning(f"LLM metrics flush failed: {e}")
+
+
+def start_metrics_flusher():
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop_metrics_flusher():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    try:
+        await flush()
+    except Exception as e:
+        logger.warning(f"LLM metrics final flush failed: {e}")
+
+
+def _percentile(hist: list, q: float):
+    """Верхняя граница корзины, в которую попадает q-й перцентиль, мс."""
+    total = sum(hist)
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    for i, count in enumerate(hist):
+        seen += count
+        if seen >= target:
+            return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+def _summarize(rollups: list, buckets: list) -> dict:
+    hist = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    summary = {"calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    for r in rollups:
+        summary["calls"] += r.calls
+        summary["errors"] += r.errors
+        summary["prompt_tokens"] += r.prompt_tokens
+        summary["completion_tokens"] += r.completion_tokens
+    for b in buckets:
+        if b.bucket < len(hist):
+            hist[b.bucket] += b.count
+    for q in (50, 95, 99):
+        summary[f"p{q}"] = _percentile(hist, q / 100)
+    return summary
+
+
+def _group(rows: list, field: str) -> dict:
+    groups = {}
+    for r in rows:
+        groups.setdefault(getattr(r, field), []).append(r)
+    return groups
+
+
+async def llm_stats(hours: int) -> dict:
+    """Сводка по агрегатам за последние hours часов: по типам вызовов и по планам."""
+    await flush()
+    since = (datetime.utcnow() - timedelta(hours=hours)).replace(minute=0, second=0, microsecond=0)
+    async with AsyncSessionLocal() as session:
+        rollups = (await session.execute(
+            select(LLMCallRollup).where(LLMCallRollup.hour >= since)
+        )).scalars().all()
+        buckets = (await session.execute(
+            select(LLMLatencyBucket).where(LLMLatencyBucket.hour >= since)
+        )).scalars().all()
+
+    result = {"total": _summarize(rollups, buckets)}
+    for field, name in (("call_type", "by_type"), ("plan", "by_plan")):
+        rollup_groups, bucket_groups = _group(rollups, field), _group(buckets, field)
+        result[name] = {
+            k: _summarize(v, bucket_groups.get(k, [])) for k, v in sorted(rollup_groups.items())
+        }
+    return result
+
+
+def metrics_stats() -> dict:
+    return {**_stats, "buffered": len(_buffer)}
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, update, func
+from database.db import AsyncSessionLocal, MenuCache
+from config import (
+    MENU_CACHE_ENABLED, MENU_CACHE_TTL_HOURS,
+    MENU_CACHE_MAX_MB, MENU_CACHE_VARIANTS,
+)
+
+logger = logging.getLogger(__name__)
+
+_stats = {"hits": 0, "misses": 0, "fills": 0, "stores": 0, "evictions": 0}
+
+
+def menu_cache_key(diet_type, num_people, num_days, meals_config, eaters_prompt,
+                   hide_dinner_calories, model, prompt_version) -> str:
+    """Ключ кэша — хэш нормализованных параметров, от которых зависит промпт."""
+    normalized = {
+        "diet": (diet_type or "").strip().lower(),
+        "people": int(num_people),
+        "days": int(num_days),
+        "meals": {k: str(v).strip() for k, v in sorted((meals_config or {}).items())},
+        "eaters": " ".join((eaters_prompt or "").lower().split()),
+        "hide_dinner": bool(hide_dinner_calories),
+        "model": model,
+        "version": prompt_version,
+    }
+    raw = json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def get_cached_menu(cache_key: str):
+    """Возвращает один из закэшированных вариантов или None.
+
+    Если вариантов меньше MENU_CACHE_VARIANTS, с вероятностью
+    1 - вариантов / MENU_CACHE_VARIANTS генерируем новый (fills) — набор
+    постепенно пополняется, а кэш помогает с первого сохранённого меню.
+    """
+    if not MENU_CACHE_ENABLED:
+        return None
+    expire_before = datetime.utcnow() - timedelta(hours=MENU_CACHE_TTL_HOURS)
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            delete(MenuCache).where(
+                MenuCache.cache_key == cache_key,
+                MenuCache.created_at < expire_before,
+            )
+        )
+        result = await session.execute(
+            select(MenuCache).where(MenuCache.cache_key == cache_key)
+        )
+        variants = result.scalars().all()
+        if not variants or random.random() >= len(variants) / MENU_CACHE_VARIANTS:
+            await session.commit()
+            _stats["fills" if variants else "misses"] += 1
+            return None
+
+        entry = random.choice(variants)
+        entry.hits = (entry.hits or 0) + 1
+        entry.last_used_at = datetime.utcnow()
+        await session.commit()
+        _stats["hits"] += 1
+        return entry.content
+
+
+async def put_cached_menu(cache_key: str, content: dict):
+    if not MENU_CACHE_ENABLED:
+        return
+    async with AsyncSessionLocal() as session:
+        entry = MenuCache(cache_key=cache_key, content=content)
+        session.add(entry)
+        await session.flush()
+        # Размер сжатого блоба считает БД — меню не сжимаем второй раз ради длины
+        await session.execute(
+            update(MenuCache).where(MenuCache.id == entry.id)
+            .values(size_bytes=func.length(MenuCache.content))
+        )
+        _stats["stores"] += 1
+
+        total = await session.scalar(select(func.coalesce(func.sum(MenuCache.size_bytes), 0)))
+        overflow = total - int(MENU_CACHE_MAX_MB * 1024 * 1024)
+        if overflow > 0:
+            # LRU по объёму: выкидываем дольше всех не отдававшиеся записи, пока не влезем
+            oldest = await session.execute(
+                select(MenuCache.id, MenuCache.size_bytes).order_by(MenuCache.last_used_at.asc())
+            )
+            evict = []
+            for row in oldest:
+                if overflow <= 0:
+                    break
+                evict.append(row.id)
+                overflow -= row.size_bytes or 0
+            await session.execute(delete(MenuCache).where(MenuCache.id.in_(evict)))
+            _stats["evictions"] += len(evict)
+        await session.commit()
+
+
+def cache_stats() -> dict:
+    total = _stats["hits"] + _stats["misses"] + _stats["fills"]
+    return {**_stats, "hit_rate": round(_stats["hits"] / total, 3) if total else 0.0}
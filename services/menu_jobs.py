@@ -0,0 +1,269 @@
+"""Очередь генерации меню в таблице menu_jobs.
+
+Обработчик кнопки только ставит задание и сразу отвечает. Задания разбирает
+пул с ограниченной параллельностью — в каждом процессе бота; захват задания —
+условный UPDATE, поэтому одно задание не достанется двум процессам.
+
+Пока задание выполняется, процесс продлевает lease_until. Если процесс упал
+или был перезапущен, срок истекает и задание берёт любой живой процесс.
+При штатной остановке незавершённые задания сразу возвращаются в очередь.
+Сохранённое меню записывается в задание той же транзакцией, так что
+повторная попытка после сбоя не генерирует его заново.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func, or_, and_
+from database.db import AsyncSessionLocal, MenuJob
+from services.llm_metrics import bind_user
+from config import (
+    MENU_JOB_CONCURRENCY, MENU_JOB_POLL_INTERVAL, MENU_JOB_LEASE,
+    MENU_JOB_MAX_ATTEMPTS, MENU_JOB_RETENTION_DAYS, WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 3600  # сек между чистками завершённых заданий
+
+_wakeup = asyncio.Event()
+_dispatch_task = None
+_active = {}  # job id → задача генерации
+_stats = {"done": 0, "failed": 0, "resumed": 0, "requeued": 0}
+
+
+def _claimable(now: datetime):
+    expired = and_(MenuJob.status == "running", MenuJob.lease_until < now)
+    return or_(MenuJob.status == "queued", expired)
+
+
+async def queue_position(session) -> int:
+    """Место нового задания в очереди: 0 — начнётся сразу, N — N-е в очереди.
+    Звать до enqueue_menu_job, чтобы сообщение об очереди ушло раньше прогресса."""
+    counts = dict((await session.execute(
+        select(MenuJob.status, func.count(MenuJob.id))
+        .where(MenuJob.status.in_(("queued", "running")))
+        .group_by(MenuJob.status)
+    )).all())
+    await session.commit()
+    # Супервизор делит MENU_JOB_CONCURRENCY между WORKERS процессами
+    free = max(0, MENU_JOB_CONCURRENCY * WORKERS - counts.get("running", 0))
+    waiting = counts.get("queued", 0) - free
+    return waiting + 1 if waiting >= 0 else 0
+
+
+async def enqueue_menu_job(session, user, chat_id: int, message_id: int, plan: str, params: dict):
+    """Ставит задание в очередь (с коммитом) и будит разбор очереди."""
+    session.add(MenuJob(
+        user_id=user.id, telegram_id=user.telegram_id, chat_id=chat_id,
+        message_id=message_id, plan=plan, params=params,
+    ))
+    await session.commit()
+    _wakeup.set()
+
+
+async def _claim():
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        candidates = (await session.scalars(
+            select(MenuJob.id).where(_claimable(now)).order_by(MenuJob.id).limit(MENU_JOB_CONCURRENCY)
+        )).all()
+        for job_id in candidates:
+            # Кто первым поменял статус, тот и взял — остальные процессы получат rowcount 0
+            result = await session.execute(
+                update(MenuJob)
+                .where(MenuJob.id == job_id, _claimable(now))
+                .values(
+                    status="running",
+                    attempts=MenuJob.attempts + 1,
+                    lease_until=now + timedelta(seconds=MENU_JOB_LEASE),
+                    started_at=func.coalesce(MenuJob.started_at, now),
+                )
+            )
+            await session.commit()
+            if result.rowcount == 1:
+                return await session.get(MenuJob, job_id)
+    return None
+
+
+async def _finish(job_id: int, status: str, menu_id: int = None, error: str = None):
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(MenuJob).where(MenuJob.id == job_id).values(
+                status=status, menu_id=menu_id, error=error,
+                lease_until=None, finished_at=datetime.utcnow(),
+            )
+        )
+        await session.commit()
+
+
+async def _keep_lease(job_id: int):
+    while True:
+        await asyncio.sleep(MENU_JOB_LEASE / 3)
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(MenuJob)
+                    .where(MenuJob.id == job_id, MenuJob.status == "running")
+                    .values(lease_until=datetime.utcnow() + timedelta(seconds=MENU_JOB_LEASE))
+                )
+                await session.commit()
+        except Exception as e:
+            logger.warning(f"Menu job {job_id} lease renewal failed: {e}")
+
+
+async def _notify_gave_up(bot, job: MenuJob):
+    try:
+        await bot.edit_message_text(
+            "<b>Не удалось сгенерировать меню.</b>\n\nПожалуйста, попробуйте снова.",
+            chat_id=job.chat_id, message_id=job.message_id, parse_mode="HTML",
+        )
+    except Exception as e:
+        logger.warning(f"Menu job {job.id}: could not notify user: {e}")
+
+
+async def _execute(runner, bot, job: MenuJob):
+    bind_user(job.telegram_id)
+    if job.attempts > 1:
+        _stats["resumed"] += 1
+        logger.info(f"Menu job {job.id} resumed, attempt {job.attempts}")
+    lease = asyncio.create_task(_keep_lease(job.id))
+    try:
+        if job.attempts > MENU_JOB_MAX_ATTEMPTS:
+            # Задание раз за разом роняет процесс — больше не берём
+            await _notify_gave_up(bot, job)
+            raise RuntimeError(f"задание прерывалось {job.attempts - 1} раз")
+        menu_id = await runner(bot, job)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _stats["failed"] += 1
+        logger.warning(f"Menu job {job.id} failed: {e}")
+        await _finish(job.id, "failed", error=str(e)[:500])
+    else:
+        _stats["done"] += 1
+        await _finish(job.id, "done", menu_id=menu_id)
+        waited = (job.started_at - job.created_at).total_seconds()
+        total = (datetime.utcnow() - job.created_at).total_seconds()
+        logger.info(f"Menu job {job.id} done in {total:.1f}s (waited {waited:.1f}s)")
+    finally:
+        lease.cancel()
+
+
+async def _purge_finished():
+    cutoff = datetime.utcnow() - timedelta(days=MENU_JOB_RETENTION_DAYS)
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            delete(MenuJob).where(MenuJob.status.in_(("done", "failed")), MenuJob.created_at < cutoff)
+        )
+        await session.commit()
+
+
+async def _dispatch_loop(runner, bot):
+    slots = asyncio.Semaphore(MENU_JOB_CONCURRENCY)
+    last_purge = 0.0
+    loop = asyncio.get_running_loop()
+    while True:
+        await slots.acquire()
+        _wakeup.clear()
+        try:
+            job = await _claim()
+            if loop.time() - last_purge > PURGE_INTERVAL:
+                last_purge = loop.time()
+                await _purge_finished()
+        except Exception as e:
+            logger.warning(f"Menu job queue poll failed: {e}")
+            job = None
+        if job is None:
+            slots.release()
+            # asyncio.timeout, а не wait_for: wait_for теряет cancel() из stop_menu_jobs,
+            # если событие выставлено в тот же момент
+            try:
+                async with asyncio.timeout(MENU_JOB_POLL_INTERVAL):
+                    await _wakeup.wait()
+            except TimeoutError:
+                pass
+            continue
+
+        task = asyncio.create_task(_execute(runner, bot, job))
+        _active[job.id] = task
+
+        def _done(_, job_id=job.id):
+            _active.pop(job_id, None)
+            slots.release()
+
+        task.add_done_callback(_done)
+
+
+def start_menu_jobs(runner, bot):
+    """runner(bot, job) генерирует меню и возвращает id сохранённого Menu.
+    Если job.menu_id уже задан, меню сохранено прошлой попыткой."""
+    global _dispatch_task
+    if _dispatch_task is None or _dispatch_task.done():
+        _dispatch_task = asyncio.create_task(_dispatch_loop(runner, bot))
+
+
+async def stop_menu_jobs():
+    global _dispatch_task
+    if _dispatch_task is not None:
+        _dispatch_task.cancel()
+        await asyncio.gather(_dispatch_task, return_exceptions=True)
+        _dispatch_task = None
+
+    tasks = dict(_active)
+    if not tasks:
+        return
+    for task in tasks.values():
+        task.cancel()
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    # Прерванные остановкой задания — обратно в очередь, попытку не засчитываем
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(MenuJob)
+                .where(MenuJob.id.in_(tasks), MenuJob.status == "running")
+                .values(status="queued", lease_until=None, attempts=MenuJob.attempts - 1)
+            )
+            await session.commit()
+        _stats["requeued"] += len(tasks)
+        logger.info(f"{len(tasks)} menu jobs returned to the queue")
+    except Exception as e:
+        logger.warning(f"Menu jobs requeue failed, they resume after lease expiry: {e}")
+
+
+def _percentile(values: list, q: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+async def menu_job_stats(hours: int) -> dict:
+    """Глубина очереди сейчас и задержки заданий за последние hours часов, мс."""
+    since = datetime.utcnow() - timedelta(hours=hours)
+    async with AsyncSessionLocal() as session:
+        depth = dict((await session.execute(
+            select(MenuJob.status, func.count(MenuJob.id))
+            .where(MenuJob.status.in_(("queued", "running")))
+            .group_by(MenuJob.status)
+        )).all())
+        oldest = await session.scalar(select(func.min(MenuJob.created_at)).where(MenuJob.status == "queued"))
+        rows = (await session.execute(
+            select(MenuJob.status, MenuJob.created_at, MenuJob.started_at, MenuJob.finished_at)
+            .where(MenuJob.created_at >= since, MenuJob.status.in_(("done", "failed")))
+        )).all()
+
+    def ms(a, b):
+        return int((b - a).total_seconds() * 1000)
+
+    waits = [ms(r.created_at, r.started_at) for r in rows if r.started_at]
+    totals = [ms(r.created_at, r.finished_at) for r in rows if r.status == "done" and r.finished_at]
+    return {
+        "queued": depth.get("queued", 0),
+        "running": depth.get("running", 0),
+        "oldest_queued_s": int((datetime.utcnow() - oldest).total_seconds()) if oldest else None,
+        "done": sum(r.status == "done" for r in rows),
+        "failed": sum(r.status == "failed" for r in rows),
+        "wait_p50": _percentile(waits, 0.5),
+        "wait_p95": _percentile(waits, 0.95),
+        "total_p50": _percentile(totals, 0.5),
+        "total_p95": _percentile(totals, 0.95),
+        "process": dict(_stats, active=len(_active)),
+    }
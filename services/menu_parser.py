@@ -0,0 +1,76 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DaysStreamParser:
+    """Достаёт завершённые элементы массива "days" из JSON, который приходит кусками.
+
+    Парсер не строит полное дерево: он ищет начало массива по ключу и считает
+    глубину скобок с учётом строк, отдавая каждый закрытый объект дня.
+    """
+
+    def __init__(self, key: str = "days"):
+        self.buffer = ""
+        self.done = False
+        self._marker = f'"{key}"'
+        self._pos = 0          # до какого символа буфер уже просканирован
+        self._in_array = False
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self._obj_start = None
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk
+        days = []
+        if self.done:
+            return days
+
+        if not self._in_array:
+            idx = self.buffer.find(self._marker)
+            if idx == -1:
+                return days
+            bracket = self.buffer.find("[", idx + len(self._marker))
+            if bracket == -1:
+                return days
+            self._in_array = True
+            self._pos = bracket + 1
+
+        buf = self.buffer
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+                continue
+            if ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._obj_start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0 and ch == "]":
+                    self.done = True
+                    self._pos = i + 1
+                    return days
+                self._depth -= 1
+                if self._depth == 0 and ch == "}" and self._obj_start is not None:
+                    try:
+                        days.append(json.loads(buf[self._obj_start:i + 1]))
+                    except json.JSONDecodeError as e:
+                        logger.warning(f"Skipping malformed day object: {e}")
+                    self._obj_start = None
+        self._pos = len(buf)
+        return days
+
+
+def recover_days(text: str, key: str = "days") -> list:
+    """Все полностью завершённые дни из ответа, даже если он оборван на середине."""
+    return DaysStreamParser(key).feed(text)
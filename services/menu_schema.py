@@ -0,0 +1,90 @@
+"""Компактная схема ответа ИИ для меню и разворачивание её в формат Menu.content.
+
+Длинные ключи (calories_per_serving, meal_name, ...) повторяются тысячи раз
+в длинном меню и занимают заметную часть выходных токенов. ИИ отвечает короткими
+ключами, а всё, что можно вычислить (названия приёмов пищи, время, подписи дней,
+суммы калорий), заполняется здесь.
+
+    {"d": [{"n": 1, "m": [{"t": "breakfast", "x": [
+        {"n": "Омлет", "s": "описание", "i": [["Яйцо", 2, "шт"]], "k": 350, "b": [15, 10, 45]}
+    ]}]}]}
+"""
+
+DAYS_KEY = "d"
+
+MEAL_NAMES = {
+    "breakfast": "Завтрак",
+    "brunch": "Второй завтрак",
+    "lunch": "Обед",
+    "snack": "Перекус",
+    "dinner": "Ужин",
+}
+
+SCHEMA_EXAMPLE = (
+    '{"d":[{"n":1,"m":[{"t":"breakfast","x":[{"n":"Название блюда","s":"Краткое описание",'
+    '"i":[["Ингредиент",100,"г"]],"k":350,"b":[15,10,45]}]}]}]}'
+)
+SCHEMA_LEGEND = (
+    "d — дни; n — номер дня или название блюда; m — приёмы пищи; t — тип приёма пищи; "
+    "x — блюда; s — краткое описание; i — ингредиенты [название, количество, единица]; "
+    "k — калорийность порции; b — [белки, жиры, углеводы] в граммах"
+)
+
+
+def _kcal(value):
+    try:
+        return round(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _ingredient(item) -> dict:
+    if isinstance(item, dict):
+        return item
+    item = list(item) + ["", "", ""]
+    return {"name": item[0], "amount": item[1], "unit": item[2]}
+
+
+def expand_dish(raw: dict) -> dict:
+    if "name" in raw:
+        return raw
+    macros = list(raw.get("b") or []) + [None, None, None]
+    dish = {
+        "name": raw.get("n", ""),
+        "description": raw.get("s", ""),
+        "ingredients": [_ingredient(i) for i in raw.get("i", []) if i],
+        "proteins": macros[0],
+        "fats": macros[1],
+        "carbs": macros[2],
+    }
+    if raw.get("k") is not None:
+        dish["calories_per_serving"] = raw["k"]
+    return dish
+
+
+def expand_day(raw: dict, meals_config: dict) -> dict:
+    """День компактной схемы → день Menu.content. Дни в полной схеме
+    (если ИИ её проигнорировал) возвращаются как есть."""
+    if "meals" in raw:
+        return raw
+    meals = []
+    for raw_meal in raw.get("m", []):
+        meal_type = raw_meal.get("t", "")
+        dishes = [expand_dish(x) for x in raw_meal.get("x", [])]
+        meal = {
+            "meal_type": meal_type,
+            "meal_name": MEAL_NAMES.get(meal_type, meal_type),
+            "time": (meals_config or {}).get(meal_type, ""),
+            "dishes": dishes,
+        }
+        calories = [c for c in (_kcal(d.get("calories_per_serving")) for d in dishes) if c is not None]
+        if calories:
+            meal["total_calories"] = sum(calories)
+        meals.append(meal)
+
+    number = raw.get("n", 0)
+    day = {"day": number, "date_label": f"День {number}", "meals": meals}
+    totals = [m["total_calories"] for m in meals if "total_calories" in m]
+    if totals:
+        day["day_total_calories"] = sum(totals)
+    return day
@@ -0,0 +1,281 @@
+"""Меню в нормализованных таблицах: запись, сборка обратно в формат Menu.content
+и точечная замена блюда.
+
+Правка блюда меняет одну строку dishes, её ингредиенты и итоги одного дня —
+объём записи не зависит от длины меню. Экраны редактирования читают только
+показываемый срез (список дней, приёмы пищи дня, блюда приёма пищи).
+"""
+import logging
+from sqlalchemy import select, update, delete, insert, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.db import Menu, MenuDay, MenuMeal, Dish, DishIngredient
+from services.dish_cache import recompute_totals
+
+logger = logging.getLogger(__name__)
+
+DISH_FIELDS = ("name", "description", "calories_per_serving", "proteins", "fats", "carbs", "ingredients")
+NUMERIC_FIELDS = ("calories_per_serving", "proteins", "fats", "carbs")
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def _dish_row(dish: dict) -> dict:
+    extra = {k: v for k, v in dish.items() if k not in DISH_FIELDS}
+    row = {
+        "name": dish.get("name", ""),
+        "description": dish.get("description", ""),
+        "extra": extra or None,
+    }
+    for field in NUMERIC_FIELDS:
+        row[field] = _number(dish.get(field))
+    return row
+
+
+def _ingredient_rows(menu_id: int, dish_id: int, ingredients) -> list:
+    rows = []
+    for position, ing in enumerate(ingredients or []):
+        if not isinstance(ing, dict):
+            continue
+        rows.append({
+            "menu_id": menu_id, "dish_id": dish_id, "position": position,
+            "name": ing.get("name", ""), "amount": ing.get("amount"), "unit": ing.get("unit", ""),
+        })
+    return rows
+
+
+async def _insert_returning_ids(session: AsyncSession, model, rows: list) -> list:
+    if not rows:
+        return []
+    result = await session.execute(
+        insert(model).returning(model.id, sort_by_parameter_order=True), rows
+    )
+    return list(result.scalars())
+
+
+async def save_menu_content(session: AsyncSession, menu_id: int, content: dict):
+    """Раскладывает меню по таблицам: по одному пакетному INSERT на уровень."""
+    days = (content or {}).get("days", [])
+    day_ids = await _insert_returning_ids(session, MenuDay, [
+        {"menu_id": menu_id, "day": _number(d.get("day")) or i + 1,
+         "date_label": d.get("date_label"), "total_calories": _number(d.get("day_total_calories"))}
+        for i, d in enumerate(days)
+    ])
+
+    meals = [(day_id, position, m) for day_id, d in zip(day_ids, days)
+             for position, m in enumerate(d.get("meals", []))]
+    meal_ids = await _insert_returning_ids(session, MenuMeal, [
+        {"menu_id": menu_id, "day_id": day_id, "position": position,
+         "meal_type": m.get("meal_type", ""), "meal_name": m.get("meal_name", ""),
+         "time": m.get("time", ""), "total_calories": _number(m.get("total_calories"))}
+        for day_id, position, m in meals
+    ])
+
+    dishes = [(meal_id, position, x) for meal_id, (_, _, m) in zip(meal_ids, meals)
+              for position, x in enumerate(m.get("dishes", []))]
+    dish_ids = await _insert_returning_ids(session, Dish, [
+        {"menu_id": menu_id, "meal_id": meal_id, "position": position, **_dish_row(x)}
+        for meal_id, position, x in dishes
+    ])
+
+    ingredients = []
+    for dish_id, (_, _, x) in zip(dish_ids, dishes):
+        ingredients.extend(_ingredient_rows(menu_id, dish_id, x.get("ingredients")))
+    if ingredients:
+        await session.execute(insert(DishIngredient), ingredients)
+
+
+async def delete_menu_content(session: AsyncSession, menu_id: int):
+    # Без ON DELETE CASCADE в SQLite (foreign_keys выключены) — удаляем снизу вверх
+    for model in (DishIngredient, Dish, MenuMeal, MenuDay):
+        await session.execute(delete(model).where(model.menu_id == menu_id))
+
+
+async def _ensure_rows(session: AsyncSession, menu_id: int) -> bool:
+    """Переносит в таблицы меню, записанное старым форматом (Menu.content).
+    False — меню нет."""
+    if await session.scalar(select(MenuDay.id).where(MenuDay.menu_id == menu_id).limit(1)):
+        return True
+    row = (await session.execute(select(Menu.id, Menu.content).where(Menu.id == menu_id))).first()
+    if row is None:
+        return False
+    if row.content:
+        await save_menu_content(session, menu_id, row.content)
+        await session.execute(update(Menu).where(Menu.id == menu_id).values(content=None))
+        logger.info(f"Menu {menu_id} moved to normalized storage")
+    return True
+
+
+def _assemble(day_rows, meal_rows, dish_rows, ingredient_rows) -> list:
+    ingredients = {}
+    for r in ingredient_rows:
+        ingredients.setdefault(r.dish_id, []).append({"name": r.name, "amount": r.amount, "unit": r.unit})
+
+    dishes = {}
+    for r in dish_rows:
+        dish = {"name": r.name, "description": r.description or "",
+                "ingredients": ingredients.get(r.id, [])}
+        for field in NUMERIC_FIELDS:
+            value = getattr(r, field)
+            if value is not None or field != "calories_per_serving":
+                dish[field] = _number(value)
+        if r.extra:
+            dish.update(r.extra)
+        dishes.setdefault(r.meal_id, []).append(dish)
+
+    meals = {}
+    for r in meal_rows:
+        meal = {"meal_type": r.meal_type, "meal_name": r.meal_name, "time": r.time,
+                "dishes": dishes.get(r.id, [])}
+        if r.total_calories is not None:
+            meal["total_calories"] = r.total_calories
+        meals.setdefault(r.day_id, []).append(meal)
+
+    days = []
+    for r in day_rows:
+        day = {"day": r.day, "date_label": r.date_label or f"День {r.day}", "meals": meals.get(r.id, [])}
+        if r.total_calories is not None:
+            day["day_total_calories"] = r.total_calories
+        days.append(day)
+    return days
+
+
+async def _load_days(session: AsyncSession, menu_id: int, day: int = None) -> tuple:
+    days_q = select(MenuDay).where(MenuDay.menu_id == menu_id).order_by(MenuDay.day)
+    if day is not None:
+        days_q = days_q.where(MenuDay.day == day)
+    day_rows = (await session.execute(days_q.with_only_columns(
+        MenuDay.id, MenuDay.day, MenuDay.date_label, MenuDay.total_calories
+    ))).all()
+    if not day_rows:
+        return [], [], [], []
+
+    meal_cols = (MenuMeal.id, MenuMeal.day_id, MenuMeal.meal_type, MenuMeal.meal_name,
+                 MenuMeal.time, MenuMeal.total_calories)
+    dish_cols = (Dish.id, Dish.meal_id, Dish.name, Dish.description, Dish.calories_per_serving,
+                 Dish.proteins, Dish.fats, Dish.carbs, Dish.extra)
+    ing_cols = (DishIngredient.dish_id, DishIngredient.name, DishIngredient.amount, DishIngredient.unit)
+    if day is None:
+        # Всё меню — по menu_id, без join'ов
+        meal_q = select(*meal_cols).where(MenuMeal.menu_id == menu_id)
+        dish_q = select(*dish_cols).where(Dish.menu_id == menu_id)
+        ing_q = select(*ing_cols).where(DishIngredient.menu_id == menu_id)
+    else:
+        day_id = day_rows[0].id
+        meal_q = select(*meal_cols).where(MenuMeal.day_id == day_id)
+        dish_q = select(*dish_cols).join(MenuMeal, Dish.meal_id == MenuMeal.id).where(MenuMeal.day_id == day_id)
+        ing_q = (select(*ing_cols).join(Dish, DishIngredient.dish_id == Dish.id)
+                 .join(MenuMeal, Dish.meal_id == MenuMeal.id).where(MenuMeal.day_id == day_id))
+
+    meal_rows = (await session.execute(meal_q.order_by(MenuMeal.day_id, MenuMeal.position))).all()
+    dish_rows = (await session.execute(dish_q.order_by(Dish.meal_id, Dish.position))).all()
+    ing_rows = (await session.execute(
+        ing_q.order_by(DishIngredient.dish_id, DishIngredient.position)
+    )).all()
+    return day_rows, meal_rows, dish_rows, ing_rows
+
+
+async def load_menu_content(session: AsyncSession, menu_id: int, day: int = None) -> dict:
+    """Меню (или один день) в формате Menu.content: {"days": [...]}.
+    None — меню не найдено."""
+    if not await _ensure_rows(session, menu_id):
+        return None
+    return {"days": _assemble(*await _load_days(session, menu_id, day))}
+
+
+async def list_days(session: AsyncSession, menu_id: int) -> list:
+    """[(номер дня, подпись)] — для выбора дня при редактировании."""
+    if not await _ensure_rows(session, menu_id):
+        return None
+    result = await session.execute(
+        select(MenuDay.day, MenuDay.date_label).where(MenuDay.menu_id == menu_id).order_by(MenuDay.day)
+    )
+    return [(r.day, r.date_label or f"День {r.day}") for r in result]
+
+
+async def list_meals(session: AsyncSession, menu_id: int, day: int) -> list:
+    result = await session.execute(
+        select(MenuMeal.meal_type, MenuMeal.meal_name, MenuMeal.time)
+        .join(MenuDay, MenuMeal.day_id == MenuDay.id)
+        .where(MenuDay.menu_id == menu_id, MenuDay.day == day)
+        .order_by(MenuMeal.position)
+    )
+    return [{"meal_type": r.meal_type, "meal_name": r.meal_name, "time": r.time} for r in result]
+
+
+async def list_dishes(session: AsyncSession, menu_id: int, day: int, meal_type: str) -> list:
+    result = await session.execute(
+        select(Dish.name)
+        .join(MenuMeal, Dish.meal_id == MenuMeal.id)
+        .join(MenuDay, MenuMeal.day_id == MenuDay.id)
+        .where(MenuDay.menu_id == menu_id, MenuDay.day == day, MenuMeal.meal_type == meal_type)
+        .order_by(Dish.position)
+    )
+    return list(result.scalars())
+
+
+async def replace_dish(session: AsyncSession, menu_id: int, day: int, meal_type: str,
+                       index: int, dish: dict, recompute: bool = True) -> dict:
+    """Заменяет одно блюдо и пересчитывает итоги его дня. Возвращает
+    обновлённый день или None, если такого блюда нет."""
+    day_rows, meal_rows, dish_rows, ing_rows = await _load_days(session, menu_id, day)
+    meal_row = next((m for m in meal_rows if m.meal_type == meal_type), None)
+    if meal_row is None:
+        return None
+    meal_dish_ids = [r.id for r in dish_rows if r.meal_id == meal_row.id]
+    if not 0 <= index < len(meal_dish_ids):
+        return None
+    dish_id = meal_dish_ids[index]
+
+    await session.execute(update(Dish).where(Dish.id == dish_id).values(**_dish_row(dish)))
+    await session.execute(delete(DishIngredient).where(DishIngredient.dish_id == dish_id))
+    ingredients = _ingredient_rows(menu_id, dish_id, dish.get("ingredients"))
+    if ingredients:
+        await session.execute(insert(DishIngredient), ingredients)
+
+    # Собираем день уже с новым блюдом, итоги считаем тем же кодом, что и раньше
+    dish_rows = [r for r in dish_rows if r.id != dish_id]
+    ing_rows = [r for r in ing_rows if r.dish_id != dish_id]
+    new_day = _assemble(day_rows, meal_rows, dish_rows, ing_rows)[0]
+    meal_index = next(i for i, m in enumerate(meal_rows) if m.id == meal_row.id)
+    new_day["meals"][meal_index]["dishes"].insert(index, _assembled_dish(dish))
+    if not recompute:
+        return new_day
+
+    recompute_totals(new_day)
+    for row, meal in zip(meal_rows, new_day["meals"]):
+        if row.total_calories != meal["total_calories"]:
+            await session.execute(
+                update(MenuMeal).where(MenuMeal.id == row.id).values(total_calories=meal["total_calories"])
+            )
+    await session.execute(
+        update(MenuDay).where(MenuDay.id == day_rows[0].id)
+        .values(total_calories=new_day["day_total_calories"])
+    )
+    return new_day
+
+
+def _assembled_dish(dish: dict) -> dict:
+    # Блюдо в том виде, в каком его вернёт _assemble после записи
+    row = _dish_row(dish)
+    result = {"name": row["name"], "description": row["description"] or "",
+              "ingredients": [{"name": i["name"], "amount": i["amount"], "unit": i["unit"]}
+                              for i in _ingredient_rows(0, 0, dish.get("ingredients"))]}
+    for field in NUMERIC_FIELDS:
+        if row[field] is not None or field != "calories_per_serving":
+            result[field] = row[field]
+    if row["extra"]:
+        result.update(row["extra"])
+    return result
+
+
+async def average_day_calories(session: AsyncSession, menu_id: int):
+    value = await session.scalar(
+        select(func.avg(MenuDay.total_calories)).where(MenuDay.menu_id == menu_id)
+    )
+    return round(value) if value is not None else None
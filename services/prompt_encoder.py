@@ -0,0 +1,58 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сколько токенов сэкономили компактные промпты, по типам вызовов
+_savings = {}
+
+
+def estimate_tokens(text: str) -> int:
+    # Грубая оценка: для русского текста ~3 символа на токен
+    return len(text) // 3 + 10
+
+
+def numbered(items: list) -> str:
+    """Строки `1. значение`: модель отвечает номерами, а не повторяет названия."""
+    return "\n".join(f"{i}. {item}" for i, item in enumerate(items, start=1))
+
+
+def decode_numbered(answer: dict, keys: list, values: list = None) -> dict:
+    """Ответ вида {"номер": номер} → {ключ: значение}; номера вне списков пропускаем.
+    Без values значения ответа возвращаются как есть: {"номер": что угодно} → {ключ: ...}."""
+    decoded = {}
+    for key_no, value in answer.items():
+        try:
+            key_no = int(key_no)
+            if values is not None:
+                value_no = int(value)
+        except (TypeError, ValueError):
+            continue
+        if not 1 <= key_no <= len(keys):
+            continue
+        if values is None:
+            decoded[keys[key_no - 1]] = value
+        elif 1 <= value_no <= len(values):
+            decoded[keys[key_no - 1]] = values[value_no - 1]
+    return decoded
+
+
+def track_savings(call_type: str, sent: str, repeated: list):
+    """Запоминает, во сколько раз компактный вызов меньше полного варианта.
+
+    sent — промпт и ответ как есть; repeated — названия, которые полный вариант
+    повторил бы в ответе вместо номеров. Второй промпт ради сравнения не строим.
+    """
+    sent_tokens = estimate_tokens(sent)
+    raw_tokens = sent_tokens + sum(len(text) for text in repeated) // 3
+    stats = _savings.setdefault(call_type, {"calls": 0, "raw_tokens": 0, "sent_tokens": 0})
+    stats["calls"] += 1
+    stats["raw_tokens"] += raw_tokens
+    stats["sent_tokens"] += sent_tokens
+    logger.info(f"Compact prompt for {call_type}: ~{raw_tokens} → ~{sent_tokens} tokens")
+
+
+def encoding_stats() -> dict:
+    return {
+        call_type: {**s, "ratio": round(s["raw_tokens"] / s["sent_tokens"], 1) if s["sent_tokens"] else 0.0}
+        for call_type, s in _savings.items()
+    }
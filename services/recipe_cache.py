@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import re
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from database.db import AsyncSessionLocal, RecipeQuery
+from services.groq_service import suggest_recipe_queries, suggest_recipe_queries_batch
+from config import RECIPE_PREFETCH_BATCH
+
+logger = logging.getLogger(__name__)
+
+_stats = {"hits": 0, "misses": 0, "prefetched": 0}
+# Ссылки на фоновые задачи, чтобы их не собрал GC до завершения
+_background_tasks = set()
+
+
+def normalize_dish_name(name: str) -> str:
+    text = str(name or "").lower().replace("ё", "е")
+    text = re.sub(r"[^\w\s-]", " ", text)
+    return " ".join(text.split())
+
+
+def _fallback_queries(dish_name: str) -> list:
+    return [f"рецепт {dish_name}", f"{dish_name} пошаговый рецепт"]
+
+
+async def _load(keys: list) -> dict:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(RecipeQuery.dish_key, RecipeQuery.queries).where(RecipeQuery.dish_key.in_(keys))
+        )
+        return {key: queries for key, queries in result.all()}
+
+
+async def _store(queries_by_name: dict):
+    if not queries_by_name:
+        return
+    async with AsyncSessionLocal() as session:
+        existing = await session.execute(
+            select(RecipeQuery.dish_key).where(
+                RecipeQuery.dish_key.in_([normalize_dish_name(n) for n in queries_by_name])
+            )
+        )
+        known = set(existing.scalars().all())
+        for name, queries in queries_by_name.items():
+            key = normalize_dish_name(name)
+            if key in known:
+                continue
+            known.add(key)
+            session.add(RecipeQuery(dish_key=key, dish_name=name, queries=queries))
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Параллельный префетч уже записал эти блюда — кэш всё равно заполнен
+            await session.rollback()
+
+
+async def get_recipe_queries(dish_name: str, plan: str = "free") -> list:
+    """Запросы для блюда из общего кэша; при промахе — один вызов ИИ."""
+    key = normalize_dish_name(dish_name)
+    cached = (await _load([key])).get(key)
+    if cached:
+        _stats["hits"] += 1
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(RecipeQuery).where(RecipeQuery.dish_key == key)
+                .values(hits=RecipeQuery.hits + 1)
+            )
+            await session.commit()
+        return cached
+
+    _stats["misses"] += 1
+    try:
+        queries = await suggest_recipe_queries(dish_name, plan)
+    except Exception as e:
+        logger.warning(f"Recipe queries failed for {dish_name!r}: {e}")
+        return _fallback_queries(dish_name)
+    await _store({dish_name: queries})
+    return queries
+
+
+async def prefetch_recipe_queries(menu_data: dict, plan: str = "free"):
+    """Заполняет кэш запросами для всех блюд меню, которых в нём ещё нет.
+
+    Обычно это один вызов ИИ на меню. Длинное меню (31 день — до ~200 блюд)
+    делится по RECIPE_PREFETCH_BATCH блюд: ответ на все сразу не влез бы
+    в лимит токенов ответа, а обрезанный JSON потерял бы весь кэш меню."""
+    names = {}
+    for day in menu_data.get("days", []):
+        for meal in day.get("meals", []):
+            for dish in meal.get("dishes", []):
+                name = dish.get("name")
+                if name:
+                    names.setdefault(normalize_dish_name(name), name)
+
+    known = await _load(list(names))
+    missing = [name for key, name in names.items() if key not in known]
+    for start in range(0, len(missing), RECIPE_PREFETCH_BATCH):
+        batch = missing[start:start + RECIPE_PREFETCH_BATCH]
+        try:
+            queries = await suggest_recipe_queries_batch(batch, plan)
+        except Exception as e:
+            logger.warning(f"Recipe prefetch batch failed: {e}")
+            continue
+        await _store(queries)
+        _stats["prefetched"] += len(queries)
+
+
+def schedule_recipe_prefetch(menu_data: dict, plan: str = "free"):
+    task = asyncio.create_task(prefetch_recipe_queries(menu_data, plan))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def recipe_cache_stats() -> dict:
+    total = _stats["hits"] + _stats["misses"]
+    return {**_stats, "hit_rate": round(_stats["hits"] / total, 3) if total else 0.0}
@@ -0,0 +1,243 @@
+import logging
+import re
+from services.groq_service import classify_ingredients
+
+logger = logging.getLogger(__name__)
+
+# Порядок категорий совпадает с макетом PDF списка покупок
+CATEGORIES = [
+    "Мясо и рыба",
+    "Овощи и фрукты",
+    "Молочные продукты",
+    "Крупы и злаки",
+    "Масла и соусы",
+    "Специи и приправы",
+    "Прочее",
+]
+OTHER = "Прочее"
+
+# Основы слов для классификации. Побеждает самое длинное совпадение,
+# поэтому "перец болгарский" уходит в овощи, а "перец" — в специи.
+CATEGORY_KEYWORDS = {
+    "Мясо и рыба": [
+        "говяд", "говяж", "свин", "баран", "телят", "куриц", "курин", "кур ", "индей",
+        "утк", "утин", "гус", "кроли", "фарш", "мяс", "печень", "печен", "бекон",
+        "ветчин", "колбас", "сосиск", "филе", "грудк", "бедр", "окорок", "стейк",
+        "рыб", "лосос", "семг", "форел", "треск", "минта", "хек", "судак", "тунец",
+        "тунц", "скумбр", "сельд", "горбуш", "кета", "карп", "дорадо", "сибас",
+        "креветк", "кальмар", "мидии", "мидий", "краб", "икра", "морепродукт",
+    ],
+    "Овощи и фрукты": [
+        "картоф", "картош", "морков", "лук", "чеснок", "капуст", "брокколи",
+        "цветная", "кабач", "цукини", "баклажан", "помидор", "томат", "черри",
+        "огур", "болгарск", "сладкий перец", "перец сладк", "свекл", "тыкв",
+        "редис", "редьк", "сельдер", "шпинат", "салат", "руккол", "укроп",
+        "петруш", "кинз", "базилик", "зелен", "щавел", "спарж", "фасоль стручк",
+        "горошек", "кукуруз", "гриб", "шампинь", "вешенк", "авокадо", "яблок",
+        "груш", "банан", "апельсин", "мандарин", "лимон", "лайм", "грейпфрут",
+        "ягод", "клубник", "малин", "черник", "голубик", "смородин", "клюкв",
+        "вишн", "черешн", "виноград", "киви", "манго", "ананас", "персик",
+        "абрикос", "слив", "гранат", "хурм", "инжир", "финик", "изюм", "курага",
+        "чернослив", "имбир", "сухофрукт", "маслин", "оливк",
+    ],
+    "Молочные продукты": [
+        "молок", "молоч", "кефир", "йогурт", "творог", "творож", "сметан",
+        "сливк", "сливочн", "сыр", "брынз", "моцарел", "пармезан", "фета",
+        "рикотт", "ряженк", "простокваш", "айран", "масло сливочное", "яйц", "яйк",
+    ],
+    "Крупы и злаки": [
+        "рис", "гречк", "гречн", "овсян", "овес", "хлопь", "пшен", "булгур",
+        "киноа", "кускус", "перлов", "ячнев", "манн", "круп", "макарон", "спагетти",
+        "паста", "лапш", "вермишел", "мук", "хлеб", "батон", "лаваш", "тортиль",
+        "хлебц", "отруб", "гранол", "мюсли", "чечевиц", "нут", "фасол", "горох",
+        "маш", "полб", "амарант", "крахмал", "сухар", "панировоч",
+    ],
+    "Масла и соусы": [
+        "масл", "соус", "майонез", "кетчуп", "горчиц", "уксус", "песто", "тахини",
+        "соев", "терияки", "ткемали", "аджик", "хрен", "паста томатн", "томатная паста",
+        "оливковое масло", "масло оливков", "растительн", "подсолнечн", "льняное масло",
+        "кокосовое масло", "кунжутное масло",
+    ],
+    "Специи и приправы": [
+        "соль", "перец", "паприк", "куркум", "карри", "корица", "кориц", "ванил",
+        "мускат", "гвоздик", "лавров", "орегано", "тимьян", "розмарин", "прованск",
+        "хмели", "зира", "кумин", "кардамон", "специ", "приправ", "сушен",
+        "бульонн", "семена", "кунжут", "чиа", "льнян",
+    ],
+    "Прочее": [
+        "сахар", "мед", "сироп", "какао", "шоколад", "орех", "миндал",
+        "фундук", "кешью", "арахис", "фисташ", "грецк", "кедров", "разрыхлит",
+        "сода", "дрожж", "желатин", "вода", "бульон", "тофу", "хумус", "варень",
+        "джем", "протеин", "кофе", "чай", "вино",
+    ],
+}
+
+# Синонимы, которые должны сливаться в одну строку списка
+NAME_SYNONYMS = {
+    "томат": "помидор",
+    "томаты": "помидоры",
+    "филе куриное": "куриная грудка",
+    "куриное филе": "куриная грудка",
+    "филе курицы": "куриная грудка",
+    "яйцо куриное": "яйца",
+    "куриное яйцо": "яйца",
+    "яйца куриные": "яйца",
+    "репчатый лук": "лук",
+    "лук репчатый": "лук",
+    "картофель молодой": "картофель",
+    "оливковое масло extra virgin": "оливковое масло",
+    "масло оливковое": "оливковое масло",
+    "масло растительное": "растительное масло",
+    "масло подсолнечное": "растительное масло",
+    "подсолнечное масло": "растительное масло",
+    "масло сливочное": "сливочное масло",
+}
+
+_STOP_WORDS = {"свежий", "свежая", "свежее", "свежие", "свежих", "охлажденный",
+               "охлажденная", "замороженный", "замороженная", "замороженные",
+               "крупный", "крупная", "мелкий", "мелкая", "средний", "средняя"}
+
+# Приведение единиц: (каноническая единица, множитель)
+UNIT_ALIASES = {
+    "г": ("г", 1), "гр": ("г", 1), "грамм": ("г", 1), "граммов": ("г", 1), "g": ("г", 1),
+    "кг": ("г", 1000), "kg": ("г", 1000),
+    "мл": ("мл", 1), "ml": ("мл", 1),
+    "л": ("мл", 1000), "литр": ("мл", 1000), "l": ("мл", 1000),
+    "стакан": ("мл", 250), "стакана": ("мл", 250),
+    "шт": ("шт", 1), "штука": ("шт", 1), "штуки": ("шт", 1), "штук": ("шт", 1), "pcs": ("шт", 1),
+    "ч.л": ("ч.л.", 1), "чл": ("ч.л.", 1), "чайная ложка": ("ч.л.", 1), "чайные ложки": ("ч.л.", 1),
+    "ст.л": ("ч.л.", 3), "стл": ("ч.л.", 3), "столовая ложка": ("ч.л.", 3),
+    "столовые ложки": ("ч.л.", 3), "столовых ложки": ("ч.л.", 3),
+}
+
+# Выученные у ИИ категории для названий, которых нет в словаре
+_learned_categories = {}
+
+
+def normalize_unit(unit) -> tuple:
+    raw = str(unit or "").strip().lower().replace("ё", "е")
+    key = raw.rstrip(".").replace(". ", ".").replace(" .", ".")
+    if key in UNIT_ALIASES:
+        return UNIT_ALIASES[key]
+    compact = key.replace(" ", "")
+    if compact in UNIT_ALIASES:
+        return UNIT_ALIASES[compact]
+    return raw or "", 1
+
+
+def _parse_amount(amount):
+    if isinstance(amount, (int, float)):
+        return float(amount)
+    match = re.search(r"\d+(?:[.,]\d+)?", str(amount or ""))
+    return float(match.group().replace(",", ".")) if match else None
+
+
+def _stem(word: str) -> str:
+    if len(word) > 5:
+        return word[:5]
+    return word.rstrip("аяыиоуеьй") or word
+
+
+def normalize_name(name: str) -> str:
+    text = str(name or "").lower().replace("ё", "е")
+    text = re.sub(r"\(.*?\)", " ", text)
+    text = re.sub(r"[^\w\s-]", " ", text)
+    text = " ".join(text.split())
+    text = NAME_SYNONYMS.get(text, text)
+    words = [w for w in text.split() if w not in _STOP_WORDS]
+    return " ".join(sorted(_stem(w) for w in words)) or text
+
+
+def classify(name: str):
+    """Категория по словарю или None, если ни одно ключевое слово не подошло."""
+    text = " " + " ".join(str(name).lower().replace("ё", "е").split()) + " "
+    key = normalize_name(name)
+    if key in _learned_categories:
+        return _learned_categories[key]
+    best, best_len = None, 0
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        for kw in keywords:
+            if len(kw) > best_len and (" " + kw) in text:
+                best, best_len = category, len(kw)
+    return best
+
+
+def learn_categories(mapping: dict):
+    for name, category in mapping.items():
+        if category in CATEGORIES:
+            _learned_categories[normalize_name(name)] = category
+
+
+def _format_amount(value: float, unit: str) -> tuple:
+    if unit == "г" and value >= 1000:
+        value, unit = value / 1000, "кг"
+    elif unit == "мл" and value >= 1000:
+        value, unit = value / 1000, "л"
+    elif unit == "ч.л." and value >= 3 and value % 3 == 0:
+        value, unit = value / 3, "ст.л."
+    value = round(value, 2)
+    return (int(value) if value == int(value) else value), unit
+
+
+def aggregate_ingredients(menu_data: dict) -> list:
+    """Проходит days → meals → dishes → ingredients и суммирует одинаковые продукты.
+
+    Возвращает строки вида {"name", "total_amount", "unit"} в порядке появления.
+    """
+    totals = {}
+    for day in menu_data.get("days", []):
+        for meal in day.get("meals", []):
+            for dish in meal.get("dishes", []):
+                for ing in dish.get("ingredients") or []:
+                    name = str(ing.get("name", "")).strip()
+                    if not name:
+                        continue
+                    unit, factor = normalize_unit(ing.get("unit"))
+                    amount = _parse_amount(ing.get("amount"))
+                    key = (normalize_name(name), unit if amount is not None else None)
+                    row = totals.get(key)
+                    if row is None:
+                        row = totals[key] = {"name": name[:1].upper() + name[1:],
+                                             "amount": None, "unit": unit}
+                    if amount is not None:
+                        row["amount"] = (row["amount"] or 0) + amount * factor
+
+    items = []
+    for row in totals.values():
+        if row["amount"] is None:
+            items.append({"name": row["name"], "total_amount": "",
+                          "unit": row["unit"] or "по вкусу"})
+        else:
+            amount, unit = _format_amount(row["amount"], row["unit"])
+            items.append({"name": row["name"], "total_amount": amount, "unit": unit})
+    return items
+
+
+def group_by_category(items: list, overrides: dict = None) -> dict:
+    overrides = overrides or {}
+    grouped = {name: [] for name in CATEGORIES}
+    for item in items:
+        category = overrides.get(item["name"]) or classify(item["name"]) or OTHER
+        grouped.setdefault(category, []).append(item)
+    return {
+        "categories": [
+            {"name": name, "items": sorted(rows, key=lambda r: r["name"])}
+            for name, rows in grouped.items()
+        ],
+        "total_items": len(items),
+    }
+
+
+async def build_shopping_list(menu_data: dict, plan: str = "free") -> dict:
+    """Собирает список покупок локально. ИИ спрашиваем только о продуктах,
+    которые не удалось отнести к категории по словарю."""
+    items = aggregate_ingredients(menu_data)
+    unknown = [item["name"] for item in items if classify(item["name"]) is None]
+    overrides = {}
+    if unknown:
+        try:
+            overrides = await classify_ingredients(unknown, plan)
+            learn_categories(overrides)
+        except Exception as e:
+            logger.warning(f"Ingredient classification fallback failed: {e}")
+    return group_by_category(items, overrides)
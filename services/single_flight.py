@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Fanout:
+    """События общей задачи для всех, кто её ждёт: каждый подписчик получает
+    каждое событие, подключившимся позже сначала повторяются прошедшие."""
+
+    def __init__(self):
+        self._subscribers = []
+        self._history = []
+
+    def emitter(self, name: str):
+        async def emit(*args):
+            self._history.append((name, args))
+            await asyncio.gather(*(self._deliver(s, name, args) for s in list(self._subscribers)))
+
+        return emit
+
+    async def subscribe(self, callbacks: dict):
+        history = list(self._history)
+        self._subscribers.append(callbacks)
+        for name, args in history:
+            await self._deliver(callbacks, name, args)
+
+    def unsubscribe(self, callbacks: dict):
+        if callbacks in self._subscribers:
+            self._subscribers.remove(callbacks)
+
+    @staticmethod
+    async def _deliver(callbacks: dict, name: str, args: tuple):
+        callback = callbacks.get(name)
+        if callback is None:
+            return
+        # Сбой колбэка одного ждущего не должен обрывать общую задачу
+        try:
+            await callback(*args)
+        except Exception as e:
+            logger.warning(f"Coalesced {name} callback failed: {e}")
+
+
+class SingleFlight:
+    """Одинаковые запросы, пришедшие одновременно, выполняются один раз:
+    остальные вызывающие ждут тот же результат (или ту же ошибку).
+
+    Работа идёт в отдельной задаче, поэтому отмена одного из ждущих
+    не обрывает запрос для остальных; задача отменяется, только когда
+    ждать её больше некому.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> [task, число ждущих, Fanout]
+        self.stats = {}
+
+    def _count(self, kind: str, field: str):
+        stats = self.stats.setdefault(kind, {"calls": 0, "coalesced": 0})
+        stats[field] += 1
+
+    async def do(self, kind: str, key: str, factory, events: dict = None):
+        """events — колбэки этого вызывающего ({имя: функция}). С ними factory
+        вызывается как factory(fanout) и шлёт события через fanout.emitter(имя),
+        а получают их все ждущие, а не только первый."""
+        self._count(kind, "calls")
+        entry = self._inflight.get((kind, key))
+        if entry is not None:
+            self._count(kind, "coalesced")
+        else:
+            fanout = Fanout()
+            task = asyncio.create_task(factory(fanout) if events is not None else factory())
+            entry = [task, 0, fanout]
+            self._inflight[(kind, key)] = entry
+            task.add_done_callback(lambda _: self._forget(kind, key, task))
+
+        task, _, fanout = entry
+        entry[1] += 1
+        try:
+            if events is not None:
+                await fanout.subscribe(events)
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and entry[1] == 1:
+                task.cancel()
+            raise
+        finally:
+            entry[1] -= 1
+            if events is not None:
+                fanout.unsubscribe(events)
+
+    def _forget(self, kind: str, key: str, task):
+        entry = self._inflight.get((kind, key))
+        if entry is not None and entry[0] is task:
+            del self._inflight[(kind, key)]
+        # Ошибку забирают ждущие; если их не осталось — не шумим в лог asyncio
+        if not task.cancelled():
+            task.exception()
+
+    def snapshot(self) -> dict:
+        return {
+            kind: {**s, "rate": round(s["coalesced"] / s["calls"], 3) if s["calls"] else 0.0}
+            for kind, s in self.stats.items()
+        }
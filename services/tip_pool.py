@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import logging
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
+from database.db import AsyncSessionLocal, NutritionTip, TipView, _dialect_insert
+from services.groq_service import (
+    generate_nutrition_tip, generate_nutrition_tips, rate_limit_pressure
+)
+from config import (
+    TIP_POOL_MIN, TIP_POOL_MAX, TIP_POOL_LOW,
+    TIP_BATCH_SIZE, TIP_REFILL_MAX_PRESSURE,
+)
+
+logger = logging.getLogger(__name__)
+
+TIP_REFILL_INTERVAL = 300  # сек между плановыми проверками пула
+
+_refill_event = asyncio.Event()
+_refill_task = None
+_stats = {"served": 0, "live": 0, "generated": 0}
+
+
+def _tip_hash(text: str) -> str:
+    normalized = " ".join(text.lower().replace("ё", "е").split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+async def _store_tips(tips: list) -> list:
+    """Сохраняет новые советы, пропуская дубликаты. Возвращает id всех переданных советов
+    (новых и уже бывших в пуле) в исходном порядке."""
+    by_hash = {}
+    for text in tips:
+        by_hash.setdefault(_tip_hash(text), text)
+    if not by_hash:
+        return []
+    async with AsyncSessionLocal() as session:
+        # Одним запросом: дубликат (в том числе вставленный параллельно другим процессом)
+        # просто пропускается и не откатывает остальные советы пачки
+        insert = _dialect_insert(session)
+        await session.execute(
+            insert(NutritionTip)
+            .values([{"text": text, "text_hash": h} for h, text in by_hash.items()])
+            .on_conflict_do_nothing(index_elements=["text_hash"])
+        )
+        ids = dict((await session.execute(
+            select(NutritionTip.text_hash, NutritionTip.id).where(NutritionTip.text_hash.in_(by_hash))
+        )).all())
+        await session.commit()
+    return [ids[h] for h in by_hash if h in ids]
+
+
+def request_refill():
+    _refill_event.set()
+
+
+async def pop_tip(telegram_id: int, plan: str = "free") -> str:
+    """Отдаёт случайный совет, который пользователь ещё не видел."""
+    async with AsyncSessionLocal() as session:
+        seen = select(TipView.tip_id).where(TipView.telegram_id == telegram_id)
+        unseen = select(NutritionTip).where(NutritionTip.id.not_in(seen))
+        left = await session.scalar(select(func.count()).select_from(unseen.subquery()))
+        tip = (await session.execute(unseen.order_by(func.random()).limit(1))).scalar_one_or_none()
+        if left - 1 < TIP_POOL_LOW:
+            request_refill()
+        if tip:
+            session.add(TipView(telegram_id=telegram_id, tip_id=tip.id))
+            await session.commit()
+            _stats["served"] += 1
+            return tip.text
+
+    # Пользователь прочитал весь пул — отвечаем живым запросом и пополняем пул им же
+    text = await generate_nutrition_tip(plan)
+    _stats["live"] += 1
+    ids = await _store_tips([text])
+    if ids:
+        async with AsyncSessionLocal() as session:
+            session.add(TipView(telegram_id=telegram_id, tip_id=ids[0]))
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+    return text
+
+
+async def _wait_for_capacity():
+    while rate_limit_pressure() > TIP_REFILL_MAX_PRESSURE:
+        await asyncio.sleep(5)
+
+
+async def _refill(requested: bool):
+    async with AsyncSessionLocal() as session:
+        total = await session.scalar(select(func.count(NutritionTip.id)))
+    if total >= TIP_POOL_MAX or (total >= TIP_POOL_MIN and not requested):
+        return
+
+    batches = max(1, -(-(TIP_POOL_MIN - total) // TIP_BATCH_SIZE))
+    for _ in range(batches):
+        await _wait_for_capacity()
+        tips = await generate_nutrition_tips(TIP_BATCH_SIZE)
+        ids = await _store_tips(tips)
+        _stats["generated"] += len(ids)
+        logger.info(f"Tip pool refilled: +{len(ids)} (was {total})")
+        total += len(ids)
+
+
+async def _refill_loop():
+    while True:
+        requested = _refill_event.is_set()
+        _refill_event.clear()
+        try:
+            await _refill(requested)
+        except Exception as e:
+            logger.warning(f"Tip pool refill failed: {e}")
+        try:
+            await asyncio.wait_for(_refill_event.wait(), timeout=TIP_REFILL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_tip_refiller():
+    global _refill_task
+    if _refill_task is None or _refill_task.done():
+        _refill_task = asyncio.create_task(_refill_loop())
+
+
+async def stop_tip_refiller():
+    global _refill_task
+    if _refill_task is not None:
+        _refill_task.cancel()
+        try:
+            await _refill_task
+        except asyncio.CancelledError:
+            pass
+        _refill_task = None
+
+
+def tip_pool_stats() -> dict:
+    return dict(_stats)
@@ -0,0 +1,280 @@
+"""Супервизор: WORKERS процессов-обработчиков, апдейты раскладываются по пользователю.
+
+Telegram → супервизор (webhook или polling) → обработчик telegram_id % WORKERS.
+Все апдейты одного пользователя попадают в один процесс и передаются ему по
+порядку, поэтому его FSM-состояние и кэш плана живут там же. CPU-работа
+(PDF, разбор больших меню) стопорит только свой процесс.
+
+Упавший обработчик перезапускается; апдейты для него ждут в очереди.
+Метрики по обработчикам — GET /health супервизора.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import sys
+import time
+import aiohttp
+from aiohttp import web
+from aiogram import Bot
+from config import (
+    BOT_TOKEN, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_DRAIN_TIMEOUT,
+    WORKERS, WORKER_BASE_PORT, WORKER_QUEUE_SIZE, WORKER_RESTART_MAX_DELAY,
+    GROQ_RPM, GROQ_TPM, DB_POOL_SIZE, DB_MAX_OVERFLOW, MENU_JOB_CONCURRENCY,
+)
+from database.db import init_db
+from main import build_dispatcher, set_webhook, wait_for_stop_signal, webhook_secret
+
+logger = logging.getLogger(__name__)
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+FORWARD_RETRY_SECONDS = 60   # сколько ждать обработчик (например, перезапуск), прежде чем бросить апдейт
+STABLE_UPTIME = 60           # прожил дольше — паузу перед перезапуском сбрасываем
+TELEGRAM_API = "https://api.telegram.org"
+
+
+def update_shard_key(update: dict):
+    """telegram id автора апдейта (или чата, если автора нет)."""
+    for key, payload in update.items():
+        if key == "update_id" or not isinstance(payload, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            value = payload.get(field)
+            if isinstance(value, dict) and "id" in value:
+                return value["id"]
+    return None
+
+
+class Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.port = WORKER_BASE_PORT + index
+        self.url = f"http://127.0.0.1:{self.port}{WEBHOOK_PATH}"
+        self.queue = asyncio.Queue(maxsize=WORKER_QUEUE_SIZE)
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.forwarded = 0
+        self.dropped = 0
+
+    def env(self) -> dict:
+        env = dict(os.environ, WORKER_INDEX=str(self.index))
+        # Лимиты Groq, пул БД и очередь генерации меню — общие на всех, каждому процессу достаётся своя доля
+        env["GROQ_RPM"] = str(max(1, GROQ_RPM // WORKERS))
+        env["GROQ_TPM"] = str(max(1, GROQ_TPM // WORKERS))
+        env["DB_POOL_SIZE"] = str(max(2, DB_POOL_SIZE // WORKERS))
+        env["DB_MAX_OVERFLOW"] = str(max(0, DB_MAX_OVERFLOW // WORKERS))
+        env["MENU_JOB_CONCURRENCY"] = str(max(1, MENU_JOB_CONCURRENCY // WORKERS))
+        return env
+
+    async def spawn(self):
+        self.process = await asyncio.create_subprocess_exec(sys.executable, MAIN_PATH, env=self.env())
+        self.started_at = time.monotonic()
+        logger.info(f"Worker {self.index} spawned, pid {self.process.pid}, port {self.port}")
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def snapshot(self) -> dict:
+        return {
+            "index": self.index,
+            "pid": self.process.pid if self.process else None,
+            "alive": self.alive,
+            "uptime_s": round(time.monotonic() - self.started_at) if self.alive else 0,
+            "restarts": self.restarts,
+            "queued": self.queue.qsize(),
+            "forwarded": self.forwarded,
+            "dropped": self.dropped,
+        }
+
+
+class Supervisor:
+    def __init__(self):
+        self.workers = [Worker(i) for i in range(WORKERS)]
+        self.stopping = asyncio.Event()
+        self.http = None
+        self.tasks = []
+
+    def worker_for(self, update: dict) -> Worker:
+        key = update_shard_key(update)
+        if key is None:
+            key = update.get("update_id", 0)
+        return self.workers[key % len(self.workers)]
+
+    async def keep_alive(self, worker: Worker):
+        delay = 1.0
+        while not self.stopping.is_set():
+            await worker.spawn()
+            code = await worker.process.wait()
+            if self.stopping.is_set():
+                return
+            uptime = time.monotonic() - worker.started_at
+            worker.restarts += 1
+            delay = 1.0 if uptime > STABLE_UPTIME else min(delay * 2, WORKER_RESTART_MAX_DELAY)
+            logger.error(
+                f"Worker {worker.index} (pid {worker.process.pid}) exited with code {code} "
+                f"after {uptime:.0f}s, restarting in {delay:.0f}s"
+            )
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def forward(self, worker: Worker):
+        # Один отправитель на обработчик — апдейты уходят строго в порядке поступления
+        headers = {"X-Telegram-Bot-Api-Secret-Token": webhook_secret()}
+        timeout = aiohttp.ClientTimeout(total=10)
+        while True:
+            update = await worker.queue.get()
+            deadline = time.monotonic() + FORWARD_RETRY_SECONDS
+            while True:
+                try:
+                    async with self.http.post(worker.url, json=update, headers=headers, timeout=timeout) as resp:
+                        if resp.status == 200:
+                            worker.forwarded += 1
+                            break
+                        error = f"HTTP {resp.status}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+                if time.monotonic() > deadline:
+                    worker.dropped += 1
+                    logger.warning(f"Update {update.get('update_id')} dropped, worker {worker.index}: {error}")
+                    break
+                await asyncio.sleep(0.2)
+            worker.queue.task_done()
+
+    async def worker_stats(self, worker: Worker) -> dict:
+        stats = worker.snapshot()
+        if worker.alive:
+            try:
+                url = f"http://127.0.0.1:{worker.port}/health"
+                async with self.http.get(url, timeout=aiohttp.ClientTimeout(total=1)) as resp:
+                    body = await resp.json()
+                stats.update(in_flight=body.get("in_flight"), loop_lag_max_ms=body.get("loop_lag_max_ms"),
+                             llm_pool=body.get("llm_pool"))
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                stats["in_flight"] = None
+        return stats
+
+    async def health(self, request: web.Request) -> web.Response:
+        workers = await asyncio.gather(*(self.worker_stats(w) for w in self.workers))
+        draining = self.stopping.is_set()
+        ok = not draining and all(w["alive"] for w in workers)
+        return web.json_response({
+            "status": "draining" if draining else ("ok" if ok else "degraded"),
+            "mode": BOT_MODE,
+            "workers": workers,
+        }, status=200 if not draining else 503)
+
+    async def receive_webhook(self, request: web.Request) -> web.Response:
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(token, webhook_secret()):
+            return web.Response(status=401)
+        if self.stopping.is_set():
+            return web.Response(status=503)
+        update = await request.json()
+        try:
+            self.worker_for(update).queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            return web.Response(status=503)
+        return web.Response(status=200)
+
+    async def poll(self, allowed_updates: list):
+        # Сырые апдейты без разбора в объекты aiogram — их всё равно пересылать дальше
+        url = f"{TELEGRAM_API}/bot{BOT_TOKEN}/getUpdates"
+        offset = None
+        while not self.stopping.is_set():
+            params = {"timeout": 25, "allowed_updates": allowed_updates}
+            if offset is not None:
+                params["offset"] = offset
+            try:
+                async with self.http.post(url, json=params, timeout=aiohttp.ClientTimeout(total=40)) as resp:
+                    body = await resp.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning(f"getUpdates failed: {e!r}")
+                await asyncio.sleep(2)
+                continue
+            if not body.get("ok"):
+                logger.warning(f"getUpdates error: {body.get('description')}")
+                await asyncio.sleep(2)
+                continue
+            for update in body["result"]:
+                offset = update["update_id"] + 1
+                await self.worker_for(update).queue.put(update)
+
+    async def run(self):
+        await init_db()
+        allowed_updates = build_dispatcher().resolve_used_update_types()
+        bot = Bot(token=BOT_TOKEN)
+        self.http = aiohttp.ClientSession()
+
+        for worker in self.workers:
+            self.tasks.append(asyncio.create_task(self.keep_alive(worker)))
+            self.tasks.append(asyncio.create_task(self.forward(worker)))
+
+        app = web.Application()
+        app.router.add_get("/health", self.health)
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("BOT_MODE=webhook требует WEBHOOK_URL")
+            app.router.add_post(WEBHOOK_PATH, self.receive_webhook)
+        runner = web.AppRunner(app, handle_signals=False)
+        await runner.setup()
+        site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+        await site.start()
+
+        if BOT_MODE == "webhook":
+            await set_webhook(bot, allowed_updates)
+            intake = None
+        else:
+            # getUpdates не работает, пока у бота установлен webhook
+            await bot.delete_webhook(drop_pending_updates=False)
+            intake = asyncio.create_task(self.poll(allowed_updates))
+        await bot.session.close()
+        logger.info(f"Supervisor started: {WORKERS} workers, mode {BOT_MODE}, health on {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+
+        try:
+            await wait_for_stop_signal()
+        finally:
+            await self.shutdown(intake, runner)
+
+    async def shutdown(self, intake, runner):
+        self.stopping.set()
+        if intake is not None:
+            intake.cancel()
+            await asyncio.gather(intake, return_exceptions=True)
+
+        # Сначала отдаём обработчикам всё, что уже принято, потом останавливаем их
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(w.queue.join() for w in self.workers)), timeout=WEBHOOK_DRAIN_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"{sum(w.queue.qsize() for w in self.workers)} queued updates not forwarded")
+
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.send_signal(signal.SIGTERM)
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                await asyncio.wait_for(worker.process.wait(), timeout=WEBHOOK_DRAIN_TIMEOUT + 5)
+            except asyncio.TimeoutError:
+                logger.warning(f"Worker {worker.index} did not stop in time, killing")
+                worker.process.kill()
+                await worker.process.wait()
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await runner.cleanup()
+        await self.http.close()
+        logger.info("Supervisor stopped")
+
+
+async def run_supervisor():
+    await Supervisor().run()